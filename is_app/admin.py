@@ -1,7 +1,31 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.utils.functional import cached_property
 
 # Register your models here.
-from .models import Language, Word, WordVideo
+from . import search
+from .models import (
+    Analysis, AnalysisAggregate, BacklogEntry, Language, Word, WordVideo
+)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Unfiltered changelists count from the table statistics,
+    filtered ones stop counting at MAX_COUNT
+    """
+    MAX_COUNT = 10000
+
+    @cached_property
+    def count(self):
+        if not self.object_list.query.where:
+            return search.estimated_count(self.object_list.model)
+        return self.object_list[:self.MAX_COUNT].count()
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 @admin.register(Language)
@@ -10,10 +34,50 @@ class LanguageAdmin(admin.ModelAdmin):
 
 
 @admin.register(Word)
-class WordAdmin(admin.ModelAdmin):
-    pass
+class WordAdmin(LargeTableAdmin):
+    list_display = ('word', 'language', 'relevance', 'count_char')
+    list_filter = ('language',)
+    list_select_related = ('language',)
+    # total thanks to the unique constraint, follows the word indexes
+    ordering = ('word', 'language')
+    # searched by prefix, see get_search_results
+    search_fields = ('word',)
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Prefix search on the word index, for the changelist and the
+        autocomplete widgets
+        """
+        return search.prefix_filter(queryset, search_term), False
 
 
 @admin.register(WordVideo)
-class WordVideoAdmin(admin.ModelAdmin):
-    pass
+class WordVideoAdmin(LargeTableAdmin):
+    list_display = ('word', 'title', 'link_code')
+    list_select_related = ('word',)
+    autocomplete_fields = ('word',)
+
+
+@admin.register(BacklogEntry)
+class BacklogEntryAdmin(LargeTableAdmin):
+    list_display = ('word', 'language', 'relevance', 'claimed_by')
+    raw_id_fields = ('word',)
+
+
+@admin.register(Analysis)
+class AnalysisAdmin(LargeTableAdmin):
+    list_display = (
+        'filename', 'language', 'voice', 'duration', 'min_note',
+        'max_note', 'pitch_range', 'voiced_ratio'
+    )
+    list_filter = ('language', 'voice')
+    list_select_related = ('language',)
+    raw_id_fields = ('word',)
+
+
+@admin.register(AnalysisAggregate)
+class AnalysisAggregateAdmin(admin.ModelAdmin):
+    list_display = (
+        'language', 'voice', 'analyses', 'mean_duration',
+        'mean_pitch_range', 'mean_voiced_ratio', 'min_midi', 'max_midi'
+    )
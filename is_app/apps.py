@@ -1,5 +1,10 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class IsAppConfig(AppConfig):
     name = 'is_app'
+
+    def ready(self):
+        from .db import configure_sqlite
+        connection_created.connect(configure_sqlite)
@@ -0,0 +1,167 @@
+"""
+Catalogue of the pitch analyses.
+Every analysis made by the AudioAnalyst is stored once per file with its
+summary, the totals per language and voice are updated in the same
+transaction so that corpus-wide figures are read from one row instead
+of being computed over every analysis.
+"""
+import numpy as np
+from django.db import transaction
+from django.db.models import Count, F, Max, Min, Q, Sum, Value
+from django.db.models.functions import Coalesce, Greatest, Least
+
+from utils import NoteTools
+
+from .models import Analysis, AnalysisAggregate
+
+
+# aubio pitch units convertible to MIDI, cents and bins are not
+HZ_UNITS = ('Hz', 'hertz', 'Hertz', 'freq', 'default')
+
+
+def to_midi(pitches, unit):
+    """
+    MIDI numbers of the pitches, with the conventions of the workers
+    """
+    if unit == 'midi':
+        return pitches
+    if unit not in HZ_UNITS:
+        raise ValueError(f'Unsupported pitch unit {unit!r}')
+    return NoteTools.freqs_to_midi(pitches)
+
+
+def summary(analysis):
+    """
+    Catalogue columns of a PitchAnalysis
+    """
+    samples = np.asarray(analysis.samples, dtype=float)
+    voiced = (samples != analysis.no_value) & (samples != 0.0)
+    pitches = to_midi(samples[voiced], analysis.unit)
+    contour = np.full(samples.size, np.nan, dtype='<f2')
+    contour[voiced] = pitches
+    columns = {
+        'title': analysis.title,
+        'filename': analysis.filename,
+        'duration': samples.size * analysis.hop / analysis.samplerate,
+        'frames': samples.size,
+        'min_midi': None,
+        'max_midi': None,
+        'min_note': None,
+        'max_note': None,
+        'pitch_range': 0.0,
+        'voiced_ratio': float(voiced.mean()) if samples.size else 0.0,
+        'unit': analysis.unit,
+        'samplerate': analysis.samplerate,
+        'hop': analysis.hop,
+        'tolerance': analysis.tolerance,
+        'silence': analysis.silence,
+        'contour': contour.tobytes(),
+    }
+    if pitches.size:
+        columns.update({
+            'min_midi': float(pitches.min()),
+            'max_midi': float(pitches.max()),
+            'min_note': analysis.min_note,
+            'max_note': analysis.max_note,
+            'pitch_range': float(pitches.max() - pitches.min()),
+        })
+    return columns
+
+
+def contour(entry):
+    """
+    MIDI pitches of a catalogue entry, NaN where unvoiced
+    """
+    return np.frombuffer(bytes(entry.contour), dtype='<f2').astype(float)
+
+
+def update_aggregate(entry, sign):
+    """
+    Add (sign 1) or take away (sign -1) an entry from its totals
+    """
+    aggregate = AnalysisAggregate.objects.get_or_create(
+        language_id=entry.language_id, voice=entry.voice
+    )[0]
+    voiced = entry.min_midi is not None
+    changes = {
+        'analyses': F('analyses') + sign,
+        'voiced_analyses': F('voiced_analyses') + sign * voiced,
+        'total_duration': F('total_duration') + sign * entry.duration,
+        'total_pitch_range':
+            F('total_pitch_range') + sign * entry.pitch_range,
+        'total_voiced_ratio':
+            F('total_voiced_ratio') + sign * entry.voiced_ratio,
+    }
+    if sign > 0 and voiced:
+        # LEAST and GREATEST are NULL with a NULL argument on SQLite
+        changes['min_midi'] = Coalesce(
+            Least('min_midi', Value(entry.min_midi)), Value(entry.min_midi)
+        )
+        changes['max_midi'] = Coalesce(
+            Greatest('max_midi', Value(entry.max_midi)), Value(entry.max_midi)
+        )
+    AnalysisAggregate.objects.filter(id=aggregate.id).update(**changes)
+
+
+def update_extremes(language_id, voice):
+    """
+    Lowest and highest pitch of a language and voice, from the entries
+    """
+    AnalysisAggregate.objects.filter(
+        language_id=language_id, voice=voice
+    ).update(**Analysis.objects.filter(
+        language_id=language_id, voice=voice
+    ).aggregate(min_midi=Min('min_midi'), max_midi=Max('max_midi')))
+
+
+def record(analysis, language, voice='', word=None):
+    """
+    Store a PitchAnalysis, replacing the entry of the same file
+    """
+    columns = summary(analysis)
+    with transaction.atomic():
+        entry = Analysis.objects.select_for_update().filter(
+            filename=columns['filename']
+        ).first()
+        if entry is None:
+            entry = Analysis.objects.create(
+                language=language, voice=voice, word=word, **columns
+            )
+        else:
+            update_aggregate(entry, -1)
+            replaced = (entry.language_id, entry.voice)
+            for name, value in columns.items():
+                setattr(entry, name, value)
+            entry.language, entry.voice, entry.word = language, voice, word
+            entry.save()
+            update_extremes(*replaced)
+        update_aggregate(entry, 1)
+    return entry
+
+
+def remove(entry):
+    with transaction.atomic():
+        update_aggregate(entry, -1)
+        entry.delete()
+        update_extremes(entry.language_id, entry.voice)
+
+
+def rebuild_aggregates():
+    """
+    Recompute every total from the entries
+    """
+    groups = Analysis.objects.values('language_id', 'voice').annotate(
+        analyses=Count('id'),
+        voiced_analyses=Count('id', filter=Q(min_midi__isnull=False)),
+        total_duration=Sum('duration'),
+        total_pitch_range=Sum('pitch_range'),
+        total_voiced_ratio=Sum('voiced_ratio'),
+        min_midi=Min('min_midi'),
+        max_midi=Max('max_midi'),
+    ).order_by()
+    with transaction.atomic():
+        AnalysisAggregate.objects.all().delete()
+        AnalysisAggregate.objects.bulk_create(
+            [AnalysisAggregate(**group) for group in groups]
+        )
+    return len(groups)
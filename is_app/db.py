@@ -0,0 +1,110 @@
+"""
+Database access shared by many worker processes.
+SQLite connections get settings.SQLITE_PRAGMAS when they open, other
+databases are left as they are. Frequent small updates, like the
+status of the words being rendered, go through a write-behind buffer
+and reach the database in a few batched statements.
+"""
+import atexit
+import threading
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """
+    connection_created receiver
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+class WriteBehindBuffer:
+    """
+    Buffered updates of the rows of a model, the last value of a field
+    wins. Rows updated with the same values share one UPDATE. Updates
+    are written every max_items rows, at the latest max_delay seconds
+    after the first one, by flush and when the process exits.
+    """
+    MAX_ITEMS = 500
+    MAX_DELAY = 1.0
+    BATCH_SIZE = 500
+
+    def __init__(
+        self,
+        model,
+        key='pk',
+        stamp=None,
+        max_items=MAX_ITEMS,
+        max_delay=MAX_DELAY
+    ):
+        """
+        key is the field finding the rows,
+        stamp a datetime field set to the time of the flush
+        """
+        self.model = model
+        self.key = key
+        self.stamp = stamp
+        self.max_items = max_items
+        self.max_delay = max_delay
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.timer = None
+        atexit.register(self.flush)
+
+    def __len__(self):
+        return len(self.pending)
+
+    def update(self, key, **values):
+        with self.lock:
+            if not self.pending:
+                self.timer = threading.Timer(
+                    self.max_delay, self.flush_in_timer
+                )
+                self.timer.daemon = True
+                self.timer.start()
+            self.pending.setdefault(key, {}).update(values)
+            due = len(self.pending) >= self.max_items
+        if due:
+            self.flush()
+
+    def flush_in_timer(self):
+        try:
+            self.flush()
+        finally:
+            # the connections of the timer thread
+            connections.close_all()
+
+    def discard(self, key):
+        with self.lock:
+            self.pending.pop(key, None)
+
+    def flush(self):
+        """
+        Write the pending updates in one transaction,
+        return the number of rows updated
+        """
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        if not pending:
+            return 0
+        groups = {}
+        for key, values in pending.items():
+            groups.setdefault(tuple(sorted(values.items())), []).append(key)
+        stamp = {self.stamp: timezone.now()} if self.stamp else {}
+        updated = 0
+        with transaction.atomic():
+            for values, keys in groups.items():
+                for start in range(0, len(keys), self.BATCH_SIZE):
+                    updated += self.model.objects.filter(**{
+                        f'{self.key}__in': keys[start:start + self.BATCH_SIZE]
+                    }).update(**dict(values), **stamp)
+        return updated
@@ -0,0 +1,101 @@
+import statistics
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from is_app import planner
+from is_app.models import BacklogEntry, Language
+
+
+class Command(BaseCommand):
+    help = 'Time the planner on the imported words'
+    """
+    Run after import_words on every language of the corpus.
+    Claims are released at the end, the backlog is left as it was.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--n', type=int, default=50)
+        parser.add_argument('--rounds', type=int, default=100)
+        parser.add_argument('--workers', type=int, default=4)
+
+    @staticmethod
+    def timed(function, *args):
+        started = time.perf_counter()
+        result = function(*args)
+        return result, time.perf_counter() - started
+
+    def report(self, name, timings):
+        timings = sorted(timings)
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        self.stdout.write(
+            f'{name}: median {statistics.median(timings) * 1000:.2f}ms, '
+            f'p99 {p99 * 1000:.2f}ms'
+        )
+
+    def claim_concurrently(self, language, n, rounds, workers):
+        """
+        Claims of many threads, each with its own connection
+        """
+        claimed = []
+        lock = threading.Lock()
+
+        def work(worker):
+            try:
+                for _ in range(rounds):
+                    words = planner.claim(language, n, f'bench{worker}')
+                    with lock:
+                        claimed.extend(word.id for word in words)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=work, args=(worker,))
+            for worker in range(workers)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return claimed, time.perf_counter() - started
+
+    def handle(self, *args, **options):
+        n, rounds = options['n'], options['rounds']
+        _, refreshed = self.timed(planner.refresh)
+        self.stdout.write(f'backlog refreshed in {refreshed:.2f}s')
+        languages = list(Language.objects.all())
+        if not BacklogEntry.objects.exists():
+            raise CommandError('Empty backlog, import the words first')
+        self.stdout.write(
+            f'{BacklogEntry.objects.count()} words in the backlog, '
+            f'{len(languages)} languages'
+        )
+        peeks, claims = [], []
+        try:
+            for _ in range(rounds):
+                for language in languages:
+                    peeks.append(
+                        self.timed(planner.next_words, language, n)[1]
+                    )
+                    claims.append(
+                        self.timed(planner.claim, language, n, 'bench')[1]
+                    )
+            self.report(f'next {n}', peeks)
+            self.report(f'claim {n}', claims)
+            claimed, elapsed = self.claim_concurrently(
+                languages[0], n, rounds, options['workers']
+            )
+            duplicates = len(claimed) - len(set(claimed))
+            self.stdout.write(
+                f'{options["workers"]} workers claimed {len(claimed)} words '
+                f'in {elapsed:.2f}s, {duplicates} claimed twice'
+            )
+            if duplicates:
+                raise CommandError('Words claimed by more than one worker')
+        finally:
+            BacklogEntry.objects.filter(
+                claimed_by__startswith='bench'
+            ).update(claimed_by=None, claimed_at=None)
@@ -1,35 +1,171 @@
+import hashlib
 import os
+import unicodedata
 from django.core.management.base import BaseCommand
-from is_app.models import Word, Language
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from is_app.models import BacklogEntry, CorpusState, Word, Language
+from is_app import planner
+from is_app.views import invalidate_api_cache
 from django.conf import settings
 
 
-class OpenSubtitleCommand(BaseCommand):
+class Command(BaseCommand):
     help = 'Import words from file'
     """
     Built on top of opensutitles.com corpora
     """
     FILENAME_PATTERN = '%s_50k.txt'
+    BATCH_SIZE = 5000
+    VOWELS = set('aeiouy')
 
     def add_arguments(self, parser):
-        parser.add_argument('langs', nargs='+', type=str)
+        parser.add_argument(
+            'langs', nargs='*', type=str,
+            help='every language of the corpora if none'
+        )
+        parser.add_argument(
+            '--sync', action='store_true',
+            help='apply the changes of the word lists since the last sync'
+        )
+
+    @classmethod
+    def count_vowels(cls, word):
+        # accented vowels count as their base letter
+        return sum(
+            char in cls.VOWELS
+            for char in unicodedata.normalize('NFD', word.lower())
+        )
+
+    @classmethod
+    def read_words(cls, lang_file):
+        """
+        Yield (word, relevance), the relevance is the word count
+        """
+        with open(lang_file, encoding='utf8') as fp:
+            for line in fp:
+                word, _, relevance = line.strip().rpartition(' ')
+                if word:
+                    yield word, int(relevance)
+
+    @staticmethod
+    def checksum(lang_file):
+        with open(lang_file, 'rb') as fp:
+            return hashlib.sha256(fp.read()).hexdigest()
+
+    @classmethod
+    def new_word(cls, word, relevance, lang_obj):
+        return Word(
+            word=word,
+            language=lang_obj,
+            relevance=relevance,
+            count_char=len(word),
+            count_vowels=cls.count_vowels(word),
+        )
+
+    def batches(self, items):
+        for start in range(0, len(items), self.BATCH_SIZE):
+            yield items[start:start + self.BATCH_SIZE]
+
+    def import_language(self, lang_obj, lang_file):
+        """
+        Add the words not known yet, return how many
+        """
+        known = set(
+            Word.objects.filter(language=lang_obj)
+            .values_list('word', flat=True)
+        )
+        # bulk_create skips Word.save, rows keep the file order
+        words = [
+            self.new_word(word, relevance, lang_obj)
+            for word, relevance in self.read_words(lang_file)
+            if word not in known
+        ]
+        Word.objects.bulk_create(words, batch_size=self.BATCH_SIZE)
+        return len(words)
+
+    def sync_language(self, lang_obj, lang_file):
+        """
+        Apply the difference between the word list and the stored words,
+        None if the list did not change since the last sync.
+        Words with a video are kept when they leave the list.
+        """
+        checksum = self.checksum(lang_file)
+        state = CorpusState.objects.filter(language=lang_obj).first()
+        if state is not None and state.checksum == checksum:
+            return None
+        corpus = dict(self.read_words(lang_file))
+        stored = {
+            word: (id, relevance)
+            for id, word, relevance in Word.objects.filter(
+                language=lang_obj
+            ).values_list('id', 'word', 'relevance')
+        }
+        inserts = [
+            self.new_word(word, relevance, lang_obj)
+            for word, relevance in corpus.items() if word not in stored
+        ]
+        updates = [
+            Word(id=id, relevance=corpus[word])
+            for word, (id, relevance) in stored.items()
+            if word in corpus and corpus[word] != relevance
+        ]
+        deletes = [
+            id for word, (id, _) in stored.items() if word not in corpus
+        ]
+        with transaction.atomic():
+            Word.objects.bulk_create(inserts, batch_size=self.BATCH_SIZE)
+            Word.objects.bulk_update(
+                updates, ['relevance'], batch_size=self.BATCH_SIZE
+            )
+            for batch in self.batches([word.id for word in updates]):
+                # the backlog keeps a copy of the relevance
+                BacklogEntry.objects.filter(word_id__in=batch).update(
+                    relevance=Subquery(
+                        Word.objects.filter(id=OuterRef('word_id'))
+                        .values('relevance')[:1]
+                    )
+                )
+            deleted = 0
+            for batch in self.batches(deletes):
+                deleted += Word.objects.filter(
+                    id__in=batch, videos__isnull=True
+                ).delete()[1].get(Word._meta.label, 0)
+            CorpusState.objects.update_or_create(
+                language=lang_obj,
+                defaults={'checksum': checksum, 'words': len(corpus)}
+            )
+        return len(inserts), len(updates), deleted
 
     def handle(self, *args, **options):
-        for lang in options['langs']:
-            lang_obj = Language.objects.get_or_create(code=lang)
+        langs = options['langs'] or sorted(
+            lang for lang in os.listdir(settings.OS_WORDS_PATH)
+            if os.path.exists(os.path.join(
+                settings.OS_WORDS_PATH, lang, self.FILENAME_PATTERN % lang
+            ))
+        )
+        changed = 0
+        for lang in langs:
+            lang_obj = Language.objects.get_or_create(code=lang)[0]
             lang_folder = os.path.join(settings.OS_WORDS_PATH, lang)
             lang_file = os.path.join(lang_folder, self.FILENAME_PATTERN % lang)
             if not os.path.exists(lang_file):
+                self.stderr.write(f'No word list for {lang}: {lang_file}')
                 continue
-            with open(lang_file) as fp:
-                line = fp.readline()
-                cnt = 1
-                while line:
-                    word, relevance = line.split(' ')
-                    Word.objects.get_or_create(
-                        word=word,
-                        relevance=relevance,
-                        languge=lang
-                    )
-                    line = fp.readline()
-                    cnt += 1
+            if not options['sync']:
+                imported = self.import_language(lang_obj, lang_file)
+                changed += imported
+                planner.refresh(lang_obj)
+                self.stdout.write(f'{lang}: {imported} words imported')
+                continue
+            diff = self.sync_language(lang_obj, lang_file)
+            if diff is None:
+                self.stdout.write(f'{lang}: unchanged')
+                continue
+            changed += sum(diff)
+            planner.refresh(lang_obj)
+            self.stdout.write(
+                '{}: {} inserted, {} updated, {} deleted'.format(lang, *diff)
+            )
+        if changed:
+            invalidate_api_cache()
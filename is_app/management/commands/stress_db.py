@@ -0,0 +1,93 @@
+import multiprocessing
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from django.db.models import Count
+
+from is_app import planner
+from is_app.models import BacklogEntry, Language, Word, WordVideo
+
+
+def render_words(worker, language_id, batch):
+    """
+    Worker process: claim, report and complete words until none is left,
+    return (completed words, lock errors)
+    """
+    language = Language.objects.get(id=language_id)
+    completed = errors = 0
+    while True:
+        try:
+            words = planner.claim(language, batch, f'stress{worker}')
+        except OperationalError:
+            errors += 1
+            continue
+        if not words:
+            break
+        for word in words:
+            planner.report(word, 'rendering')
+            try:
+                planner.complete(word, title=word.word)
+                completed += 1
+            except OperationalError:
+                errors += 1
+                planner.release([word])
+    planner.status_updates.flush()
+    connection.close()
+    return completed, errors
+
+
+class Command(BaseCommand):
+    help = 'Concurrent writer processes on the database'
+    """
+    Every process claims words of a scratch language, reports their
+    status and records their videos like a render worker would.
+    The scratch language is deleted at the end.
+    """
+    LANGUAGE = 'stress'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=8)
+        parser.add_argument('--words', type=int, default=5000)
+        parser.add_argument('--batch', type=int, default=10)
+
+    def handle(self, *args, **options):
+        if Language.objects.filter(code=self.LANGUAGE).exists():
+            raise CommandError(f'Language {self.LANGUAGE} already exists')
+        language = Language.objects.create(code=self.LANGUAGE)
+        try:
+            Word.objects.bulk_create([
+                Word(word=f'stress{n}', language=language, relevance=n)
+                for n in range(options['words'])
+            ])
+            planner.refresh(language)
+            # forked children open their own connections
+            connection.close()
+            context = multiprocessing.get_context('fork')
+            started = time.perf_counter()
+            with context.Pool(options['processes']) as pool:
+                results = pool.starmap(render_words, [
+                    (worker, language.id, options['batch'])
+                    for worker in range(options['processes'])
+                ])
+            elapsed = time.perf_counter() - started
+            self.report(language, results, elapsed, options)
+        finally:
+            language.delete()
+
+    def report(self, language, results, elapsed, options):
+        completed = sum(result[0] for result in results)
+        errors = sum(result[1] for result in results)
+        videos = WordVideo.objects.filter(word__language=language)
+        twice = videos.values('word').annotate(
+            videos=Count('id')
+        ).filter(videos__gt=1).count()
+        left = BacklogEntry.objects.filter(language=language).count()
+        self.stdout.write(
+            f'{options["processes"]} processes: {completed} videos in '
+            f'{elapsed:.2f}s ({completed / elapsed:.0f}/s), '
+            f'{errors} lock errors, {twice} words rendered twice, '
+            f'{left} left in the backlog'
+        )
+        if twice or left or videos.count() != options['words']:
+            raise CommandError('Lost or duplicated writes')
@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('is_app', '0001_initial'),
+    ]
+
+    operations = [
+        # the model always allowed languages without a name
+        migrations.AlterField(
+            model_name='language',
+            name='name',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='word',
+            index=models.Index(
+                fields=['language', 'relevance'],
+                name='word_language_relevance_idx'
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='word',
+            index=models.Index(
+                fields=['language', 'count_char'],
+                name='word_language_count_char_idx'
+            ),
+        ),
+    ]
@@ -0,0 +1,47 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('is_app', '0002_word_indexes'),
+    ]
+
+    operations = [
+        # videos belonged to a language by mistake
+        migrations.AlterField(
+            model_name='wordvideo',
+            name='word',
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name='videos',
+                to='is_app.Word'
+            ),
+        ),
+        migrations.CreateModel(
+            name='BacklogEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('relevance', models.IntegerField(default=0)),
+                ('claimed_by', models.CharField(blank=True, max_length=255, null=True)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('language', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='is_app.Language')),
+                ('word', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='backlog_entry', to='is_app.Word')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='backlogentry',
+            index=models.Index(
+                condition=models.Q(claimed_at__isnull=True),
+                fields=['language', '-relevance'],
+                name='backlog_unclaimed_idx'
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='backlogentry',
+            index=models.Index(
+                fields=['claimed_by'], name='backlog_claimed_by_idx'
+            ),
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('is_app', '0003_planner'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='word',
+            index=models.Index(
+                fields=['word', 'language'], name='word_word_language_idx'
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name='word',
+            constraint=models.UniqueConstraint(
+                fields=['language', 'word'], name='word_language_word_uniq'
+            ),
+        ),
+    ]
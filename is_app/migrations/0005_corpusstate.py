@@ -0,0 +1,22 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('is_app', '0004_word_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CorpusState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('checksum', models.CharField(max_length=64)),
+                ('words', models.IntegerField(default=0)),
+                ('synced_at', models.DateTimeField(auto_now=True)),
+                ('language', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='corpus_state', to='is_app.Language')),
+            ],
+        ),
+    ]
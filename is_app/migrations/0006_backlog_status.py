@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('is_app', '0005_corpusstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='backlogentry',
+            name='status',
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='backlogentry',
+            name='updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,59 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('is_app', '0006_backlog_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Analysis',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('voice', models.CharField(blank=True, default='', max_length=255)),
+                ('title', models.CharField(blank=True, max_length=1023, null=True)),
+                ('filename', models.CharField(max_length=1023, unique=True)),
+                ('duration', models.FloatField()),
+                ('frames', models.IntegerField()),
+                ('min_midi', models.FloatField(blank=True, null=True)),
+                ('max_midi', models.FloatField(blank=True, null=True)),
+                ('min_note', models.CharField(blank=True, max_length=8, null=True)),
+                ('max_note', models.CharField(blank=True, max_length=8, null=True)),
+                ('pitch_range', models.FloatField(default=0)),
+                ('voiced_ratio', models.FloatField()),
+                ('unit', models.CharField(max_length=8)),
+                ('samplerate', models.IntegerField()),
+                ('hop', models.IntegerField()),
+                ('tolerance', models.FloatField(blank=True, null=True)),
+                ('silence', models.FloatField(blank=True, null=True)),
+                ('contour', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('language', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='is_app.language')),
+                ('word', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='is_app.word')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['language', 'voice'], name='analysis_language_voice_idx'), models.Index(fields=['duration'], name='analysis_duration_idx'), models.Index(fields=['pitch_range'], name='analysis_pitch_range_idx'), models.Index(fields=['voiced_ratio'], name='analysis_voiced_ratio_idx'), models.Index(fields=['min_midi', 'max_midi'], name='analysis_midi_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='AnalysisAggregate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('voice', models.CharField(blank=True, default='', max_length=255)),
+                ('analyses', models.IntegerField(default=0)),
+                ('voiced_analyses', models.IntegerField(default=0)),
+                ('total_duration', models.FloatField(default=0)),
+                ('total_pitch_range', models.FloatField(default=0)),
+                ('total_voiced_ratio', models.FloatField(default=0)),
+                ('min_midi', models.FloatField(blank=True, null=True)),
+                ('max_midi', models.FloatField(blank=True, null=True)),
+                ('language', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='is_app.language')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('language', 'voice'), name='analysis_aggregate_language_voice_uniq')],
+            },
+        ),
+    ]
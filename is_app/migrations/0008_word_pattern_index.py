@@ -0,0 +1,30 @@
+from django.db import migrations
+
+# LIKE 'prefix%' only seeks an index of the pattern operators unless the
+# database collation is C, see is_app/search.py
+CREATE_INDEX = (
+    'CREATE INDEX word_word_pattern_idx '
+    'ON is_app_word (word varchar_pattern_ops)'
+)
+DROP_INDEX = 'DROP INDEX IF EXISTS word_word_pattern_idx'
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_INDEX)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('is_app', '0007_analysis_catalogue'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
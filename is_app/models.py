@@ -14,7 +14,7 @@ class Language(models.Model):
 
 
 class Word(models.Model):
-    word = models.CharField(max_length=1023, unique=True)
+    word = models.CharField(max_length=1023)
     language = models.ForeignKey(
         Language,
         on_delete=models.CASCADE
@@ -23,16 +23,187 @@ class Word(models.Model):
     count_vowels = models.IntegerField(blank=True, null=True)
     relevance = models.IntegerField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['language', 'relevance'],
+                name='word_language_relevance_idx'
+            ),
+            models.Index(
+                fields=['language', 'count_char'],
+                name='word_language_count_char_idx'
+            ),
+            # prefix searches over every language
+            models.Index(
+                fields=['word', 'language'], name='word_word_language_idx'
+            ),
+        ]
+        constraints = [
+            # also the index of the prefix searches in a language
+            models.UniqueConstraint(
+                fields=['language', 'word'], name='word_language_word_uniq'
+            ),
+        ]
+
+    def __str__(self):
+        return self.word
+
     def save(self):
         pass
 
 
 class WordVideo(models.Model):
     word = models.ForeignKey(
-        Language,
-        on_delete=models.CASCADE
+        Word,
+        on_delete=models.CASCADE,
+        related_name='videos'
     )
     link_code = models.CharField(max_length=1023, blank=True, null=True)
     title = models.CharField(max_length=1023, blank=True, null=True)
     description = models.TextField(blank=True, null=True)
     keywords = models.TextField(blank=True, null=True)
+
+
+class BacklogEntry(models.Model):
+    """
+    A word waiting for its video.
+    Language and relevance are copied from the word so that the next
+    unclaimed entries of a language are read in order from one index.
+    """
+    word = models.OneToOneField(
+        Word,
+        on_delete=models.CASCADE,
+        related_name='backlog_entry'
+    )
+    language = models.ForeignKey(
+        Language,
+        on_delete=models.CASCADE
+    )
+    relevance = models.IntegerField(default=0)
+    claimed_by = models.CharField(max_length=255, blank=True, null=True)
+    claimed_at = models.DateTimeField(blank=True, null=True)
+    # reported by the worker rendering the word
+    status = models.CharField(max_length=32, blank=True, null=True)
+    updated_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['language', '-relevance'],
+                name='backlog_unclaimed_idx',
+                condition=models.Q(claimed_at__isnull=True)
+            ),
+            models.Index(fields=['claimed_by'], name='backlog_claimed_by_idx'),
+        ]
+
+
+class CorpusState(models.Model):
+    """
+    Word list a language was last synced with
+    """
+    language = models.OneToOneField(
+        Language,
+        on_delete=models.CASCADE,
+        related_name='corpus_state'
+    )
+    checksum = models.CharField(max_length=64)
+    words = models.IntegerField(default=0)
+    synced_at = models.DateTimeField(auto_now=True)
+
+
+class Analysis(models.Model):
+    """
+    Catalogue entry of a pitch analysis.
+    The summary columns are indexed for queries over the whole corpus,
+    the contour is kept as float16 MIDI pitches, NaN where unvoiced.
+    """
+    language = models.ForeignKey(
+        Language,
+        on_delete=models.CASCADE
+    )
+    voice = models.CharField(max_length=255, blank=True, default='')
+    word = models.ForeignKey(
+        Word,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True
+    )
+    title = models.CharField(max_length=1023, blank=True, null=True)
+    filename = models.CharField(max_length=1023, unique=True)
+    duration = models.FloatField()
+    frames = models.IntegerField()
+    min_midi = models.FloatField(blank=True, null=True)
+    max_midi = models.FloatField(blank=True, null=True)
+    min_note = models.CharField(max_length=8, blank=True, null=True)
+    max_note = models.CharField(max_length=8, blank=True, null=True)
+    # semitones between the lowest and the highest pitch
+    pitch_range = models.FloatField(default=0)
+    voiced_ratio = models.FloatField()
+    unit = models.CharField(max_length=8)
+    samplerate = models.IntegerField()
+    hop = models.IntegerField()
+    tolerance = models.FloatField(blank=True, null=True)
+    silence = models.FloatField(blank=True, null=True)
+    contour = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['language', 'voice'],
+                name='analysis_language_voice_idx'
+            ),
+            models.Index(fields=['duration'], name='analysis_duration_idx'),
+            models.Index(
+                fields=['pitch_range'], name='analysis_pitch_range_idx'
+            ),
+            models.Index(
+                fields=['voiced_ratio'], name='analysis_voiced_ratio_idx'
+            ),
+            models.Index(
+                fields=['min_midi', 'max_midi'], name='analysis_midi_idx'
+            ),
+        ]
+
+
+class AnalysisAggregate(models.Model):
+    """
+    Running totals of the analyses of a language and voice,
+    updated with every catalogue change
+    """
+    language = models.ForeignKey(
+        Language,
+        on_delete=models.CASCADE
+    )
+    voice = models.CharField(max_length=255, blank=True, default='')
+    analyses = models.IntegerField(default=0)
+    voiced_analyses = models.IntegerField(default=0)
+    total_duration = models.FloatField(default=0)
+    total_pitch_range = models.FloatField(default=0)
+    total_voiced_ratio = models.FloatField(default=0)
+    min_midi = models.FloatField(blank=True, null=True)
+    max_midi = models.FloatField(blank=True, null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['language', 'voice'],
+                name='analysis_aggregate_language_voice_uniq'
+            ),
+        ]
+
+    @property
+    def mean_duration(self):
+        return self.total_duration / self.analyses if self.analyses else 0
+
+    @property
+    def mean_pitch_range(self):
+        """
+        Over the analyses with voiced frames
+        """
+        return self.total_pitch_range / self.voiced_analyses \
+            if self.voiced_analyses else 0
+
+    @property
+    def mean_voiced_ratio(self):
+        return self.total_voiced_ratio / self.analyses if self.analyses else 0
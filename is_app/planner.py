@@ -0,0 +1,127 @@
+"""
+Production planner: which words get their video next.
+Every word without a video has a BacklogEntry. The unclaimed entries of
+a language are in a partial index ordered by relevance, so the next N
+words are the first N rows of that index.
+Workers claim entries with a single UPDATE, each claim has its own
+token, so two workers never get the same word. Their status reports
+are buffered and written in batches.
+"""
+import uuid
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .db import WriteBehindBuffer
+from .models import BacklogEntry, Word, WordVideo
+
+CLAIM_TIMEOUT = timedelta(hours=6)
+
+status_updates = WriteBehindBuffer(
+    BacklogEntry, key='word_id', stamp='updated_at'
+)
+
+
+def refresh(language=None):
+    """
+    Add the words without video nor backlog entry to the backlog,
+    return how many were added
+    """
+    # anti-join on the indexed word ids of the videos and the backlog
+    words = Word.objects.filter(
+        videos__isnull=True, backlog_entry__isnull=True
+    )
+    if language is not None:
+        words = words.filter(language=language)
+    entries = [
+        BacklogEntry(
+            word_id=id, language_id=language_id, relevance=relevance or 0
+        )
+        for id, language_id, relevance in words.values_list(
+            'id', 'language_id', 'relevance'
+        ).iterator()
+    ]
+    BacklogEntry.objects.bulk_create(entries, batch_size=5000)
+    return len(entries)
+
+
+def unclaimed(language):
+    return BacklogEntry.objects.filter(
+        language=language, claimed_at__isnull=True
+    ).order_by('-relevance', 'id')
+
+
+def next_words(language, n):
+    """
+    The next n words to render, without claiming them
+    """
+    entries = unclaimed(language).select_related('word')[:n]
+    return [entry.word for entry in entries]
+
+
+def claim(language, n, worker='worker'):
+    """
+    Claim the next n words of the language for a worker
+    """
+    token = f'{worker}:{uuid.uuid4().hex}'
+    now = timezone.now()
+    with transaction.atomic():
+        candidates = unclaimed(language)[:n]
+        if connection.features.has_select_for_update_skip_locked:
+            # rows locked by another claim are skipped, not waited for
+            candidates = list(
+                candidates.select_for_update(skip_locked=True)
+                .values_list('id', flat=True)
+            )
+        else:
+            # SQLite serializes writes: picking and claiming is one UPDATE
+            candidates = candidates.values('id')
+        BacklogEntry.objects.filter(
+            id__in=candidates, claimed_at__isnull=True
+        ).update(claimed_by=token, claimed_at=now)
+    return [
+        entry.word for entry in BacklogEntry.objects.filter(claimed_by=token)
+        .select_related('word').order_by('-relevance', 'id')
+    ]
+
+
+def report(word, status):
+    """
+    Status of a claimed word, written behind
+    """
+    status_updates.update(word.id, status=status)
+
+
+def release(words):
+    """
+    Put claimed words back in the backlog
+    """
+    for word in words:
+        status_updates.discard(word.id)
+    return BacklogEntry.objects.filter(word__in=words).update(
+        claimed_by=None, claimed_at=None, status=None, updated_at=None
+    )
+
+
+def release_stale(timeout=CLAIM_TIMEOUT):
+    """
+    Put back the words claimed by workers that neither finished nor
+    reported in time
+    """
+    status_updates.flush()
+    cutoff = timezone.now() - timeout
+    return BacklogEntry.objects.filter(claimed_at__lt=cutoff).exclude(
+        updated_at__gte=cutoff
+    ).update(claimed_by=None, claimed_at=None, status=None, updated_at=None)
+
+
+def complete(word, **video):
+    """
+    Record the video of a word and take it out of the backlog
+    """
+    status_updates.discard(word.id)
+    with transaction.atomic():
+        word_video = WordVideo.objects.create(word=word, **video)
+        BacklogEntry.objects.filter(word=word).delete()
+    return word_video
@@ -0,0 +1,68 @@
+"""
+Prefix search over the words.
+On SQLite a prefix is a range of the word index: every word starting
+with it sorts between the prefix and the prefix followed by the last
+code point, so a lookup is an index seek plus as many rows as returned.
+That only holds under the binary collation of SQLite: a linguistic
+collation sorts 'ca' after 'c\U0010ffff'. Other databases get a LIKE
+'prefix%', which PostgreSQL seeks in the varchar_pattern_ops index of
+migration 0008. icontains scans the whole table instead.
+"""
+from django.db import connection
+
+from .models import Word
+
+LAST_CHAR = '\U0010ffff'
+AUTOCOMPLETE_SIZE = 20
+
+
+def normalize(prefix):
+    # the corpus words are lower case
+    return prefix.strip().lower()
+
+
+def prefix_filter(queryset, prefix, field='word'):
+    """
+    Queryset rows whose field starts with prefix
+    """
+    prefix = normalize(prefix)
+    if not prefix:
+        return queryset
+    if connection.vendor != 'sqlite':
+        return queryset.filter(**{f'{field}__startswith': prefix})
+    return queryset.filter(**{
+        f'{field}__gte': prefix,
+        f'{field}__lt': prefix + LAST_CHAR,
+    })
+
+
+def autocomplete(prefix, language=None, limit=AUTOCOMPLETE_SIZE):
+    """
+    First words in alphabetical order starting with prefix
+    """
+    words = Word.objects.all()
+    if language is not None:
+        words = words.filter(language=language)
+    return prefix_filter(words, prefix).order_by('word', 'language_id')[:limit]
+
+
+def estimated_count(model):
+    """
+    Row count of a table without counting it: the planner statistics on
+    PostgreSQL, the id range elsewhere, exact while rows are not deleted
+    """
+    table = model._meta.db_table
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples FROM pg_class WHERE relname = %s', [table]
+            )
+            row = cursor.fetchone()
+        if row and row[0] >= 0:
+            return int(row[0])
+    # both ends are index seeks on the primary key
+    ids = model.objects.order_by('pk').values_list('pk', flat=True)
+    first = ids.first()
+    if first is None:
+        return 0
+    return ids.last() - first + 1
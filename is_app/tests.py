@@ -1,3 +1,398 @@
-from django.test import TestCase
+import io
+import os
+import tempfile
+import threading
+import types
+import unittest.mock
+from datetime import timedelta
 
-# Create your tests here.
+import numpy as np
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from utils import NoteTools
+
+from . import catalogue, planner, search
+from .db import WriteBehindBuffer
+from .models import (
+    Analysis, AnalysisAggregate, BacklogEntry, Language, Word
+)
+from .views import invalidate_api_cache
+
+LOCMEM_CACHE = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class TestApi(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.en = Language.objects.create(code='en', name='English')
+        cls.it = Language.objects.create(code='it', name='Italiano')
+        # Word.save does nothing, rows are created in bulk
+        Word.objects.bulk_create([
+            Word(
+                word=f'{language.code}{n}',
+                language=language,
+                relevance=1000 - n,
+                count_char=len(f'{language.code}{n}'),
+            )
+            for language in (cls.en, cls.it)
+            for n in range(25)
+        ])
+
+    def setUp(self):
+        invalidate_api_cache()
+
+    def test_keyset_pages(self):
+        url = '/api/words/?language=en&limit=10'
+        words = []
+        while url:
+            page = self.client.get(url).json()
+            words += [row['word'] for row in page['results']]
+            url = page['next']
+        self.assertEqual(words, [f'en{n}' for n in range(25)])
+
+    def test_filters(self):
+        page = self.client.get(
+            '/api/words/?language=it&min_relevance=980&count_char=4'
+        ).json()
+        self.assertEqual(
+            [row['word'] for row in page['results']],
+            [f'it{n}' for n in range(10, 21)]
+        )
+        self.assertIsNone(page['next'])
+
+    def test_bad_request(self):
+        response = self.client.get('/api/words/?min_relevance=high')
+        self.assertEqual(response.status_code, 400)
+
+    def test_etag(self):
+        response = self.client.get('/api/languages/')
+        self.assertEqual(len(response.json()['results']), 2)
+        not_modified = self.client.get(
+            '/api/languages/', HTTP_IF_NONE_MATCH=response['ETag']
+        )
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_invalidation(self):
+        first = self.client.get('/api/languages/')
+        Language.objects.create(code='de')
+        self.assertEqual(self.client.get('/api/languages/').content,
+                         first.content)
+        invalidate_api_cache()
+        self.assertEqual(
+            len(self.client.get('/api/languages/').json()['results']), 3
+        )
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class TestImportWords(TestCase):
+
+    def test_import(self):
+        with tempfile.TemporaryDirectory() as words_path:
+            os.mkdir(os.path.join(words_path, 'it'))
+            with open(os.path.join(words_path, 'it', 'it_50k.txt'), 'w',
+                      encoding='utf8') as words_file:
+                words_file.write('non 2000\nperché 1000\n')
+            with override_settings(OS_WORDS_PATH=words_path):
+                before = self.client.get('/api/words/').json()
+                call_command('import_words', 'it', stdout=io.StringIO())
+                # again: nothing new
+                call_command('import_words', 'it', stdout=io.StringIO())
+        self.assertEqual(before['results'], [])
+        words = self.client.get('/api/words/').json()['results']
+        self.assertEqual(
+            [(row['word'], row['relevance'], row['count_vowels'])
+             for row in words],
+            [('non', 2000, 1), ('perché', 1000, 2)]
+        )
+
+    def sync(self, words_path, content):
+        with open(os.path.join(words_path, 'it', 'it_50k.txt'), 'w',
+                  encoding='utf8') as words_file:
+            words_file.write(content)
+        out = io.StringIO()
+        with override_settings(OS_WORDS_PATH=words_path):
+            call_command('import_words', 'it', sync=True, stdout=out)
+        return out.getvalue().strip()
+
+    def test_sync(self):
+        with tempfile.TemporaryDirectory() as words_path:
+            os.mkdir(os.path.join(words_path, 'it'))
+            self.assertEqual(
+                self.sync(words_path, 'non 2000\nperché 1000\nche 500\n'),
+                'it: 3 inserted, 0 updated, 0 deleted'
+            )
+            self.assertEqual(
+                self.sync(words_path, 'non 2000\nperché 1000\nche 500\n'),
+                'it: unchanged'
+            )
+            che = Word.objects.get(word='che')
+            planner.complete(che, title='che')
+            self.assertEqual(
+                self.sync(words_path, 'non 2000\nperché 3000\nsì 10\n'),
+                'it: 1 inserted, 1 updated, 0 deleted'
+            )
+        # che has a video and stays
+        self.assertEqual(
+            dict(Word.objects.values_list('word', 'relevance')),
+            {'non': 2000, 'perché': 3000, 'che': 500, 'sì': 10}
+        )
+        self.assertEqual(
+            [word.word for word in planner.next_words(che.language, 3)],
+            ['perché', 'non', 'sì']
+        )
+
+
+class TestPlanner(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.en = Language.objects.create(code='en', name='English')
+        cls.it = Language.objects.create(code='it', name='Italiano')
+        Word.objects.bulk_create([
+            Word(word=f'{language.code}{n}', language=language, relevance=n)
+            for language in (cls.en, cls.it)
+            for n in range(10)
+        ])
+        planner.refresh()
+
+    def words(self, words):
+        return [word.word for word in words]
+
+    def test_next_words(self):
+        self.assertEqual(
+            self.words(planner.next_words(self.en, 3)), ['en9', 'en8', 'en7']
+        )
+        # peeking claims nothing
+        self.assertEqual(
+            self.words(planner.next_words(self.en, 3)), ['en9', 'en8', 'en7']
+        )
+
+    def test_claims_are_disjoint(self):
+        first = planner.claim(self.en, 4, 'first')
+        second = planner.claim(self.en, 4, 'second')
+        self.assertEqual(self.words(first), ['en9', 'en8', 'en7', 'en6'])
+        self.assertEqual(self.words(second), ['en5', 'en4', 'en3', 'en2'])
+        self.assertEqual(len(planner.claim(self.en, 4)), 2)
+        self.assertEqual(planner.claim(self.en, 4), [])
+        self.assertEqual(len(planner.claim(self.it, 20)), 10)
+
+    def test_complete(self):
+        word = planner.claim(self.en, 1)[0]
+        planner.complete(word, title=word.word)
+        self.assertFalse(BacklogEntry.objects.filter(word=word).exists())
+        self.assertEqual(word.videos.get().title, 'en9')
+        # words with a video do not come back
+        self.assertEqual(planner.refresh(), 0)
+
+    def test_release(self):
+        words = planner.claim(self.en, 2)
+        planner.release(words[:1])
+        self.assertEqual(self.words(planner.next_words(self.en, 1)), ['en9'])
+        self.assertEqual(planner.release_stale(timedelta(hours=1)), 0)
+        self.assertEqual(planner.release_stale(timedelta(0)), 1)
+        self.assertEqual(self.words(planner.next_words(self.en, 2)),
+                         ['en9', 'en8'])
+
+    def test_report(self):
+        words = planner.claim(self.en, 2)
+        planner.report(words[0], 'rendering')
+        planner.status_updates.flush()
+        entry = BacklogEntry.objects.get(word=words[0])
+        self.assertEqual(entry.status, 'rendering')
+        self.assertIsNotNone(entry.updated_at)
+        BacklogEntry.objects.filter(claimed_at__isnull=False).update(
+            claimed_at=entry.claimed_at - timedelta(hours=2)
+        )
+        # a reporting worker keeps its claim
+        self.assertEqual(planner.release_stale(timedelta(hours=1)), 1)
+        self.assertEqual(self.words(planner.next_words(self.en, 1)), ['en8'])
+
+
+class TestDatabase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.en = Language.objects.create(code='en')
+        cls.it = Language.objects.create(code='it')
+        cls.de = Language.objects.create(code='de')
+
+    def test_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 30000)
+
+    def test_write_behind(self):
+        buffer = WriteBehindBuffer(Language, key='code', max_items=3)
+        buffer.update('en', name='English')
+        buffer.update('en', name='Inglese')
+        buffer.update('it', name='Italiano')
+        self.assertEqual(len(buffer), 2)
+        self.assertIsNone(Language.objects.get(code='en').name)
+        # the third row fills the buffer
+        buffer.update('de', name='Tedesco')
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(
+            dict(Language.objects.values_list('code', 'name')),
+            {'en': 'Inglese', 'it': 'Italiano', 'de': 'Tedesco'}
+        )
+        buffer.update('de', name='Deutsch')
+        buffer.discard('de')
+        self.assertEqual(buffer.flush(), 0)
+
+    def test_write_behind_on_time(self):
+        """
+        Pending updates are written max_delay seconds after the first
+        """
+        buffer = WriteBehindBuffer(Language, key='code', max_delay=0.05)
+        flushed = threading.Event()
+        buffer.flush = flushed.set
+        buffer.update('en', name='English')
+        self.assertTrue(flushed.wait(5))
+        buffer.discard('en')
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class TestSearch(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.en = Language.objects.create(code='en', name='English')
+        cls.it = Language.objects.create(code='it', name='Italiano')
+        Word.objects.bulk_create([
+            Word(word=word, language=language)
+            for language, words in (
+                (cls.en, ('car', 'card', 'care', 'cat', 'ca')),
+                (cls.it, ('cara', 'casa', 'perché', 'perciò', 'car')),
+            )
+            for word in words
+        ])
+
+    def setUp(self):
+        invalidate_api_cache()
+
+    def test_prefix(self):
+        words = search.autocomplete('CAR ')
+        self.assertEqual(
+            [(word.word, word.language_id) for word in words],
+            [('car', self.en.id), ('car', self.it.id), ('cara', self.it.id),
+             ('card', self.en.id), ('care', self.en.id)]
+        )
+        self.assertEqual(
+            [word.word for word in search.autocomplete('perc', self.it)],
+            ['perché', 'perciò']
+        )
+        self.assertEqual(
+            [word.word for word in search.autocomplete('ca', self.en, 2)],
+            ['ca', 'car']
+        )
+
+    def test_prefix_without_binary_collation(self):
+        """
+        Off SQLite the prefix is a LIKE, with the same words
+        """
+        words = Word.objects.order_by('word', 'language_id')
+        ranged = search.prefix_filter(words, 'car')
+        with unittest.mock.patch.object(
+            search, 'connection', types.SimpleNamespace(vendor='postgresql')
+        ):
+            liked = search.prefix_filter(words, 'car')
+        self.assertIn('LIKE', str(liked.query))
+        self.assertNotIn('LIKE', str(ranged.query))
+        self.assertEqual(list(liked), list(ranged))
+
+    def test_estimated_count(self):
+        self.assertEqual(search.estimated_count(Word), 10)
+        self.assertEqual(search.estimated_count(BacklogEntry), 0)
+
+    def test_api(self):
+        results = self.client.get(
+            '/api/words/autocomplete/?prefix=ca&language=it'
+        ).json()['results']
+        self.assertEqual(
+            [row['word'] for row in results], ['car', 'cara', 'casa']
+        )
+        page = self.client.get('/api/words/?prefix=car&language=en').json()
+        self.assertEqual(
+            sorted(row['word'] for row in page['results']),
+            ['car', 'card', 'care']
+        )
+        self.assertEqual(
+            self.client.get('/api/words/autocomplete/?limit=0').status_code,
+            400
+        )
+
+
+def pitch_analysis(filename, samples, unit='midi'):
+    """
+    What catalogue.record reads of a PitchAnalysis
+    """
+    return types.SimpleNamespace(
+        samples=np.array(samples, dtype=float), no_value=0.0, unit=unit,
+        title=filename, filename=filename, samplerate=80, hop=20,
+        tolerance=0.8, silence=-40.0, min_note='A4', max_note='A5'
+    )
+
+
+class TestCatalogue(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.en = Language.objects.create(code='en')
+
+    def aggregate(self):
+        return AnalysisAggregate.objects.values_list(
+            'analyses', 'voiced_analyses', 'total_duration',
+            'total_pitch_range', 'min_midi', 'max_midi'
+        ).get(language=self.en, voice='a')
+
+    def test_record(self):
+        entry = catalogue.record(
+            pitch_analysis('one.wav', [0, 440, 880, 0], 'freq'),
+            self.en, 'a'
+        )
+        self.assertEqual(entry.duration, 1.0)
+        self.assertEqual(entry.voiced_ratio, 0.5)
+        self.assertEqual((entry.min_midi, entry.max_midi), (69, 81))
+        self.assertEqual(entry.pitch_range, 12)
+        np.testing.assert_array_equal(
+            catalogue.contour(entry), [np.nan, 69, 81, np.nan]
+        )
+        catalogue.record(pitch_analysis('two.wav', [60, 62]), self.en, 'a')
+        catalogue.record(pitch_analysis('silent.wav', [0, 0]), self.en, 'a')
+        self.assertEqual(self.aggregate(), (3, 2, 2.0, 14.0, 60.0, 81.0))
+        aggregate = AnalysisAggregate.objects.get(voice='a')
+        self.assertEqual(aggregate.mean_pitch_range, 7)
+
+    def test_replace_and_remove(self):
+        catalogue.record(pitch_analysis('one.wav', [50, 70]), self.en, 'a')
+        two = catalogue.record(pitch_analysis('two.wav', [60]), self.en, 'a')
+        catalogue.record(pitch_analysis('one.wav', [55, 65]), self.en, 'a')
+        self.assertEqual(self.aggregate(), (2, 2, 0.75, 10.0, 55.0, 65.0))
+        catalogue.remove(two)
+        self.assertEqual(self.aggregate(), (1, 1, 0.5, 10.0, 55.0, 65.0))
+        before = self.aggregate()
+        catalogue.rebuild_aggregates()
+        self.assertEqual(self.aggregate(), before)
+
+    def test_midi_conventions(self):
+        """
+        The catalogue converts pitches like the workers, C4 is 60
+        """
+        freqs = NoteTools.notes_to_freqs(['C4', 'A4'])
+        np.testing.assert_allclose(catalogue.to_midi(freqs, 'Hz'), [60, 69])
+
+    def test_unsupported_unit(self):
+        with self.assertRaises(ValueError):
+            catalogue.record(
+                pitch_analysis('cents.wav', [6000], 'cent'), self.en
+            )
+        self.assertFalse(Analysis.objects.exists())
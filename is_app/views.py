@@ -1,3 +1,166 @@
-from django.shortcuts import render
+"""
+Read-only JSON API.
+Pages are keyset paginated on the primary key: a page starts after the
+last id of the previous one, so deep pages cost as much as the first.
+Responses are cached per query and carry an ETag. The cache version is
+bumped by the imports, which invalidates every cached page.
+"""
+import hashlib
+import json
+from functools import wraps
 
-# Create your views here.
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotAllowed, JsonResponse
+from django.utils.http import urlencode
+
+from . import search
+from .models import Language, Word, WordVideo
+
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+CACHE_TIMEOUT = 3600
+CACHE_VERSION_KEY = 'api:version'
+
+
+def api_cache_version():
+    return cache.get_or_set(CACHE_VERSION_KEY, 1, None)
+
+
+def invalidate_api_cache():
+    """
+    Drop every cached response, called after the data changed
+    """
+    try:
+        cache.incr(CACHE_VERSION_KEY)
+    except ValueError:
+        cache.set(CACHE_VERSION_KEY, 2, None)
+
+
+def int_param(request, name, default=None):
+    value = request.GET.get(name)
+    if value in (None, ''):
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f'{name} must be an integer')
+
+
+def paginate(request, queryset, fields):
+    """
+    Page of the queryset after the id given as cursor
+    """
+    limit = min(int_param(request, 'limit', PAGE_SIZE), MAX_PAGE_SIZE)
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    after = int_param(request, 'after')
+    if after is not None:
+        queryset = queryset.filter(id__gt=after)
+    # one more row tells whether there is a next page
+    rows = list(queryset.order_by('id').values(*fields)[:limit + 1])
+    next_url = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        query = request.GET.copy()
+        query['after'] = rows[-1]['id']
+        next_url = f'{request.path}?{urlencode(sorted(query.items()))}'
+    return {'results': rows, 'next': next_url}
+
+
+def api_view(view):
+    """
+    Serve a JSON view from the cache, with ETags.
+    ValueErrors of the view are bad requests.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return HttpResponseNotAllowed(['GET', 'HEAD'])
+        query = urlencode(sorted(request.GET.lists()), doseq=True)
+        key = hashlib.sha1(
+            f'{request.path}?{query}'.encode('utf8')
+        ).hexdigest()
+        version = api_cache_version()
+        entry = cache.get(key, version=version)
+        if entry is None:
+            try:
+                data = view(request, *args, **kwargs)
+            except ValueError as e:
+                return JsonResponse({'error': str(e)}, status=400)
+            body = json.dumps(data, separators=(',', ':')).encode('utf8')
+            entry = (body, f'"{hashlib.sha1(body).hexdigest()}"')
+            cache.set(key, entry, CACHE_TIMEOUT, version=version)
+        body, etag = entry
+        matches = [
+            tag.strip()
+            for tag in request.headers.get('If-None-Match', '').split(',')
+        ]
+        if etag in matches or '*' in matches:
+            response = HttpResponse(status=304)
+        else:
+            response = HttpResponse(body, content_type='application/json')
+        response['ETag'] = etag
+        return response
+    return wrapper
+
+
+@api_view
+def languages(request):
+    return paginate(request, Language.objects.all(), ('id', 'code', 'name'))
+
+
+@api_view
+def words(request):
+    """
+    Words filtered by language code, prefix, relevance range and length
+    """
+    queryset = Word.objects.all()
+    if request.GET.get('language'):
+        queryset = queryset.filter(language__code=request.GET['language'])
+    if request.GET.get('prefix'):
+        queryset = search.prefix_filter(queryset, request.GET['prefix'])
+    min_relevance = int_param(request, 'min_relevance')
+    if min_relevance is not None:
+        queryset = queryset.filter(relevance__gte=min_relevance)
+    max_relevance = int_param(request, 'max_relevance')
+    if max_relevance is not None:
+        queryset = queryset.filter(relevance__lte=max_relevance)
+    count_char = int_param(request, 'count_char')
+    if count_char is not None:
+        queryset = queryset.filter(count_char=count_char)
+    return paginate(request, queryset, (
+        'id', 'word', 'language_id', 'count_char', 'count_vowels',
+        'relevance'
+    ))
+
+
+@api_view
+def autocomplete(request):
+    """
+    First words in alphabetical order starting with ?prefix=
+    """
+    limit = int_param(request, 'limit', search.AUTOCOMPLETE_SIZE)
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+    language = None
+    if request.GET.get('language'):
+        language = Language.objects.filter(
+            code=request.GET['language']
+        ).first()
+        if language is None:
+            return {'results': []}
+    words = search.autocomplete(
+        request.GET.get('prefix', ''), language, limit
+    )
+    return {'results': list(words.values('id', 'word', 'language_id'))}
+
+
+@api_view
+def videos(request):
+    queryset = WordVideo.objects.all()
+    word = int_param(request, 'word')
+    if word is not None:
+        queryset = queryset.filter(word_id=word)
+    return paginate(request, queryset, (
+        'id', 'word_id', 'link_code', 'title', 'description', 'keywords'
+    ))
@@ -2,6 +2,7 @@
 ASGI config for is project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP goes to Django, the live intonation WebSocket to the workers.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
@@ -13,4 +14,18 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'is_project.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# the settings put the workers on the path
+from live import LiveSocket  # noqa: E402
+
+live_socket = LiveSocket()
+
+
+async def application(scope, receive, send):
+    if scope['type'] != 'websocket':
+        return await django_application(scope, receive, send)
+    if scope['path'] == LiveSocket.PATH:
+        return await live_socket(scope, receive, send)
+    await receive()
+    await send({'type': 'websocket.close', 'code': 1000})
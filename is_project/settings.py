@@ -11,10 +11,17 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
 import os
+import sys
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+# The workers are flat modules. The project imports the shared ones,
+# the live socket and the note conversions, from their directory.
+WORKERS_DIR = os.path.join(BASE_DIR, 'is_workers')
+if WORKERS_DIR not in sys.path:
+    sys.path.append(WORKERS_DIR)
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/3.0/howto/deployment/checklist/
@@ -37,7 +44,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'is_app'
+    'is_app.apps.IsAppConfig'
 ]
 
 MIDDLEWARE = [
@@ -78,6 +85,34 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # seconds a writer waits for the lock before "database is locked"
+        'OPTIONS': {'timeout': 30},
+        # worker processes keep their connection between jobs
+        'CONN_MAX_AGE': 600,
+    }
+}
+
+# Pragmas of every new SQLite connection, see is_app/db.py.
+# With the WAL journal readers and the writer do not block each other.
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 30000,
+    'temp_store': 'MEMORY',
+    'cache_size': -20000,
+    'mmap_size': 268435456,
+}
+
+
+# Cache
+# Shared by the server and the management commands: an import
+# invalidates the cached API responses of every process.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, '.cache'),
     }
 }
 
@@ -119,3 +154,7 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.0/howto/static-files/
 
 STATIC_URL = '/static/'
+
+# OpenSubtitles word lists, <lang>/<lang>_50k.txt
+
+OS_WORDS_PATH = os.path.join(BASE_DIR, 'words')
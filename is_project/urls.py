@@ -16,6 +16,13 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path
 
+from is_app import views
+
 urlpatterns = [
+    path('api/languages/', views.languages, name='api-languages'),
+    path('api/words/', views.words, name='api-words'),
+    path('api/words/autocomplete/', views.autocomplete,
+         name='api-autocomplete'),
+    path('api/videos/', views.videos, name='api-videos'),
     path('', admin.site.urls),
 ]
@@ -1,14 +1,112 @@
+import io
 import os
-import json
+import threading
+import wave
+from xml.sax.saxutils import escape
 
-from aubio import source, pitch
-from google.cloud import texttospeech
-from google.oauth2 import service_account
-import ffmpeg
 import numpy as np
-from scipy.cluster.hierarchy import linkage
 
-from utils import path_in_medialib, NoteTools
+from audiofile import audio_cache
+from medialib import library
+from models import PitchAnalysis
+from utils import lazy_import
+
+aubio = lazy_import('aubio')
+ffmpeg = lazy_import('ffmpeg')
+google_auth = lazy_import('google.auth')
+google_auth_requests = lazy_import('google.auth.transport.requests')
+service_account = lazy_import('google.oauth2.service_account')
+texttospeech = lazy_import('google.cloud.texttospeech')
+texttospeech_beta = lazy_import('google.cloud.texttospeech_v1beta1')
+
+
+class TextToSpeechClients:
+    """
+    Registry of long-lived TTS clients, shared by the whole process.
+    Every credentials file gets a pool of clients, each one keeping its
+    gRPC channel open. The clients of a pool share one credentials
+    object: refreshing it renews the token without new channels.
+    Timepoints need the beta API, its clients have their own pools.
+    """
+    POOL_SIZE = 2
+    SCOPES = ['https://www.googleapis.com/auth/cloud-platform']
+
+    def __init__(
+        self,
+        make_client=None,
+        load_credentials=None,
+        pool_size=POOL_SIZE
+    ):
+        self.make_client = make_client or self.default_client
+        self.load_credentials = load_credentials or self.default_credentials
+        self.pool_size = pool_size
+        self.lock = threading.Lock()
+        self.pools = {}
+
+    @staticmethod
+    def default_client(credentials, beta=False):
+        module = texttospeech_beta if beta else texttospeech
+        return module.TextToSpeechClient(credentials=credentials)
+
+    @classmethod
+    def default_credentials(cls, credential_filepath):
+        """
+        Service account file or, without one, the application default
+        """
+        if credential_filepath:
+            return service_account.Credentials.from_service_account_file(
+                credential_filepath, scopes=cls.SCOPES
+            )
+        return google_auth.default(scopes=cls.SCOPES)[0]
+
+    def pool(self, credential_filepath=None, beta=False):
+        with self.lock:
+            pool = self.pools.get((credential_filepath, beta))
+            if pool is None:
+                credentials = self.load_credentials(credential_filepath)
+                pool = {
+                    'credentials': credentials,
+                    'clients': [
+                        self.make_client(credentials, beta)
+                        for x in range(self.pool_size)
+                    ],
+                    'next': 0,
+                }
+                self.pools[(credential_filepath, beta)] = pool
+            return pool
+
+    def get(self, credential_filepath=None, beta=False):
+        """
+        Next client of the pool, round robin
+        """
+        pool = self.pool(credential_filepath, beta)
+        with self.lock:
+            client = pool['clients'][pool['next']]
+            pool['next'] = (pool['next'] + 1) % len(pool['clients'])
+        return client
+
+    def refresh(self, credential_filepath=None):
+        """
+        Renew the token of the pool, the channels stay open
+        """
+        credentials = self.pool(credential_filepath)['credentials']
+        credentials.refresh(google_auth_requests.Request())
+        return credentials
+
+    def warm_up(self, credential_filepath=None, language='en-US'):
+        """
+        Fetch the token and open every channel before the first request
+        """
+        self.refresh(credential_filepath)
+        for client in self.pool(credential_filepath)['clients']:
+            client.list_voices(language_code=language)
+
+    def clear(self):
+        with self.lock:
+            self.pools = {}
+
+
+tts_clients = TextToSpeechClients()
 
 
 class GoogleSpeaker:
@@ -16,26 +114,34 @@ class GoogleSpeaker:
     FILENAME_EXTENSION = 'mp3'
     DEFAULT_CREDENTIAL_FILEPATH = \
         "/Users/elio/projects/writersup/credentials.json"
-    default_credentials = None
 
-    def __init__(self):
+    def __init__(self, registry=None):
+        self.registry = registry or tts_clients
+        self.client = self.registry.get(self.credential_filepath())
+
+    def warm_up(self):
+        """
+        To be called at worker start
+        """
+        self.registry.warm_up(self.credential_filepath())
+
+    @classmethod
+    def credential_filepath(cls):
+        """
+        None when the environment provides the credentials
+        """
         credential_filepath = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')
         if not credential_filepath or not os.path.exists(credential_filepath):
-            self.default_credentials = \
-                service_account.Credentials.from_service_account_file(
-                    self.DEFAULT_CREDENTIAL_FILEPATH)
-        self.client = texttospeech.TextToSpeechClient() \
-            if not self.default_credentials \
-            else texttospeech.TextToSpeechClient(
-                    credentials=self.default_credentials
-                )
+            return cls.DEFAULT_CREDENTIAL_FILEPATH
+        return None
 
     @staticmethod
     def mp3_to_wav(mp3_path, wav_path):
         try:
             mp3 = ffmpeg.input(mp3_path)
+            # float samples are mapped by WavFile.to_float without a copy
             outdict = {
-                'acodec': 'pcm_u8',
+                'acodec': 'pcm_f32le',
             }
             ffmpeg.output(mp3, wav_path, **outdict).run(
                 capture_stdout=True,
@@ -53,6 +159,13 @@ class GoogleSpeaker:
         out = f"{out}_{language_code}_{str(speak_rate).replace('.','_')}"
         return out
 
+    def filename_for(self, text, rate, language, voice_name):
+        """
+        Readable name followed by the content address of the speech
+        """
+        key = library.key(text, rate, language, voice_name)
+        return f'{self.filename_from_text(text, language, rate)}_{key[:12]}'
+
     def speak(
         self,
         text,
@@ -65,10 +178,8 @@ class GoogleSpeaker:
         Create the audio file from text.
         """
         if not filename:
-            filename = self.filename_from_text(text, rate, language)
-        filepath = path_in_medialib(filename)
-        filepath_wav = f'{filepath}.wav'
-        filepath_mp3 = f'{filepath}.mp3'
+            filename = self.filename_for(text, rate, language, voice_name)
+        filepath_wav = library.path(f'{filename}.wav')
         if os.path.exists(filepath_wav):
             return filepath_wav
         synthesis_input = texttospeech.SynthesisInput(text=text)
@@ -86,12 +197,137 @@ class GoogleSpeaker:
             input=synthesis_input, voice=voice, audio_config=audio_config
         )
         # The response's audio_content is binary.
-        with open(filepath_mp3, "wb") as out:
-            out.write(response.audio_content)
-        self.mp3_to_wav(filepath_mp3, filepath_wav)
+        with library.atomic(f'{filename}.mp3') as filepath_mp3:
+            with open(filepath_mp3, "wb") as out:
+                out.write(response.audio_content)
+        with library.atomic(f'{filename}.wav') as partial_wav:
+            self.mp3_to_wav(library.path(f'{filename}.mp3'), partial_wav)
         return filepath_wav
 
 
+class BatchSpeaker(GoogleSpeaker):
+    """
+    Synthesize many words with a single request.
+    The words are separated by SSML marks, the response timepoints
+    tell where to cut the audio into one clip per word. Every clip is
+    stored under the name GoogleSpeaker.speak would give it.
+    """
+    # the API accepts at most 5000 bytes of SSML
+    MAX_SSML_BYTES = 4500
+    BREAK = '400ms'
+    SAMPLERATE = 24000
+
+    def __init__(self, registry=None):
+        self.registry = registry or tts_clients
+        self.client = self.registry.get(self.credential_filepath(), True)
+
+    @classmethod
+    def ssml_for(cls, words):
+        """
+        Mark i precedes the word i, the last mark ends the last word
+        """
+        parts = ['<speak>']
+        for i, word in enumerate(words):
+            parts.append(
+                f'<mark name="{i}"/>{escape(word)}'
+                f'<break time="{cls.BREAK}"/>'
+            )
+        parts.append(f'<mark name="{len(words)}"/></speak>')
+        return ''.join(parts)
+
+    @classmethod
+    def batches(cls, words):
+        """
+        Split the words in requests below the SSML size limit
+        """
+        batch = []
+        for word in words:
+            if batch and len(
+                cls.ssml_for(batch + [word]).encode('utf8')
+            ) > cls.MAX_SSML_BYTES:
+                yield batch
+                batch = []
+            batch.append(word)
+        if batch:
+            yield batch
+
+    @staticmethod
+    def split_timepoints(audio_content, timepoints, count):
+        """
+        Cut a LINEAR16 response in count clips at the marks.
+        Return the wav parameters and the frames of every clip.
+        """
+        marks = {
+            int(timepoint.mark_name): timepoint.time_seconds
+            for timepoint in timepoints
+        }
+        missing = set(range(count + 1)) - set(marks)
+        if missing:
+            raise ValueError(f'Missing timepoints: {sorted(missing)}')
+        with wave.open(io.BytesIO(audio_content)) as audio:
+            params = audio.getparams()
+            frames = audio.readframes(params.nframes)
+        frame_size = params.sampwidth * params.nchannels
+        offsets = [
+            min(round(marks[i] * params.framerate), params.nframes)
+            for i in range(count + 1)
+        ]
+        clips = [
+            frames[start * frame_size:end * frame_size]
+            for start, end in zip(offsets, offsets[1:])
+        ]
+        return params, clips
+
+    def speak_batch(
+        self,
+        words,
+        rate=0.8,
+        language='en-US',
+        voice_name='en-US-Wavenet-D'
+    ):
+        """
+        Create the audio file of every word, return their paths
+        """
+        filenames = [
+            self.filename_for(word, rate, language, voice_name)
+            for word in words
+        ]
+        missing = [
+            word for word, filename in zip(words, filenames)
+            if not library.exists(f'{filename}.wav')
+        ]
+        voice = texttospeech_beta.VoiceSelectionParams(
+            language_code=language,
+            name=voice_name
+        )
+        audio_config = texttospeech_beta.AudioConfig(
+            audio_encoding=texttospeech_beta.AudioEncoding.LINEAR16,
+            speaking_rate=rate,
+            sample_rate_hertz=self.SAMPLERATE
+        )
+        mark = texttospeech_beta.SynthesizeSpeechRequest.TimepointType
+        for batch in self.batches(list(dict.fromkeys(missing))):
+            request = texttospeech_beta.SynthesizeSpeechRequest(
+                input=texttospeech_beta.SynthesisInput(
+                    ssml=self.ssml_for(batch)
+                ),
+                voice=voice,
+                audio_config=audio_config,
+                enable_time_pointing=[mark.SSML_MARK]
+            )
+            response = self.client.synthesize_speech(request=request)
+            params, clips = self.split_timepoints(
+                response.audio_content, response.timepoints, len(batch)
+            )
+            for word, clip in zip(batch, clips):
+                filename = self.filename_for(word, rate, language, voice_name)
+                with library.atomic(f'{filename}.wav') as partial_path:
+                    with wave.open(partial_path, 'wb') as out:
+                        out.setparams(params)
+                        out.writeframes(clip)
+        return [library.path(f'{filename}.wav') for filename in filenames]
+
+
 class AudioAnalyst:
     debug = True
     hop = 512  # downsample # hop size
@@ -99,9 +335,7 @@ class AudioAnalyst:
     win_s = 4096  # downsample # fft size
     tolerance = 0.8
     silence = -40
-    clean = False
-    clean_tollerance = 0.35
-    clean_value = -1.0
+    post_processor = None
     analysis = None
 
     def __init__(
@@ -112,12 +346,21 @@ class AudioAnalyst:
         method='yin',
         samplerate=12800,
         hop=512,
-        win_s=4096
+        win_s=4096,
+        signal=None,
+        post_processor=None
     ):
         """
         Default values  128000 / 512 = 25 sample per second.
+        signal is an array already at samplerate, e.g. a clip of a
+        longer recording. Otherwise the file comes from the audio
+        cache and is only decoded once per process.
+        The post processor, e.g. a PitchPostProcessor, cleans the
+        pitch track. Corpora are better cleaned in one batch.
         """
         self.filename = filename
+        self.signal = signal
+        self.post_processor = post_processor or self.post_processor
         self.title = title
         self.unit = unit
         self.hop = hop
@@ -126,8 +369,9 @@ class AudioAnalyst:
         self.is_midi = self.unit == 'midi'
         self.method = method
         self.samplerate = samplerate
-        self.s = source(filename, self.samplerate, self.hop)
-        self.pitch_o = pitch(
+        if signal is None:
+            self.signal = audio_cache.open(filename).signal(samplerate)
+        self.pitch_o = aubio.pitch(
             self.method, self.win_s, self.hop, self.samplerate
         )
         self.pitch_o.set_unit(self.unit)
@@ -135,87 +379,85 @@ class AudioAnalyst:
         self.pitch_o.set_tolerance(self.tolerance)
 
     def plot_samples(self, plot):
-        times = [t * self.hop for t in range(len(self.samples))]
-        plot.plot(times, self.samples, '.-')
-        plot.axis(ymin=0.0, ymax=1.1 * self.max_y)
+        samples = self.analysis.samples
+        times = [t * self.hop for t in range(len(samples))]
+        plot.plot(times, samples, '.-')
+        plot.axis(ymin=0.0, ymax=1.1 * self.analysis.max_y)
 
     def plot_histogram(self, plot):
-        plot.hist(self.histogram)
+        plot.hist(self.analysis.histogram)
 
     def save_file(self, filepath):
-        with open(filepath) as json_file:
-            json.dump(self.analysis, json_file)
+        self.analysis.save(filepath)
 
     def cluster(self):
         """
         Create clusters using hierarchical clustering
         """
-        zeros = np.zeros(len(self.samples))
+        from scipy.cluster.hierarchy import linkage
+        samples = self.analysis.samples
+        zeros = np.zeros(len(samples))
         points = np.column_stack(
-            (zeros.astype(np.double), self.samples.astype(np.double))
+            (zeros.astype(np.double), samples.astype(np.double))
         )
         self.linkage = linkage(points, 'ward')
         return self.linkage
 
-    def set_analysis(self, samples):
+    def set_analysis(self, samples, confidences=None):
         """
-        Set samples and compute stats
+        Set samples and compute stats.
+        Masked samples are stored as PitchAnalysis.NO_VALUE
         """
-        self.samples = samples
-        self.max_x = self.samples.size
-        self.min_y = np.min(self.samples)
-        self.max_y = np.max(self.samples)
-        self.histogram = np.histogram(
-            self.samples,
-            bins=int(self.max_y)
+        no_value = PitchAnalysis.NO_VALUE
+        samples = np.ma.filled(
+            np.ma.asarray(samples, dtype=float), no_value
+        )
+        if confidences is None:
+            confidences = np.ones(samples.size)
+        self.analysis = PitchAnalysis(
+            samples=samples,
+            confidences=np.asarray(confidences, dtype=float),
+            title=self.title,
+            filename=self.filename,
+            unit=self.unit,
+            samplerate=self.samplerate,
+            hop=self.hop,
+            tolerance=self.tolerance,
+            silence=self.silence,
+            no_value=no_value,
+            **PitchAnalysis.stats(samples, no_value, self.is_midi)
         )
-        if not self.is_midi:
-            self.max_note, self.min_note = NoteTools.freq_to_note(
-                self.max_y), \
-                NoteTools.freq_to_note(self.min_y)
-        else:
-            self.max_note, self.min_note = NoteTools.midi_to_note(
-                self.max_y), \
-                NoteTools.midi_to_note(self.min_y)
-
-        self.analysis = {
-                'samples': self.samples.tolist(),
-                'tolerance': self.tolerance,
-                'silence': str(self.silence),
-                'hop': str(self.hop),
-                'filename': self.filename,
-                'samplerate': self.samplerate,
-                'max_x': self.max_x,
-                'min_y': self.min_y,
-                'max_y': self.max_y,
-                'max_note': self.max_note,
-                'min_note': self.min_note,
-                'histogram': self.histogram,
-                'unit': self.unit,
-                'title': self.title
-        }
         return self.analysis
 
+    def blocks(self):
+        """
+        Hop sized blocks of the signal
+        """
+        signal = np.asarray(self.signal, dtype=aubio.float_type)
+        for start in range(0, signal.size, self.hop):
+            samples = signal[start:start + self.hop]
+            read = samples.size
+            if read < self.hop:
+                samples = np.pad(samples, (0, self.hop - read))
+            yield samples, read
+
     def analyse(self, json_path=None):
         total_frames = 0
         pitches = []
         confidences = []
-        while True:
-            samples, read = self.s()
+        for samples, read in self.blocks():
             pitch = self.pitch_o(samples)[0]
             confidence = self.pitch_o.get_confidence()
-            if self.clean and confidence < self.clean_tollerance:
-                pitch = self.clean_value
             pitches += [pitch]
             confidences += [confidence]
             total_frames += read
-            if read < self.hop:
-                break
         # clean results
         pitches = np.array(pitches)
         pitches = np.ma.masked_where(
             pitches <= 12.0,
             pitches
         )
-        # save and return analysis
-        return self.set_analysis(pitches)
+        self.set_analysis(pitches, confidences)
+        if self.post_processor:
+            self.analysis = self.post_processor.process(self.analysis)
+        return self.analysis
@@ -0,0 +1,195 @@
+import os
+import struct
+import threading
+from collections import OrderedDict
+from math import gcd
+
+import numpy as np
+
+from utils import lazy_import
+
+aubio = lazy_import('aubio')
+
+
+class WavFile:
+    """
+    PCM data of a WAV file memory-mapped as a (frames, channels) array.
+    Nothing is read until the samples are used.
+    """
+    PCM = 1
+    IEEE_FLOAT = 3
+    EXTENSIBLE = 0xFFFE
+    DTYPES = {
+        (PCM, 8): np.uint8,
+        (PCM, 16): np.dtype('<i2'),
+        (PCM, 32): np.dtype('<i4'),
+        (IEEE_FLOAT, 32): np.dtype('<f4'),
+        (IEEE_FLOAT, 64): np.dtype('<f8'),
+    }
+
+    def __init__(self, path):
+        self.path = path
+        fmt, data_offset, data_size = self.chunks(path)
+        tag, channels, samplerate = struct.unpack('<HHI', fmt[:8])
+        bits = struct.unpack('<H', fmt[14:16])[0]
+        if tag == self.EXTENSIBLE and len(fmt) >= 26:
+            # the sub format GUID starts with the actual format tag
+            tag = struct.unpack('<H', fmt[24:26])[0]
+        dtype = self.DTYPES.get((tag, bits))
+        if dtype is None:
+            raise ValueError(
+                f'Unsupported WAV format {tag} with {bits} bits: {path}'
+            )
+        self.samplerate = samplerate
+        self.channels = channels
+        frame_size = np.dtype(dtype).itemsize * channels
+        # streamed files may not know their size
+        data_size = min(data_size, os.path.getsize(path) - data_offset)
+        frames = data_size // frame_size
+        self.data = np.memmap(
+            path, dtype=dtype, mode='r', offset=data_offset,
+            shape=(frames, channels)
+        ) if frames else np.empty((0, channels), dtype=dtype)
+
+    @staticmethod
+    def chunks(path):
+        """
+        Return the fmt chunk and the position and size of the data
+        """
+        fmt = None
+        with open(path, 'rb') as wav_file:
+            header = wav_file.read(12)
+            if header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+                raise ValueError(f'Not a WAV file: {path}')
+            while True:
+                header = wav_file.read(8)
+                if len(header) < 8:
+                    raise ValueError(f'No data in {path}')
+                chunk_id, chunk_size = struct.unpack('<4sI', header)
+                if chunk_id == b'data':
+                    if fmt is None:
+                        raise ValueError(f'No format before data: {path}')
+                    return fmt, wav_file.tell(), chunk_size
+                if chunk_id == b'fmt ':
+                    fmt = wav_file.read(chunk_size)
+                    chunk_size = 0
+                # chunks are word aligned
+                wav_file.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+
+    def to_float(self):
+        """
+        Mono float32 samples between -1 and 1,
+        a view of the file when it is already mono float32
+        """
+        data = self.data
+        if data.dtype == np.uint8:
+            data = (data.astype(np.float32) - 128) / 128
+        elif data.dtype.kind == 'i':
+            scale = float(2 ** (8 * data.dtype.itemsize - 1))
+            data = data.astype(np.float32) / scale
+        if self.channels > 1:
+            data = data.mean(axis=1)
+        else:
+            data = data[:, 0]
+        return data.astype(np.float32, copy=False)
+
+
+class Audio:
+    """
+    Samples of an audio file, decoded once.
+    Every stage asks for the samplerate it works at: the resampled
+    signals are kept and the same arrays are handed to the pitch
+    tracker, the segmenter and the ffmpeg audio pipe.
+    """
+    BLOCK = 2 ** 16
+
+    def __init__(self, path, samplerate, signal):
+        self.path = path
+        self.samplerate = samplerate
+        self.signals = {samplerate: signal}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def open(cls, path):
+        try:
+            wav = WavFile(path)
+        except ValueError:
+            return cls.decode(path)
+        return cls(path, wav.samplerate, wav.to_float())
+
+    @classmethod
+    def decode(cls, path):
+        """
+        Files that cannot be mapped, e.g. mp3, are decoded by aubio
+        """
+        source = aubio.source(path, 0, cls.BLOCK)
+        signal = np.empty(source.duration + cls.BLOCK, dtype=np.float32)
+        position = 0
+        while True:
+            samples, read = source()
+            signal[position:position + read] = samples[:read]
+            position += read
+            if read < cls.BLOCK:
+                break
+        samplerate = source.samplerate
+        source.close()
+        return cls(path, samplerate, signal[:position])
+
+    def signal(self, samplerate=None):
+        """
+        Mono float32 signal at the given samplerate
+        """
+        samplerate = samplerate or self.samplerate
+        with self.lock:
+            if samplerate not in self.signals:
+                # lazy_import would load scipy to find scipy.signal
+                from scipy.signal import resample_poly
+                factor = gcd(samplerate, self.samplerate)
+                self.signals[samplerate] = resample_poly(
+                    self.signals[self.samplerate],
+                    samplerate // factor,
+                    self.samplerate // factor
+                ).astype(np.float32, copy=False)
+            return self.signals[samplerate]
+
+    @staticmethod
+    def pipe(signal):
+        """
+        Bytes of a signal for an ffmpeg f32le input, without a copy
+        """
+        return memoryview(np.ascontiguousarray(signal)).cast('B')
+
+
+class AudioCache:
+    """
+    Audio files opened by the process, the least recently used ones
+    are dropped. A file changed on disk is opened again.
+    """
+    MAX_FILES = 8
+
+    def __init__(self, max_files=MAX_FILES):
+        self.max_files = max_files
+        self.files = OrderedDict()
+        self.lock = threading.Lock()
+
+    def open(self, path):
+        stat = os.stat(path)
+        key = (os.path.realpath(path), stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            if key in self.files:
+                self.files.move_to_end(key)
+                return self.files[key]
+        audio = Audio.open(path)
+        with self.lock:
+            audio = self.files.setdefault(key, audio)
+            self.files.move_to_end(key)
+            while len(self.files) > self.max_files:
+                self.files.popitem(last=False)
+        return audio
+
+    def clear(self):
+        with self.lock:
+            self.files.clear()
+
+
+audio_cache = AudioCache()
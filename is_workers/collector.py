@@ -0,0 +1,217 @@
+import argparse
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+from medialib import library as default_library
+
+
+@dataclass
+class CollectionReport:
+    scanned: int = 0
+    removed: int = 0
+    reclaimed: int = 0
+    total: int = 0
+
+
+class MediaCollector:
+    """
+    Incremental garbage collector of the media library.
+    Every pass scans a bounded number of shards from where the previous
+    one stopped, removes the artifacts past their retention and, while
+    the library is above its quota, evicts the oldest removable ones.
+    The shard sizes are kept between passes to estimate the total.
+    """
+    SHARDS = 256 * 256
+    SHARDS_PER_PASS = 256
+    STATE_FILE = '.collector.json'
+    DAY = 24 * 3600
+    FRAMES = 'frames'
+    PREVIEW_PREFIX = 'preview_'
+    # Seconds before an artifact can be removed, None keeps it forever.
+    # wav files are kept while their analysis exists: <name>.json or
+    # the file recorded by library.mark_analysed, whose record goes with
+    # the analysis,
+    # mp4 files until their upload is recorded.
+    # Frames of finished videos are removed by the VideoMaker.
+    # Previews and their contact sheets are only looked at for a while.
+    RETENTION = {
+        '.mp3': 0,
+        '.wav': DAY,
+        '.mp4': 7 * DAY,
+        '.json': None,
+        '.uploaded': None,
+        '.analysed': 0,
+        FRAMES: DAY,
+        PREVIEW_PREFIX: 2 * DAY,
+    }
+
+    def __init__(
+        self,
+        library=default_library,
+        quota=None,
+        retention=None,
+        shards_per_pass=SHARDS_PER_PASS
+    ):
+        self.library = library
+        self.quota = quota
+        self.retention = dict(self.RETENTION, **(retention or {}))
+        self.shards_per_pass = shards_per_pass
+        self.state_path = os.path.join(self.library.root, self.STATE_FILE)
+        self.state = self.load_state()
+
+    def load_state(self):
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as state_file:
+                return json.load(state_file)
+        return {'cursor': 0, 'sizes': {}}
+
+    def save_state(self):
+        os.makedirs(self.library.root, exist_ok=True)
+        partial_path = f'{self.state_path}.part'
+        with open(partial_path, 'w') as state_file:
+            json.dump(self.state, state_file)
+        os.replace(partial_path, self.state_path)
+
+    @property
+    def total(self):
+        return sum(self.state['sizes'].values())
+
+    def kind(self, entry):
+        if entry.is_dir(follow_symlinks=False):
+            return self.FRAMES
+        if entry.name.startswith(self.PREVIEW_PREFIX):
+            return self.PREVIEW_PREFIX
+        return os.path.splitext(entry.name)[1]
+
+    def is_protected(self, entry, kind):
+        """
+        Artifacts still needed by a later stage
+        """
+        stem = os.path.splitext(entry.name)[0]
+        if kind == '.wav':
+            return self.library.exists(f'{stem}.json') or \
+                self.library.analysis_path(entry.name) is not None
+        if kind == self.library.ANALYSED_SUFFIX:
+            return self.library.analysis_path(stem) is not None
+        if kind == '.mp4':
+            return not self.library.exists(
+                f'{entry.name}{self.library.UPLOADED_SUFFIX}'
+            )
+        return False
+
+    def retention_of(self, entry, kind):
+        if entry.name.startswith(self.library.PARTIAL_PREFIX):
+            # leftover of an interrupted write
+            return self.DAY
+        if kind == '.mp3':
+            # the mp3 is only needed until it is converted
+            stem = os.path.splitext(entry.name)[0]
+            if not self.library.exists(f'{stem}.wav'):
+                return max(self.retention[kind], self.DAY)
+        return self.retention.get(kind)
+
+    @staticmethod
+    def size_of(entry):
+        if not entry.is_dir(follow_symlinks=False):
+            return entry.stat(follow_symlinks=False).st_size
+        with os.scandir(entry.path) as frames:
+            return sum(
+                frame.stat().st_size for frame in frames if frame.is_file()
+            )
+
+    def shard_paths(self, position):
+        first, second = f'{position >> 8:02x}', f'{position & 0xff:02x}'
+        for top in (
+            self.library.root,
+            os.path.join(self.library.root, self.library.WORK_DIR)
+        ):
+            yield os.path.relpath(
+                os.path.join(top, first, second), self.library.root
+            )
+
+    def collect(self, now=None):
+        """
+        Run one pass and report what it did
+        """
+        now = now or time.time()
+        report = CollectionReport()
+        candidates = []
+        cursor = self.state['cursor']
+        for position in range(cursor, cursor + self.shards_per_pass):
+            for shard in self.shard_paths(position % self.SHARDS):
+                path = os.path.join(self.library.root, shard)
+                if not os.path.isdir(path):
+                    self.state['sizes'].pop(shard, None)
+                    continue
+                size = 0
+                for entry in self.library.scan_shard(path):
+                    report.scanned += 1
+                    entry_size = self.size_of(entry)
+                    kind = self.kind(entry)
+                    retention = self.retention_of(entry, kind)
+                    if retention is None or self.is_protected(entry, kind):
+                        size += entry_size
+                        continue
+                    mtime = entry.stat(follow_symlinks=False).st_mtime
+                    if now - mtime >= retention:
+                        report.removed += 1
+                        report.reclaimed += self.library.remove(entry.path)
+                        continue
+                    size += entry_size
+                    candidates.append((mtime, entry.path, shard, entry_size))
+                self.state['sizes'][shard] = size
+        self.state['cursor'] = (cursor + self.shards_per_pass) % self.SHARDS
+        # over quota: the oldest removable artifacts go first
+        if self.quota is not None:
+            candidates.sort()
+            for mtime, path, shard, size in candidates:
+                if self.total <= self.quota:
+                    break
+                report.removed += 1
+                report.reclaimed += self.library.remove(path)
+                self.state['sizes'][shard] -= size
+        report.total = self.total
+        self.save_state()
+        return report
+
+    def run(self, interval=60, stop=None):
+        """
+        Collect forever, one pass every interval seconds
+        """
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            report = self.collect()
+            if report.removed:
+                print(
+                    f'Removed {report.removed} artifacts, '
+                    f'reclaimed {report.reclaimed} bytes'
+                )
+            stop.wait(interval)
+
+    def start(self, interval=60):
+        """
+        Collect in a background thread, set the returned event to stop
+        """
+        stop = threading.Event()
+        threading.Thread(
+            target=self.run, args=(interval, stop), daemon=True
+        ).start()
+        return stop
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--quota', type=int, help='Quota in bytes')
+    parser.add_argument(
+        '--passes', type=int, default=MediaCollector.SHARDS // 256,
+        help='Number of passes, the default covers the whole library'
+    )
+    args = parser.parse_args()
+    collector = MediaCollector(quota=args.quota)
+    reclaimed = 0
+    for x in range(args.passes):
+        reclaimed += collector.collect().reclaimed
+    print(f'Reclaimed {reclaimed} bytes, {collector.total} bytes left')
@@ -0,0 +1,244 @@
+import argparse
+import heapq
+import os
+import time
+
+import numpy as np
+
+from utils import NoteTools
+
+
+class ContourIndex:
+    """
+    Nearest neighbour search over pitch contours.
+    Contours are stored in semitones, resampled to LENGTH points and
+    centred on their mean so that only the shape of the intonation
+    counts. Queries rank the candidates with LB_Keogh lower bounds and
+    compute the exact banded DTW only while a bound can still beat the
+    current k-th neighbour.
+    """
+    LENGTH = 64
+    BAND = 6
+    BATCH = 256
+    GROWTH = 1024
+    DTYPE = np.float32
+
+    def __init__(self, length=LENGTH, band=BAND):
+        self.length = length
+        self.band = band
+        self.keys = []
+        self.contours = np.empty((0, self.length), dtype=self.DTYPE)
+        self.upper = np.empty((0, self.length), dtype=self.DTYPE)
+        self.lower = np.empty((0, self.length), dtype=self.DTYPE)
+        self.diagonals = self.band_diagonals()
+
+    def __len__(self):
+        return len(self.keys)
+
+    @classmethod
+    def normalise(cls, samples, voiced=None, is_midi=True, length=LENGTH):
+        """
+        Semitone contour of the voiced samples,
+        gaps are interpolated and the mean is removed.
+        """
+        samples = np.asarray(samples, dtype=float)
+        if voiced is None:
+            voiced = samples > 0
+        positions = np.flatnonzero(voiced)
+        if not positions.size:
+            return np.zeros(length)
+        pitches = samples[positions]
+        if not is_midi:
+            pitches = NoteTools.freqs_to_midi(pitches)
+        # keep the voiced span only and resample it
+        points = np.linspace(positions[0], positions[-1], length)
+        contour = np.interp(points, positions, pitches)
+        return contour - contour.mean()
+
+    @classmethod
+    def from_analysis(cls, analysis, length=LENGTH):
+        return cls.normalise(
+            analysis.samples,
+            analysis.voiced,
+            analysis.is_midi,
+            length
+        )
+
+    def envelope(self, contours):
+        """
+        Upper and lower envelopes within the DTW band
+        """
+        padded = np.pad(
+            contours, ((0, 0), (self.band, self.band)), mode='edge'
+        )
+        windows = np.stack([
+            padded[:, shift:shift + self.length]
+            for shift in range(2 * self.band + 1)
+        ])
+        return windows.max(axis=0), windows.min(axis=0)
+
+    def _grow(self, size):
+        capacity = self.contours.shape[0]
+        if size <= capacity:
+            return
+        capacity = max(size, capacity + capacity // 2, self.GROWTH)
+        for name in ('contours', 'upper', 'lower'):
+            array = getattr(self, name)
+            grown = np.empty((capacity, self.length), dtype=self.DTYPE)
+            grown[:len(self)] = array[:len(self)]
+            setattr(self, name, grown)
+
+    def add_many(self, keys, contours):
+        """
+        Insert normalised contours
+        """
+        contours = np.atleast_2d(np.asarray(contours, dtype=self.DTYPE))
+        start, end = len(self), len(self) + len(keys)
+        self._grow(end)
+        upper, lower = self.envelope(contours)
+        self.contours[start:end] = contours
+        self.upper[start:end] = upper
+        self.lower[start:end] = lower
+        self.keys.extend(keys)
+
+    def add(self, key, analysis):
+        self.add_many([key], self.from_analysis(analysis, self.length))
+
+    @staticmethod
+    def keogh(contours, upper, lower):
+        """
+        LB_Keogh of each contour against an envelope
+        """
+        # upper >= lower: at most one of the two terms is not zero
+        outside = np.maximum(contours - upper, 0) + \
+            np.maximum(lower - contours, 0)
+        return np.sqrt(np.einsum('ij,ij->i', outside, outside))
+
+    def band_diagonals(self):
+        """
+        Cells of the DTW matrix within the band, by anti-diagonal
+        """
+        diagonals = []
+        for diagonal in range(2, 2 * self.length + 1):
+            i = np.arange(
+                max(1, diagonal - self.length),
+                min(self.length, diagonal - 1) + 1
+            )
+            j = diagonal - i
+            band = np.abs(i - j) <= self.band
+            diagonals.append((i[band], j[band]))
+        return diagonals
+
+    def dtw(self, query, candidates):
+        """
+        Banded DTW distance between the query and each candidate.
+        Cells of an anti-diagonal only depend on the two previous ones
+        and are computed together.
+        """
+        count, length = candidates.shape[0], self.length
+        cost = (query[None, :, None] - candidates[:, None, :]) ** 2
+        distance = np.full((count, length + 1, length + 1), np.inf)
+        distance[:, 0, 0] = 0
+        for i, j in self.diagonals:
+            distance[:, i, j] = cost[:, i - 1, j - 1] + np.minimum(
+                np.minimum(distance[:, i - 1, j], distance[:, i, j - 1]),
+                distance[:, i - 1, j - 1]
+            )
+        return np.sqrt(distance[:, length, length])
+
+    def query(self, contour, k=10):
+        """
+        Return the k nearest (key, distance) pairs, closest first
+        """
+        n = len(self)
+        contour = np.asarray(contour, dtype=self.DTYPE)
+        upper, lower = self.envelope(contour[None, :])
+        # candidates envelopes against the query only for the
+        # batches that are actually reached
+        bounds = self.keogh(self.contours[:n], upper, lower)
+        order = np.argsort(bounds)
+        best = []  # max-heap of (-distance, position)
+        for start in range(0, n, self.BATCH):
+            batch = order[start:start + self.BATCH]
+            if len(best) == k:
+                kth = -best[0][0]
+                if bounds[batch[0]] >= kth:
+                    break
+                reverse = self.keogh(
+                    contour[None, :], self.upper[batch], self.lower[batch]
+                )
+                batch = batch[np.maximum(bounds[batch], reverse) < kth]
+                if not batch.size:
+                    continue
+            distances = self.dtw(contour, self.contours[batch])
+            for position, distance in zip(batch, distances):
+                if len(best) < k:
+                    heapq.heappush(best, (-distance, position))
+                elif distance < -best[0][0]:
+                    heapq.heapreplace(best, (-distance, position))
+        return [
+            (self.keys[position], float(-distance))
+            for distance, position in sorted(best, reverse=True)
+        ]
+
+    def query_analysis(self, analysis, k=10):
+        return self.query(self.from_analysis(analysis, self.length), k)
+
+    def save(self, filepath):
+        """
+        Persist the index, the file is replaced atomically
+        """
+        partial_path = f'{filepath}.part'
+        with open(partial_path, 'wb') as index_file:
+            np.savez(
+                index_file,
+                keys=np.array(self.keys, dtype=str),
+                contours=self.contours[:len(self)],
+                band=self.band
+            )
+        os.replace(partial_path, filepath)
+
+    @classmethod
+    def load(cls, filepath):
+        with np.load(filepath) as data:
+            contours = data['contours']
+            index = cls(contours.shape[1], int(data['band']))
+            index.add_many(data['keys'].tolist(), contours)
+        return index
+
+
+def benchmark(size, queries, k):
+    """
+    Query latency over random walk contours
+    """
+    random = np.random.default_rng(0)
+    steps = random.normal(0, 0.5, (size, ContourIndex.LENGTH))
+    contours = np.cumsum(steps, axis=1)
+    contours -= contours.mean(axis=1, keepdims=True)
+    index = ContourIndex()
+    started = time.perf_counter()
+    for start in range(0, size, 10000):
+        keys = [str(key) for key in range(start, min(size, start + 10000))]
+        index.add_many(keys, contours[start:start + 10000])
+    print(f'Inserted {size} contours in {time.perf_counter() - started:.2f}s')
+    latencies = []
+    for position in random.integers(0, size, queries):
+        query = contours[position] + random.normal(0, 0.1, index.length)
+        started = time.perf_counter()
+        index.query(query - query.mean(), k)
+        latencies.append(time.perf_counter() - started)
+    latencies = np.array(latencies) * 1000
+    print(
+        f'{queries} queries, k={k}: '
+        f'median {np.median(latencies):.1f}ms, '
+        f'p95 {np.percentile(latencies, 95):.1f}ms'
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('-k', type=int, default=10)
+    args = parser.parse_args()
+    benchmark(args.size, args.queries, args.k)
@@ -0,0 +1,210 @@
+import multiprocessing
+import os
+import time
+from multiprocessing import shared_memory
+
+from image import ImageMaker
+from utils import lazy_import
+
+cairo = lazy_import('cairo')
+ffmpeg = lazy_import('ffmpeg')
+
+
+class FrameRing:
+    """
+    Ring of BGRA frame slots in shared memory.
+    Renderer processes draw in place into the slots,
+    a single writer streams the ready slots in frame order.
+    Frame i always uses the slot i % slots: a renderer waits
+    until the writer has consumed frame i - slots (back-pressure).
+    """
+    WIDTH, HEIGHT = ImageMaker.WIDTH, ImageMaker.HEIGHT
+    SLOTS = 8
+    TIMEOUT = 60
+    # seconds between two checks of the renderers while waiting
+    POLL = 0.5
+
+    def __init__(self, slots=SLOTS):
+        self.slots = slots
+        # cairo rows of 32 bit pixels need no padding
+        self.stride = 4 * self.WIDTH
+        self.slot_size = self.stride * self.HEIGHT
+        self.shm = shared_memory.SharedMemory(
+            create=True,
+            size=self.slots * self.slot_size
+        )
+        self.condition = multiprocessing.Condition()
+        # next frame expected in each slot and whether it is drawn
+        self.expected = multiprocessing.RawArray('q', range(self.slots))
+        self.ready = multiprocessing.RawArray('b', self.slots)
+
+    def slot(self, index):
+        """
+        Memory of the slot of a frame, no copy involved
+        """
+        offset = (index % self.slots) * self.slot_size
+        return self.shm.buf[offset:offset + self.slot_size]
+
+    def _wait(self, index, ready, timeout=None, check=None):
+        """
+        check is called every POLL seconds while waiting,
+        it raises to give up
+        """
+        k = index % self.slots
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while not (
+                self.expected[k] == index and bool(self.ready[k]) == ready
+            ):
+                if check:
+                    check()
+                left = self.POLL if deadline is None \
+                    else min(self.POLL, deadline - time.monotonic())
+                if left <= 0:
+                    raise TimeoutError(f'Frame {index} is not available')
+                self.condition.wait(left)
+
+    def _set(self, index, ready):
+        k = index % self.slots
+        with self.condition:
+            self.ready[k] = ready
+            if not ready:
+                self.expected[k] = index + self.slots
+            self.condition.notify_all()
+
+    def acquire(self, index):
+        """
+        Wait for the slot of the frame to be free
+        """
+        self._wait(index, False)
+        return self.slot(index)
+
+    def release(self, index):
+        """
+        Mark the frame as drawn
+        """
+        self._set(index, True)
+
+    def consume(self, index, timeout=None, check=None):
+        """
+        Wait for the frame to be drawn
+        """
+        self._wait(index, True, timeout, check)
+        return self.slot(index)
+
+    def recycle(self, index):
+        """
+        Hand the slot over to the frame index + slots
+        """
+        self._set(index, False)
+
+    def stream(self, frames, stdin, timeout=None, check=None):
+        """
+        Write the frames in order to a pipe
+        """
+        for index in range(frames):
+            slot = self.consume(index, timeout, check)
+            stdin.write(slot)
+            slot.release()
+            self.recycle(index)
+
+    def close(self):
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+def render_frames(ring, analysis, renderer, renderers):
+    """
+    Renderer process: draw every renderers-th frame into the ring
+    """
+    image_maker = ImageMaker(analysis)
+    for index in range(renderer, len(image_maker.samples), renderers):
+        slot = ring.acquire(index)
+        surface = cairo.ImageSurface.create_for_data(
+            slot, cairo.FORMAT_ARGB32, ring.WIDTH, ring.HEIGHT, ring.stride
+        )
+        image_maker.draw_frame(surface, index)
+        surface.finish()
+        # the slot can only be released once cairo drops the buffer
+        del surface
+        slot.release()
+        ring.release(index)
+    ring.close()
+
+
+def check_renderers(processes):
+    """
+    Raise if a renderer died: its frames will never come
+    """
+    for process in processes:
+        if process.exitcode:
+            raise RuntimeError(
+                f'Renderer {process.name} exited with {process.exitcode}'
+            )
+
+
+def encode_parallel(
+    analysis,
+    audio_filepath,
+    video_path,
+    renderers=None,
+    slots=FrameRing.SLOTS
+):
+    """
+    Render the frames in several processes and pipe them to ffmpeg
+    without any intermediate image file.
+    """
+    renderers = renderers or os.cpu_count()
+    frames = analysis.max_x
+    framerate = analysis.samplerate / analysis.hop
+    ring = FrameRing(max(slots, renderers))
+    processes = [
+        multiprocessing.Process(
+            target=render_frames,
+            args=(ring, analysis, renderer, renderers),
+            daemon=True
+        )
+        for renderer in range(renderers)
+    ]
+    # cairo ARGB32 is stored as BGRA on little endian machines
+    image = ffmpeg.input(
+        'pipe:',
+        format='rawvideo',
+        pix_fmt='bgra',
+        s=f'{ring.WIDTH}x{ring.HEIGHT}',
+        framerate=framerate
+    )
+    audio = ffmpeg.input(audio_filepath)
+    encoder = ffmpeg.output(
+        image,
+        audio,
+        video_path,
+        vcodec='h264',
+        acodec='aac',
+        pix_fmt='yuv420p',
+        shortest=None
+    ).overwrite_output().run_async(pipe_stdin=True)
+    try:
+        for process in processes:
+            process.start()
+        ring.stream(
+            frames, encoder.stdin, ring.TIMEOUT,
+            lambda: check_renderers(processes)
+        )
+    except Exception:
+        # renderers blocked on a slot would never exit
+        for process in processes:
+            process.terminate()
+        raise
+    finally:
+        encoder.stdin.close()
+        encoder.wait()
+        for process in processes:
+            process.join()
+        ring.close()
+        ring.unlink()
+    if encoder.returncode:
+        raise ffmpeg.Error('ffmpeg', None, None)
+    return video_path
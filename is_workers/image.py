@@ -1,13 +1,13 @@
-import json
 import math
-import random
 import os
 
-import cairo
 import numpy as np
-import shutil
 
-from utils import path_in_medialib, NoteTools, ColorTools
+from medialib import library
+from models import PitchAnalysis
+from utils import NoteTools, ColorTools, lazy_import
+
+cairo = lazy_import('cairo')
 
 
 class ImageMaker:
@@ -16,41 +16,71 @@ class ImageMaker:
     """
     WIDTH, HEIGHT = 1280, 720
     PADDING = 20
+    RECTS = {
+        'text': (60, 20, 1120, 140),
+        'path': (60, 160, 1160, 480),
+    }
     BENCHMARKS = 4
     DRAW_GRID = False
     DRAW_HISTOGRAM_PEEKS = False
     PATTERN = 'frame_%d.png'
+    # previews: a quarter of the size, every other sample
+    PREVIEW_SCALE = 0.25
+    PREVIEW_STEP = 2
+
+    is_custom_targetdir = False
+    targetdir = None
+    images = None
+    background = None
+
+    def __init__(self, analysis, maker_id=None, scale=1.0, step=1):
+        """
+        The analysis is a PitchAnalysis or its dictionary form.
+        The layout is scaled by scale, a frame is drawn every step
+        samples.
+        """
+        self.analysis = analysis if isinstance(analysis, PitchAnalysis) \
+            else PitchAnalysis.from_dict(analysis)
+        self.samples = self.analysis.samples
+        self.id = maker_id
+        self.scale = scale
+        self.step = step
+        # even dimensions for yuv420p
+        self.width = 2 * round(self.WIDTH * scale / 2)
+        self.height = 2 * round(self.HEIGHT * scale / 2)
+        self.padding = round(self.PADDING * scale)
 
-    def __init__(self, data, maker_id=None):
-        self.data = data
-        self.samples = np.array(self.data['samples'])
-        self.id = maker_id if maker_id else random.randint(4, 10)
+    @classmethod
+    def preview(cls, analysis, maker_id=None):
+        """
+        Factory method. A small and fast maker for reviews
+        """
+        return cls(analysis, maker_id, cls.PREVIEW_SCALE, cls.PREVIEW_STEP)
 
-    def __getattr__(self, name):
-        """ Shortcut.
-            The data dictionary is accesible through the object
+    @property
+    def framerate(self):
+        return self.analysis.samplerate / self.analysis.hop / self.step
+
+    def frames(self):
+        """
+        Indexes of the samples getting a frame
         """
-        if name in self.data:
-            return self.data[name]
+        return range(0, len(self.samples), self.step)
 
     @classmethod
     def from_filepath(cls, filepath):
         """
         Factory method. Create an instance from a analysis file
         """
-        out = None
-        with open(filepath) as json_file:
-            analysis = json.load(json_file)
-            out = cls(analysis)
-        return out
+        return cls(PitchAnalysis.load(filepath))
 
     def rects(self):
         """
         Measurements of elements within the image
         """
         return {
-            'text': (60, 20, 1120, 140),
-            'path': (60, 160, 1160, 480),
+            name: tuple(round(value * self.scale) for value in rect)
+            for name, rect in self.RECTS.items()
         }
 
     def target_path(self, filename):
@@ -67,13 +97,16 @@ class ImageMaker:
             self.targetdir = custom_targetdir
             self.is_custom_targetdir = True
         else:
-            self.targetdir = path_in_medialib(f'maker_{self.id}')
-            if not os.path.exists(self.targetdir):
-                os.makedirs(self.targetdir)
+            prefix = f'maker_{self.id}' if self.id else 'maker'
+            self.targetdir = library.workdir(prefix)
 
     def remove_targetdir(self):
-        if os.path.exists(self.targetdir) and not self.is_custom_targetdir:
-            shutil.rmtree(self.targetdir)
+        """
+        Remove the frames, custom target folders are left alone
+        """
+        if self.targetdir and not self.is_custom_targetdir and \
+                os.path.exists(self.targetdir):
+            library.remove(self.targetdir)
             return True
         return False
 
@@ -85,19 +118,20 @@ class ImageMaker:
         if dim == 'path_x':
             # scale time index to the x axis of the path
             scaled_x = self.rects()['path'][2] * \
-                (float(x) / float(self.max_x))
+                (float(x) / float(self.analysis.max_x))
         if dim == 'path_y':
             # scale a frequency to the y axis of the path
+            min_y, max_y = self.analysis.min_y, self.analysis.max_y
             scaled_x = self.rects()['path'][3] - self.rects()['path'][3] * \
-                (x - self.min_y) / (self.max_y - self.min_y)
+                (x - min_y) / (max_y - min_y)
         return scaled_x
 
     def cairo_draw_canvas(self):
         canvas_color = ColorTools.COLOR_3
         surface = cairo.ImageSurface(
             cairo.FORMAT_ARGB32,
-            self.rects()['path'][2] + 2 * self.PADDING,
-            self.rects()['path'][3] + 2 * self.PADDING
+            self.rects()['path'][2] + 2 * self.padding,
+            self.rects()['path'][3] + 2 * self.padding
         )
         ctx = cairo.Context(surface)
         ctx.set_source_rgba(
@@ -106,8 +140,8 @@ class ImageMaker:
         ctx.rectangle(
             0,
             0,
-            self.rects()['path'][2] + 2 * self.PADDING,
-            self.rects()['path'][3] + 2 * self.PADDING
+            self.rects()['path'][2] + 2 * self.padding,
+            self.rects()['path'][3] + 2 * self.padding
         )
         ctx.stroke()
         return surface
@@ -119,22 +153,24 @@ class ImageMaker:
         """
         surface = cairo.ImageSurface(
             cairo.FORMAT_ARGB32,
-            self.rects()['path'][2] + 2 * self.PADDING,
-            self.rects()['path'][3] + 2 * self.PADDING
+            self.rects()['path'][2] + 2 * self.padding,
+            self.rects()['path'][3] + 2 * self.padding
         )
         ctx = cairo.Context(surface)
         ctx.set_source_rgba(
             *ColorTools.to_rgba_source(ColorTools.COLOR_3)
         )
 
-        for note in NoteTools.note_range(self.min_note, self.max_note):
-            note_scaled = NoteTools.note_to_midi(note) if \
-                self.is_midi else NoteTools.note_to_freq(note)
-            y = self.to_image_dim(note_scaled, 'path_y')
-            ctx.move_to(0, y + self.PADDING)
-            ctx.line_to(self.rects()['path'][2], y + self.PADDING)
+        notes = NoteTools.midi_range(
+            self.analysis.min_note, self.analysis.max_note
+        )
+        if not self.analysis.is_midi:
+            notes = NoteTools.midi_to_freqs(notes)
+        for y in self.to_image_dim(notes, 'path_y'):
+            ctx.move_to(0, y + self.padding)
+            ctx.line_to(self.rects()['path'][2], y + self.padding)
         ctx.set_source_rgba(
-            **ColorTools.to_rgba_source(ColorTools.COLOR_3)
+            *ColorTools.to_rgba_source(ColorTools.COLOR_3)
         )
         ctx.stroke()
         return surface
@@ -145,20 +181,20 @@ class ImageMaker:
         """
         surface = cairo.ImageSurface(
             cairo.FORMAT_ARGB32,
-            self.rects()['path'][2] + 2 * self.PADDING,
-            self.rects()['path'][3] + 2 * self.PADDING
+            self.rects()['path'][2] + 2 * self.padding,
+            self.rects()['path'][3] + 2 * self.padding
         )
         ctx = cairo.Context(surface)
         for x, y in enumerate(self.samples):
-            if y == self.no_value or y == 0.0:
-                x1 = self.PADDING + self.to_image_dim(x - 0.5, 'path_x')
-                x2 = self.PADDING + self.to_image_dim(x + 0.5, 'path_x')
+            if y == self.analysis.no_value or y == 0.0:
+                x1 = self.padding + self.to_image_dim(x - 0.5, 'path_x')
+                x2 = self.padding + self.to_image_dim(x + 0.5, 'path_x')
                 width = x2 - x1
                 ctx.rectangle(
                     x1,
                     0,
                     width,
-                    self.rects()['path'][3] + 2 * self.PADDING
+                    self.rects()['path'][3] + 2 * self.padding
                 )
                 ctx.set_source_rgba(
                     *ColorTools.to_rgba_source(ColorTools.TRANSPARENT_2)
@@ -172,15 +208,15 @@ class ImageMaker:
         """
         surface = cairo.ImageSurface(
             cairo.FORMAT_ARGB32,
-            self.rects()['path'][2] + 2 * self.PADDING,
-            self.rects()['path'][3] + 2 * self.PADDING
+            self.rects()['path'][2] + 2 * self.padding,
+            self.rects()['path'][3] + 2 * self.padding
         )
         ctx = cairo.Context(surface)
         for x, y in enumerate(self.samples):
-            if y != self.no_value and y != 0.0:
-                x1 = self.PADDING + self.to_image_dim(x, 'path_x')
-                y1 = self.PADDING + self.to_image_dim(y, 'path_y')
-                ctx.arc(x1, y1, 12, 0, 2 * math.pi)
+            if y != self.analysis.no_value and y != 0.0:
+                x1 = self.padding + self.to_image_dim(x, 'path_x')
+                y1 = self.padding + self.to_image_dim(y, 'path_y')
+                ctx.arc(x1, y1, 12 * self.scale, 0, 2 * math.pi)
                 ctx.set_source_rgba(
                     *ColorTools.to_rgba_source(ColorTools.COLOR_6)
                 )
@@ -194,21 +230,21 @@ class ImageMaker:
         """
         surface = cairo.ImageSurface(
             cairo.FORMAT_ARGB32,
-            self.rects()['path'][2] + 2 * self.PADDING,
-            self.rects()['path'][3] + 2 * self.PADDING
+            self.rects()['path'][2] + 2 * self.padding,
+            self.rects()['path'][3] + 2 * self.padding
         )
         ctx = cairo.Context(surface)
         ctx.set_source_rgba(
             *ColorTools.to_rgba_source(ColorTools.COLOR_2)
         )
-        histo = self.histogram[0]
+        histo = self.analysis.histogram[0]
         histo_indexes = np.argsort(histo)
         c = 0
         for note in histo_indexes[::-1]:
             if note > 12:
                 y = self.to_image_dim(note, 'path_y')
-                ctx.move_to(0, y + self.PADDING)
-                ctx.line_to(self.rects()['path'][2], y + self.PADDING)
+                ctx.move_to(0, y + self.padding)
+                ctx.line_to(self.rects()['path'][2], y + self.padding)
                 c = c + 1
                 if c > leaders:
                     break
@@ -225,17 +261,17 @@ class ImageMaker:
         path_color = ColorTools.to_rgba_source(ColorTools.COLOR_4)
         surface = cairo.ImageSurface(
             cairo.FORMAT_ARGB32,
-            self.rects()['path'][2] + 2 * self.PADDING,
-            self.rects()['path'][3] + 2 * self.PADDING
+            self.rects()['path'][2] + 2 * self.padding,
+            self.rects()['path'][3] + 2 * self.padding
         )
         ctx = cairo.Context(surface)
         ctx.set_source_rgba(*path_color)
-        ctx.set_line_width(8)
+        ctx.set_line_width(8 * self.scale)
         ctx.set_line_join(cairo.LINE_JOIN_ROUND)
         for x, y in enumerate(self.samples):
-            if y != self.no_value and y != 0.0:
-                x1 = self.PADDING + self.to_image_dim(x, 'path_x')
-                y1 = self.PADDING + self.to_image_dim(y, 'path_y')
+            if y != self.analysis.no_value and y != 0.0:
+                x1 = self.padding + self.to_image_dim(x, 'path_x')
+                y1 = self.padding + self.to_image_dim(y, 'path_y')
                 ctx.line_to(x1, y1)
         ctx.stroke()
         return surface
@@ -296,51 +332,85 @@ class ImageMaker:
             self.rects()['text'][1]
         )
 
+    def background_surface(self):
+        """
+        The frame without the current sample. It does not change from
+        frame to frame: drawn once, then painted on every frame.
+        """
+        if self.background is None:
+            surface = cairo.ImageSurface(
+                cairo.FORMAT_ARGB32, self.width, self.height
+            )
+            ctx = cairo.Context(surface)
+            ctx.rectangle(0, 0, self.width, self.height)
+            ctx.set_source_rgba(
+                *ColorTools.to_rgba_source(ColorTools.COLOR_0)
+            )
+            ctx.fill()
+            self.cairo_draw_background(ctx)
+            surface.flush()
+            self.background = surface
+        return self.background
+
+    def draw_frame(self, surface, x):
+        """
+        Draw the frame of the sample x on a width x height surface
+        """
+        y = self.samples[x]
+        ctx = cairo.Context(surface)
+        # Add the background, replacing whatever the surface held
+        ctx.set_operator(cairo.OPERATOR_SOURCE)
+        self.cairo_set_source(ctx, self.background_surface(), 0, 0)
+        ctx.set_operator(cairo.OPERATOR_OVER)
+        # Add the foreground
+        if y != self.analysis.no_value and y != 0.0:
+            x1 = self.padding + \
+                self.to_image_dim(x, 'path_x') + \
+                self.rects()['path'][0]
+            y1 = self.padding + \
+                self.to_image_dim(y, 'path_y') + self.rects()['path'][1]
+            ctx.arc(x1, y1, 15 * self.scale, 0, 2 * math.pi)
+            ctx.set_source_rgba(
+                *ColorTools.to_rgba_source(ColorTools.COLOR_10)
+            )
+            ctx.fill()
+        surface.flush()
+        return surface
+
     def make_images(self):
         """
         Create the images to be used in the video
         """
         self.images = []
-        for x, y in enumerate(self.samples):
+        for x in self.frames():
             surface_join = cairo.ImageSurface(
-                cairo.FORMAT_ARGB32, self.WIDTH, self.HEIGHT
+                cairo.FORMAT_ARGB32, self.width, self.height
             )
-            ctx = cairo.Context(surface_join)
-            ctx.rectangle(0, 0, self.WIDTH, self.HEIGHT)
-            ctx.set_source_rgba(*ColorTools.to_rgba_source(ColorTools.COLOR_0))
-            ctx.fill()
-            # Add the background
-            self.cairo_draw_background(ctx)
-            # Add the foreground
-            if y != self.no_value and y != 0.0:
-                x1 = self.PADDING + \
-                    self.to_image_dim(x, 'path_x') + \
-                    self.rects()['path'][0]
-                y1 = self.PADDING + \
-                    self.to_image_dim(y, 'path_y') + self.rects()['path'][1]
-                ctx.arc(x1, y1, 15, 0, 2 * math.pi)
-                ctx.set_source_rgba(
-                    *ColorTools.to_rgba_source(ColorTools.COLOR_10)
-                )
-                ctx.fill()
-            self.images.append(surface_join)
+            self.images.append(self.draw_frame(surface_join, x))
         return self.images
 
+    def save_contact_sheet(self, imagepath):
+        """
+        Save a single image of the whole path
+        """
+        self.background_surface().write_to_png(imagepath)
+        return imagepath
+
     def cairo_draw_text(self):
         surface_text = cairo.ImageSurface(
             cairo.FORMAT_ARGB32,
             self.rects()['text'][2], self.rects()['text'][3])
         ctx = cairo.Context(surface_text)
         ctx.set_source_rgba(*ColorTools.to_rgba_source(ColorTools.COLOR_8))
-        ctx.set_font_size(120)
+        ctx.set_font_size(120 * self.scale)
         ctx.select_font_face(
             "Roboto",
             cairo.FONT_SLANT_NORMAL,
             cairo.FONT_WEIGHT_NORMAL
         )
-        (x, y, width, height, dx, dy) = ctx.text_extents(self.data['title'])
-        ctx.move_to(self.PADDING,  height + self.PADDING)
-        ctx.show_text(self.data['title'])
+        (x, y, width, height, dx, dy) = ctx.text_extents(self.analysis.title)
+        ctx.move_to(self.padding,  height + self.padding)
+        ctx.show_text(self.analysis.title)
         return surface_text
 
     def save_images(self, targetdir=None):
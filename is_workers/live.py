@@ -0,0 +1,189 @@
+"""
+Live intonation: pitch points of an audio stream as soon as every hop
+is complete.
+The stream is 16 bit little endian mono PCM, read from stdin, a pipe,
+a socket or a WebSocket served next to Django (see is_project/asgi.py).
+"""
+import argparse
+import asyncio
+import json
+import socket
+import sys
+import time
+from urllib.parse import parse_qs
+
+import numpy as np
+
+from audio import AudioAnalyst
+from audiofile import audio_cache
+from medialib import library
+from models import PitchAnalysis
+from utils import path_in_medialib
+
+
+class LivePitchTracker:
+    """
+    Run hop sized blocks through the pitch object of an AudioAnalyst,
+    one point per block, as AudioAnalyst.analyse would find them.
+    """
+    SAMPLE_WIDTH = 2
+    # seconds between the end of a hop and its point
+    LATENCY_BUDGET = 0.1
+
+    def __init__(self, title='live', samplerate=12800, hop=512):
+        self.analyst = AudioAnalyst(
+            'live',
+            title,
+            samplerate=samplerate,
+            hop=hop,
+            signal=np.empty(0, dtype=np.float32)
+        )
+        self.samplerate = samplerate
+        self.hop = hop
+        self.index = 0
+        self.pending = bytearray()
+
+    def feed(self, samples):
+        """
+        Point of a block of hop float32 samples
+        """
+        pitch = float(self.analyst.pitch_o(samples)[0])
+        confidence = float(self.analyst.pitch_o.get_confidence())
+        point = {
+            'index': self.index,
+            'time': self.index * self.hop / self.samplerate,
+            'pitch': pitch if pitch > 12.0 else PitchAnalysis.NO_VALUE,
+            'confidence': confidence,
+        }
+        self.index += 1
+        return point
+
+    def feed_pcm(self, data):
+        """
+        Points of every hop completed by the data, the rest is kept
+        """
+        self.pending += data
+        block_size = self.hop * self.SAMPLE_WIDTH
+        blocks = len(self.pending) // block_size
+        if not blocks:
+            return []
+        pcm = np.frombuffer(
+            bytes(self.pending[:blocks * block_size]), dtype='<i2'
+        )
+        del self.pending[:blocks * block_size]
+        samples = (pcm / 32768).astype(np.float32).reshape(blocks, self.hop)
+        return [self.feed(block) for block in samples]
+
+    def read(self, stream):
+        """
+        Yield the points of a binary stream until it ends
+        """
+        block_size = self.hop * self.SAMPLE_WIDTH
+        while True:
+            data = stream.read(block_size)
+            if not data:
+                return
+            yield from self.feed_pcm(data)
+
+    async def replay(self, filepath, send_point):
+        """
+        Send the points of an audio file at real-time pace,
+        each with its delay after the end of its hop
+        """
+        signal = audio_cache.open(filepath).signal(self.samplerate)
+        started = time.monotonic()
+        for start in range(0, signal.size - self.hop + 1, self.hop):
+            # the hop is complete once its last sample is played
+            due = started + (start + self.hop) / self.samplerate
+            await asyncio.sleep(max(0, due - time.monotonic()))
+            point = self.feed(signal[start:start + self.hop])
+            point['latency'] = time.monotonic() - due
+            await send_point(point)
+
+
+class LiveSocket:
+    """
+    ASGI WebSocket application.
+    Binary messages carry PCM, every point goes back as a JSON text
+    message. ?replay=<file> plays a sample or library file instead,
+    ?samplerate= sets the rate of the sent PCM, a rate out of
+    SAMPLERATES closes the socket with POLICY_VIOLATION.
+    """
+    PATH = '/live/'
+    SAMPLERATES = range(8000, 96001)
+    POLICY_VIOLATION = 1008
+
+    @classmethod
+    def samplerate(cls, query):
+        """
+        Rate of the sent PCM, None if not a supported integer
+        """
+        try:
+            samplerate = int(query.get('samplerate', ['12800'])[0])
+        except ValueError:
+            return None
+        return samplerate if samplerate in cls.SAMPLERATES else None
+
+    @staticmethod
+    def replay_path(name):
+        name = name.replace('\\', '/').rsplit('/', 1)[-1]
+        return library.path(name) if library.exists(name) \
+            else path_in_medialib(name)
+
+    async def __call__(self, scope, receive, send):
+        message = await receive()
+        if message['type'] != 'websocket.connect':
+            return
+        query = parse_qs(scope.get('query_string', b'').decode())
+        samplerate = self.samplerate(query)
+        await send({'type': 'websocket.accept'})
+        if samplerate is None:
+            await send({
+                'type': 'websocket.close',
+                'code': self.POLICY_VIOLATION,
+                'reason': 'samplerate must be an integer from %d to %d' % (
+                    self.SAMPLERATES.start, self.SAMPLERATES.stop - 1
+                ),
+            })
+            return
+        tracker = LivePitchTracker(samplerate=samplerate)
+
+        async def send_point(point):
+            await send({'type': 'websocket.send', 'text': json.dumps(point)})
+
+        if 'replay' in query:
+            await tracker.replay(
+                self.replay_path(query['replay'][0]), send_point
+            )
+            await send({'type': 'websocket.close', 'code': 1000})
+            return
+        while True:
+            message = await receive()
+            if message['type'] == 'websocket.disconnect':
+                return
+            for point in tracker.feed_pcm(message.get('bytes') or b''):
+                await send_point(point)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'source', nargs='?', default='-',
+        help='- for stdin, host:port for a socket or a file to replay'
+    )
+    parser.add_argument('--samplerate', type=int, default=12800)
+    args = parser.parse_args()
+    tracker = LivePitchTracker(samplerate=args.samplerate)
+    if args.source == '-':
+        points = tracker.read(sys.stdin.buffer)
+    elif ':' in args.source:
+        host, port = args.source.rsplit(':', 1)
+        connection = socket.create_connection((host, int(port)))
+        points = tracker.read(connection.makefile('rb'))
+    else:
+        async def print_point(point):
+            print(json.dumps(point), flush=True)
+        asyncio.run(tracker.replay(args.source, print_point))
+        points = []
+    for point in points:
+        print(json.dumps(point), flush=True)
@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from contextlib import contextmanager
+
+
+class MediaLibrary:
+    """
+    Store of the generated artifacts.
+    An artifact is found by name in a shard picked by the hash of the
+    name: <root>/ab/cd/<name>, so no lookup ever lists a directory.
+    Files are written aside and renamed in place once complete,
+    work directories are unique.
+    """
+    DEFAULT_ROOT = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'media'
+    )
+    WORK_DIR = 'work'
+    PARTIAL_PREFIX = '.part-'
+    UPLOADED_SUFFIX = '.uploaded'
+    ANALYSED_SUFFIX = '.analysed'
+
+    def __init__(self, root=None):
+        self.root = root or os.environ.get('IS_MEDIALIB', self.DEFAULT_ROOT)
+
+    @staticmethod
+    def key(*parts):
+        """
+        Content address of an artifact made from the given parameters
+        """
+        return hashlib.sha1(
+            json.dumps(parts, sort_keys=True).encode('utf8')
+        ).hexdigest()
+
+    @staticmethod
+    def digest(name):
+        return hashlib.sha1(name.encode('utf8')).hexdigest()
+
+    def shard(self, name):
+        digest = self.digest(name)
+        return os.path.join(self.root, digest[:2], digest[2:4])
+
+    def path(self, name):
+        return os.path.join(self.shard(name), name)
+
+    def exists(self, name):
+        return os.path.exists(self.path(name))
+
+    @contextmanager
+    def atomic(self, name):
+        """
+        Yield a temporary path next to the artifact, renamed to the
+        artifact when the block succeeds and removed otherwise.
+        The temporary path keeps the extension for ffmpeg.
+        """
+        shard = self.shard(name)
+        os.makedirs(shard, exist_ok=True)
+        partial_path = os.path.join(
+            shard, f'{self.PARTIAL_PREFIX}{uuid.uuid4().hex}-{name}'
+        )
+        try:
+            yield partial_path
+            os.replace(partial_path, os.path.join(shard, name))
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+
+    def workdir(self, prefix='work'):
+        """
+        Create a new directory no other process can get
+        """
+        name = f'{prefix}_{uuid.uuid4().hex}'
+        digest = self.digest(name)
+        path = os.path.join(
+            self.root, self.WORK_DIR, digest[:2], digest[2:4], name
+        )
+        os.makedirs(path)
+        return path
+
+    def shards(self, workdirs=False):
+        """
+        Shard directories in a stable order
+        """
+        top = os.path.join(self.root, self.WORK_DIR) if workdirs \
+            else self.root
+        if not os.path.isdir(top):
+            return
+        for first in sorted(os.listdir(top)):
+            if len(first) != 2:
+                continue
+            first_path = os.path.join(top, first)
+            for second in sorted(os.listdir(first_path)):
+                yield os.path.join(first_path, second)
+
+    def scan(self, workdirs=False):
+        """
+        DirEntry of every artifact, stat results come with the listing
+        """
+        for shard in self.shards(workdirs):
+            yield from self.scan_shard(shard)
+
+    @staticmethod
+    def scan_shard(shard):
+        with os.scandir(shard) as entries:
+            yield from entries
+
+    def mark_uploaded(self, video_path, video_id):
+        """
+        Record that a video reached YouTube
+        """
+        name = f'{os.path.basename(video_path)}{self.UPLOADED_SUFFIX}'
+        with self.atomic(name) as partial_path:
+            with open(partial_path, 'w') as out:
+                out.write(video_id)
+
+    def mark_analysed(self, audio_path, json_path):
+        """
+        Record where the analysis of an audio file of the library is
+        saved, the audio is kept while the analysis exists
+        """
+        name = os.path.basename(audio_path)
+        if os.path.realpath(audio_path) != os.path.realpath(self.path(name)):
+            return
+        with self.atomic(f'{name}{self.ANALYSED_SUFFIX}') as partial_path:
+            with open(partial_path, 'w') as out:
+                out.write(os.path.abspath(json_path))
+
+    def analysis_path(self, name):
+        """
+        Analysis recorded by mark_analysed, None if missing or removed
+        """
+        marker = self.path(f'{name}{self.ANALYSED_SUFFIX}')
+        try:
+            with open(marker) as marked:
+                json_path = marked.read()
+        except FileNotFoundError:
+            return None
+        return json_path if os.path.exists(json_path) else None
+
+    def remove(self, path):
+        """
+        Remove an artifact or a work directory, return the freed bytes
+        """
+        if os.path.isdir(path):
+            size = sum(
+                entry.stat().st_size for entry in os.scandir(path)
+                if entry.is_file()
+            )
+            shutil.rmtree(path)
+            return size
+        size = os.path.getsize(path)
+        os.remove(path)
+        return size
+
+
+library = MediaLibrary()
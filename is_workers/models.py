@@ -1,4 +1,9 @@
-from dataclasses import dataclass
+import json
+from dataclasses import dataclass, replace
+
+import numpy as np
+
+from utils import NoteTools
 
 
 @dataclass
@@ -9,3 +14,162 @@ class YoutubeVideo:
     category: str = ''
     keywords: str = 'pronunciation, intonation'
     privacyStatus: str = 'public'
+
+
+@dataclass
+class PitchAnalysis:
+    """
+    Result of an audio analysis.
+    Made by the AudioAnalyst, drawn by the ImageMaker.
+    Unvoiced samples hold no_value, confidences come from the pitch
+    tracker.
+    """
+    __slots__ = (
+        'samples', 'confidences', 'title', 'filename', 'unit',
+        'samplerate', 'hop', 'tolerance', 'silence', 'max_x', 'min_y',
+        'max_y', 'min_note', 'max_note', 'histogram', 'no_value'
+    )
+    NO_VALUE = 0.0
+
+    samples: np.ndarray
+    confidences: np.ndarray
+    title: str
+    filename: str
+    unit: str
+    samplerate: int
+    hop: int
+    tolerance: float
+    silence: float
+    max_x: int
+    min_y: float
+    max_y: float
+    min_note: str
+    max_note: str
+    histogram: tuple
+    no_value: float
+
+    @property
+    def is_midi(self):
+        return self.unit == 'midi'
+
+    @property
+    def voiced(self):
+        """
+        Mask of the samples where the pitch is defined
+        """
+        return (self.samples != self.no_value) & (self.samples != 0.0)
+
+    def notes(self):
+        """
+        Note name of every sample, empty where unvoiced
+        """
+        to_notes = NoteTools.midi_to_notes if self.is_midi \
+            else NoteTools.freqs_to_notes
+        voiced = self.voiced
+        notes = np.full(
+            self.samples.shape, '', dtype=NoteTools.NOTE_NAMES.dtype
+        )
+        notes[voiced] = to_notes(self.samples[voiced])
+        return notes
+
+    @staticmethod
+    def stats(samples, no_value=NO_VALUE, is_midi=True):
+        """
+        Range, notes and histogram of the voiced samples
+        """
+        voiced = samples[samples != no_value]
+        max_y = float(np.max(voiced)) if voiced.size else no_value
+        min_y = float(np.min(voiced)) if voiced.size else no_value
+        # bin i counts the pitches between i and i + 1
+        top = max(int(max_y), 0) + 1
+        histogram = np.histogram(voiced, bins=top, range=(0, top))
+        to_notes = NoteTools.midi_to_notes if is_midi \
+            else NoteTools.freqs_to_notes
+        max_note, min_note = to_notes([max_y, min_y]).tolist()
+        return {
+            'max_x': samples.size,
+            'min_y': min_y,
+            'max_y': max_y,
+            'min_note': min_note,
+            'max_note': max_note,
+            'histogram': histogram,
+        }
+
+    def with_samples(self, samples):
+        """
+        Copy with other samples and their stats
+        """
+        return replace(
+            self,
+            samples=samples,
+            **self.stats(samples, self.no_value, self.is_midi)
+        )
+
+    def to_dict(self):
+        """
+        JSON serializable form
+        """
+        counts, edges = self.histogram
+        return {
+            'samples': self.samples.tolist(),
+            'confidences': self.confidences.tolist(),
+            'title': self.title,
+            'filename': self.filename,
+            'unit': self.unit,
+            'samplerate': self.samplerate,
+            'hop': self.hop,
+            'tolerance': self.tolerance,
+            'silence': self.silence,
+            'max_x': self.max_x,
+            'min_y': self.min_y,
+            'max_y': self.max_y,
+            'min_note': self.min_note,
+            'max_note': self.max_note,
+            'histogram': [counts.tolist(), edges.tolist()],
+            'no_value': self.no_value,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Inverse of to_dict. Missing keys raise a KeyError.
+        Analyses saved before no_value existed mark unvoiced
+        samples with null, the ones saved before confidences
+        existed are fully confident.
+        """
+        no_value = float(data.get('no_value', cls.NO_VALUE))
+        samples = np.array(
+            [no_value if y is None else y for y in data['samples']],
+            dtype=float
+        )
+        confidences = np.array(
+            data.get('confidences', np.ones(samples.size)), dtype=float
+        )
+        counts, edges = data['histogram']
+        return cls(
+            samples=samples,
+            confidences=confidences,
+            title=data['title'],
+            filename=data['filename'],
+            unit=data['unit'],
+            samplerate=int(data['samplerate']),
+            hop=int(data['hop']),
+            tolerance=float(data['tolerance']),
+            silence=float(data['silence']),
+            max_x=int(data['max_x']),
+            min_y=float(data['min_y']),
+            max_y=float(data['max_y']),
+            min_note=data['min_note'],
+            max_note=data['max_note'],
+            histogram=(np.array(counts), np.array(edges)),
+            no_value=no_value,
+        )
+
+    def save(self, filepath):
+        with open(filepath, 'w') as json_file:
+            json.dump(self.to_dict(), json_file)
+
+    @classmethod
+    def load(cls, filepath):
+        with open(filepath) as json_file:
+            return cls.from_dict(json.load(json_file))
@@ -0,0 +1,195 @@
+import numpy as np
+
+from utils import NoteTools
+
+
+class PitchPostProcessor:
+    """
+    Clean the pitch tracks of many analyses at once.
+    The tracks are stacked in a (tracks, frames) array padded with
+    unvoiced frames and every step works on the whole array:
+    - confidence gating unvoices the frames the tracker was unsure of,
+    - octave errors are corrected by a Viterbi search over octave
+      shifts, favouring the smallest jumps between voiced frames,
+    - a median filter removes single frame spikes,
+    - short unvoiced gaps between voiced frames are interpolated.
+    Pitches are processed in semitones, frequencies are converted.
+    """
+    MIN_CONFIDENCE = 0.5
+    MEDIAN = 5
+    MAX_GAP = 3
+    # semitones a shifted frame must save to be moved by an octave
+    OCTAVE_COST = 4.0
+    # MIDI range of the voices, shifts leaving it are not considered
+    MIDI_RANGE = (24, 96)
+    SHIFTS = np.array([-12.0, 0.0, 12.0])
+
+    def __init__(
+        self,
+        min_confidence=MIN_CONFIDENCE,
+        median=MEDIAN,
+        max_gap=MAX_GAP,
+        octave_cost=OCTAVE_COST,
+        midi_range=MIDI_RANGE
+    ):
+        """
+        A median window of 1, a max_gap of 0 or an octave_cost of None
+        turn the matching step off
+        """
+        self.min_confidence = min_confidence
+        self.median = median
+        self.max_gap = max_gap
+        self.octave_cost = octave_cost
+        self.midi_range = midi_range
+
+    @staticmethod
+    def stack(tracks, fill=np.nan):
+        lengths = np.array([len(track) for track in tracks])
+        stacked = np.full((len(tracks), lengths.max(initial=0)), fill)
+        stacked[np.arange(stacked.shape[1]) < lengths[:, None]] = \
+            np.concatenate(tracks) if len(tracks) else []
+        return stacked, lengths
+
+    def gate(self, pitches, confidences):
+        """
+        Unvoice the frames under the minimum confidence
+        """
+        return np.where(confidences >= self.min_confidence, pitches, np.nan)
+
+    def correct_octaves(self, pitches):
+        """
+        Most likely octave of every voiced frame
+        """
+        tracks, frames = pitches.shape
+        shifts = self.SHIFTS
+        states = shifts.size
+        low, high = self.midi_range
+        penalty = self.octave_cost * (shifts != 0)
+        cost = np.zeros((tracks, states))
+        last = np.full(tracks, np.nan)
+        pointers = np.empty((frames, tracks, states), dtype=np.int8)
+        keep = np.broadcast_to(np.arange(states, dtype=np.int8), cost.shape)
+        for frame in range(frames):
+            pitch = pitches[:, frame]
+            voiced = ~np.isnan(pitch)
+            candidates = pitch[:, None] + shifts
+            valid = (candidates >= low) & (candidates <= high)
+            # a pitch out of range in every octave is left as it is
+            valid |= ~valid.any(axis=1, keepdims=True) & (shifts == 0)
+            emission = np.where(valid, penalty, np.inf)
+            # (tracks, from state, to state)
+            jumps = np.abs(
+                candidates[:, None, :] - (last[:, None] + shifts)[:, :, None]
+            )
+            jumps = np.where(np.isnan(jumps), 0, jumps)
+            total = cost[:, :, None] + jumps
+            best = np.argmin(total, axis=1)
+            moved = np.take_along_axis(total, best[:, None, :], 1)[:, 0]
+            # unvoiced frames keep the states of the last voiced one
+            pointers[frame] = np.where(voiced[:, None], best, keep)
+            cost = np.where(voiced[:, None], moved + emission, cost)
+            cost -= np.min(cost, axis=1, keepdims=True)
+            last = np.where(voiced, pitch, last)
+        state = np.argmin(cost, axis=1)
+        chosen = np.empty((tracks, frames), dtype=np.int8)
+        rows = np.arange(tracks)
+        for frame in range(frames - 1, -1, -1):
+            chosen[:, frame] = state
+            state = pointers[frame, rows, state]
+        return pitches + shifts[chosen]
+
+    def median_filter(self, pitches):
+        """
+        Median of the voiced frames around every voiced frame
+        """
+        half = self.median // 2
+        padded = np.pad(
+            pitches, ((0, 0), (half, half)), constant_values=np.nan
+        )
+        windows = np.lib.stride_tricks.sliding_window_view(
+            padded, self.median, axis=1
+        )
+        voiced = ~np.isnan(pitches)
+        # unvoiced frames sort last, a voiced frame is in its own window
+        ordered = np.sort(windows[voiced], axis=1)
+        count = np.count_nonzero(~np.isnan(ordered), axis=1)
+        rows = np.arange(ordered.shape[0])
+        filtered = pitches.copy()
+        filtered[voiced] = (
+            ordered[rows, (count - 1) // 2] + ordered[rows, count // 2]
+        ) / 2
+        return filtered
+
+    def fill_gaps(self, pitches):
+        """
+        Interpolate unvoiced runs of at most max_gap frames
+        """
+        frames = np.arange(pitches.shape[1])
+        voiced = ~np.isnan(pitches)
+        previous = np.maximum.accumulate(
+            np.where(voiced, frames, -1), axis=1
+        )
+        following = np.minimum.accumulate(
+            np.where(voiced, frames, pitches.shape[1])[:, ::-1], axis=1
+        )[:, ::-1]
+        gap = ~voiced & (previous >= 0) & \
+            (following < pitches.shape[1]) & \
+            (following - previous - 1 <= self.max_gap)
+        if not gap.any():
+            return pitches
+        start = np.take_along_axis(pitches, np.maximum(previous, 0), 1)
+        end = np.take_along_axis(
+            pitches, np.minimum(following, pitches.shape[1] - 1), 1
+        )
+        position = (frames - previous) / np.maximum(following - previous, 1)
+        filled = pitches.copy()
+        filled[gap] = (start + (end - start) * position)[gap]
+        return filled
+
+    def process_tracks(self, tracks, confidences, no_value=0.0, is_midi=True):
+        """
+        Clean many pitch tracks, unvoiced frames hold no_value
+        """
+        pitches, lengths = self.stack(
+            [np.asarray(track, dtype=float) for track in tracks]
+        )
+        confidences = self.stack(
+            [np.asarray(track, dtype=float) for track in confidences], 0.0
+        )[0]
+        pitches[pitches == no_value] = np.nan
+        if not is_midi:
+            pitches = NoteTools.freqs_to_midi(pitches)
+        pitches = self.gate(pitches, confidences)
+        if self.octave_cost is not None:
+            pitches = self.correct_octaves(pitches)
+        if self.median > 1:
+            pitches = self.median_filter(pitches)
+        if self.max_gap:
+            pitches = self.fill_gaps(pitches)
+        if not is_midi:
+            pitches = NoteTools.midi_to_freqs(pitches)
+        pitches[np.isnan(pitches)] = no_value
+        return [pitches[row, :length] for row, length in enumerate(lengths)]
+
+    def process_many(self, analyses):
+        """
+        Cleaned copies of analyses sharing the same unit
+        """
+        if not analyses:
+            return []
+        units = {analysis.unit for analysis in analyses}
+        if len(units) > 1:
+            raise ValueError(f'Analyses with different units: {units}')
+        tracks = self.process_tracks(
+            [analysis.samples for analysis in analyses],
+            [analysis.confidences for analysis in analyses],
+            analyses[0].no_value,
+            analyses[0].is_midi
+        )
+        return [
+            analysis.with_samples(samples)
+            for analysis, samples in zip(analyses, tracks)
+        ]
+
+    def process(self, analysis):
+        return self.process_many([analysis])[0]
@@ -0,0 +1,442 @@
+"""
+Upload scheduler in front of initialize_upload.
+Pending uploads wait in a SQLite file with their priority, so the queue
+survives restarts. Every channel uploads in its own thread and every
+upload reserves its videos.insert units from the daily quota of the
+project of the channel before starting: an exhausted project waits for
+the quota reset instead of failing its uploads, and the uploads of a
+project are spread over what is left of the quota day. A channel over
+its own upload limit is put on hold alone.
+With a validator, broken videos are refused when queued and checked
+again, from the probe cache, before their upload.
+"""
+import argparse
+import datetime
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+from zoneinfo import ZoneInfo
+
+from googleapiclient.errors import HttpError
+
+from models import YoutubeVideo
+from upload import (
+    QuotaExceeded, UploadError, get_authenticated_service, initialize_upload
+)
+from validate import InvalidVideo, VideoValidator
+
+BASEDIR = os.path.dirname(os.path.abspath(__file__))
+STATE_PATH = os.path.join(BASEDIR, 'uploads.sqlite3')
+
+
+@dataclass
+class Channel:
+    """
+    Credentials uploading to one channel.
+    connect returns the API service, it is called in the channel thread
+    before every upload so that the token is refreshed ahead of expiry.
+    """
+    name: str
+    project: str
+    connect: Callable[[], Any]
+
+
+@dataclass
+class UploadJob:
+    id: int
+    video: YoutubeVideo
+    priority: int
+    channel: Optional[str]
+    attempts: int
+
+
+class UploadScheduler:
+    # quota units of a videos.insert call, and of a project per day
+    INSERT_COST = 1600
+    DAILY_QUOTA = 10000
+    # the quota day starts at midnight Pacific Time
+    QUOTA_TIMEZONE = 'America/Los_Angeles'
+    MAX_ATTEMPTS = 5
+    RETRY_DELAY = 60
+    # seconds between two looks at the jobs other channels are uploading
+    POLL_DELAY = 1.0
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY,
+            file TEXT NOT NULL,
+            title TEXT NOT NULL,
+            description TEXT,
+            category TEXT,
+            keywords TEXT,
+            privacy TEXT,
+            priority INTEGER NOT NULL DEFAULT 0,
+            channel TEXT,
+            state TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            not_before REAL NOT NULL DEFAULT 0,
+            video_id TEXT,
+            error TEXT
+        );
+        CREATE INDEX IF NOT EXISTS jobs_pending_idx
+            ON jobs (state, priority DESC, id);
+        CREATE TABLE IF NOT EXISTS quota (
+            project TEXT PRIMARY KEY,
+            day TEXT NOT NULL,
+            used INTEGER NOT NULL DEFAULT 0,
+            last_start REAL NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS holds (
+            channel TEXT PRIMARY KEY,
+            until REAL NOT NULL
+        );
+    """
+
+    def __init__(
+        self,
+        channels,
+        state_path=STATE_PATH,
+        quotas=None,
+        spread=True,
+        clock=time.time,
+        upload=initialize_upload,
+        validator=None
+    ):
+        """
+        quotas maps projects to their daily units if not DAILY_QUOTA,
+        spread paces the uploads of a project over the quota day,
+        validator is a VideoValidator checking the files
+        """
+        self.channels = {channel.name: channel for channel in channels}
+        self.validator = validator
+        self.quotas = quotas or {}
+        self.spread = spread
+        self.clock = clock
+        self.upload = upload
+        self.timezone = ZoneInfo(self.QUOTA_TIMEZONE)
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.db = sqlite3.connect(
+            state_path, isolation_level=None, check_same_thread=False,
+            timeout=30
+        )
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(self.SCHEMA)
+        # uploads cut by a crash start again
+        self.db.execute(
+            "UPDATE jobs SET state = 'pending' WHERE state = 'running'"
+        )
+
+    def close(self):
+        self.db.close()
+
+    def add(self, video, priority=0, channel=None):
+        """
+        Queue a YoutubeVideo, higher priorities upload first.
+        Raise InvalidVideo if the validator refuses the file.
+        """
+        if self.validator:
+            self.validator.validate(video.file)
+        with self.lock:
+            return self.db.execute(
+                'INSERT INTO jobs (file, title, description, category, '
+                'keywords, privacy, priority, channel) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (
+                    video.file, video.title, video.description,
+                    video.category, video.keywords, video.privacyStatus,
+                    priority, channel
+                )
+            ).lastrowid
+
+    def quota_day(self, now):
+        """
+        Current quota day and seconds until it ends
+        """
+        local = datetime.datetime.fromtimestamp(now, self.timezone)
+        midnight = datetime.datetime.combine(
+            local.date() + datetime.timedelta(days=1),
+            datetime.time(),
+            self.timezone
+        )
+        return local.date().isoformat(), midnight.timestamp() - now
+
+    def quota(self, project, now):
+        """
+        Units used by a project today and its last upload start
+        """
+        day, _ = self.quota_day(now)
+        row = self.db.execute(
+            'SELECT day, used, last_start FROM quota WHERE project = ?',
+            (project,)
+        ).fetchone()
+        if row is None or row['day'] != day:
+            return 0, 0.0
+        return row['used'], row['last_start']
+
+    def set_quota(self, project, used, last_start, now):
+        self.db.execute(
+            'INSERT OR REPLACE INTO quota (project, day, used, last_start) '
+            'VALUES (?, ?, ?, ?)',
+            (project, self.quota_day(now)[0], used, last_start)
+        )
+
+    def quota_wait(self, project, now):
+        """
+        Seconds before the project can start an upload
+        """
+        limit = self.quotas.get(project, self.DAILY_QUOTA)
+        used, last_start = self.quota(project, now)
+        left = (limit - used) // self.INSERT_COST
+        seconds_left = self.quota_day(now)[1]
+        if left <= 0:
+            return seconds_left
+        if not self.spread or not last_start:
+            return 0.0
+        return max(0.0, last_start + seconds_left / left - now)
+
+    def hold_wait(self, channel, now):
+        """
+        Seconds before a channel on hold can upload again
+        """
+        row = self.db.execute(
+            'SELECT until FROM holds WHERE channel = ?', (channel.name,)
+        ).fetchone()
+        return 0.0 if row is None else max(0.0, row['until'] - now)
+
+    def claim(self, channel):
+        """
+        Next job of a channel with its quota units reserved,
+        or None and the seconds to wait for one, None if no job is left.
+        Jobs other channels are uploading may come back to the queue,
+        the channel waits for them.
+        """
+        now = self.clock()
+        pending = "state = 'pending' AND (channel IS NULL OR channel = ?)"
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                retry_at = self.db.execute(
+                    f'SELECT MIN(not_before) FROM jobs WHERE {pending}',
+                    (channel.name,)
+                ).fetchone()[0]
+                quota_wait = max(
+                    self.quota_wait(channel.project, now),
+                    self.hold_wait(channel, now)
+                )
+                if retry_at is None and self.db.execute(
+                    "SELECT 1 FROM jobs WHERE state = 'running' "
+                    'AND (channel IS NULL OR channel = ?) LIMIT 1',
+                    (channel.name,)
+                ).fetchone():
+                    retry_at = now + self.POLL_DELAY
+                wait = None if retry_at is None \
+                    else max(quota_wait, retry_at - now)
+                row = None if wait is None or quota_wait > 0 \
+                    else self.db.execute(
+                        f'SELECT * FROM jobs WHERE {pending} '
+                        'AND not_before <= ? '
+                        'ORDER BY priority DESC, id LIMIT 1',
+                        (channel.name, now)
+                    ).fetchone()
+                if row is None:
+                    self.db.execute('COMMIT')
+                    return None, wait
+                used, _ = self.quota(channel.project, now)
+                self.set_quota(
+                    channel.project, used + self.INSERT_COST, now, now
+                )
+                self.db.execute(
+                    "UPDATE jobs SET state = 'running', "
+                    'attempts = attempts + 1 WHERE id = ?',
+                    (row['id'],)
+                )
+                self.db.execute('COMMIT')
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+        return UploadJob(
+            id=row['id'],
+            video=YoutubeVideo(
+                file=row['file'],
+                title=row['title'],
+                description=row['description'],
+                category=row['category'],
+                keywords=row['keywords'],
+                privacyStatus=row['privacy'],
+            ),
+            priority=row['priority'],
+            channel=channel.name,
+            attempts=row['attempts'] + 1,
+        ), 0.0
+
+    def finish(
+        self, job, state, video_id=None, error=None, not_before=0,
+        attempt=True
+    ):
+        """
+        Record the outcome of a job, not an attempt if the upload was
+        refused before starting
+        """
+        with self.lock:
+            self.db.execute(
+                'UPDATE jobs SET state = ?, video_id = ?, error = ?, '
+                'not_before = ?, attempts = attempts - ? WHERE id = ?',
+                (state, video_id, error, not_before, int(not attempt), job.id)
+            )
+
+    def exhaust(self, project):
+        """
+        The API refused an upload: nothing more today
+        """
+        now = self.clock()
+        with self.lock:
+            self.set_quota(
+                project, self.quotas.get(project, self.DAILY_QUOTA), now, now
+            )
+
+    def hold(self, channel):
+        """
+        The API refused an upload of the channel alone: nothing more
+        from it before the next quota day
+        """
+        now = self.clock()
+        with self.lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO holds (channel, until) VALUES (?, ?)',
+                (channel.name, now + self.quota_day(now)[1])
+            )
+
+    def upload_next(self, channel, service):
+        """
+        Upload the next job of a channel,
+        return the job or None and the seconds to wait
+        """
+        job, wait = self.claim(channel)
+        if job is None:
+            return None, wait
+        if self.validator:
+            # changed since it was queued
+            validation = self.validator.check(job.video.file)
+            if not validation.ok:
+                self.finish(
+                    job, 'failed', error='; '.join(validation.errors),
+                    attempt=False
+                )
+                return job, 0.0
+        try:
+            response = self.upload(service, job.video)
+        except QuotaExceeded as e:
+            if e.channel:
+                self.hold(channel)
+            else:
+                self.exhaust(channel.project)
+            self.finish(job, 'pending', error=str(e), attempt=False)
+            now = self.clock()
+            return None, max(
+                self.quota_wait(channel.project, now),
+                self.hold_wait(channel, now)
+            )
+        except HttpError as e:
+            # refused for good: bad request, forbidden
+            self.finish(job, 'failed', error=str(e))
+            return job, 0.0
+        except (UploadError, OSError) as e:
+            if job.attempts >= self.MAX_ATTEMPTS:
+                self.finish(job, 'failed', error=str(e))
+            else:
+                self.finish(
+                    job, 'pending', error=str(e),
+                    not_before=self.clock() + self.RETRY_DELAY * job.attempts
+                )
+            return job, 0.0
+        self.finish(job, 'done', video_id=response['id'])
+        return job, 0.0
+
+    def run_channel(self, channel, max_wait):
+        while not self.stopped.is_set():
+            job, wait = self.upload_next(channel, channel.connect())
+            if job is not None:
+                continue
+            if wait is None or wait > max_wait:
+                return
+            self.stopped.wait(wait)
+
+    def run(self, max_wait=float('inf')):
+        """
+        Upload with every channel in parallel. A channel stops when no
+        job is left for it or its next upload is more than max_wait
+        seconds away.
+        """
+        threads = [
+            threading.Thread(
+                target=self.run_channel, args=(channel, max_wait),
+                name=f'upload-{channel.name}'
+            )
+            for channel in self.channels.values()
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def stop(self):
+        self.stopped.set()
+
+    def counts(self):
+        """
+        Number of jobs by state
+        """
+        with self.lock:
+            return dict(self.db.execute(
+                'SELECT state, COUNT(*) FROM jobs GROUP BY state'
+            ).fetchall())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--state', default=STATE_PATH)
+    commands = parser.add_subparsers(dest='command', required=True)
+    add_parser = commands.add_parser('add')
+    add_parser.add_argument('file')
+    add_parser.add_argument('title')
+    add_parser.add_argument('--priority', type=int, default=0)
+    add_parser.add_argument('--channel')
+    run_parser = commands.add_parser('run')
+    run_parser.add_argument(
+        'channels', nargs='+',
+        help='name:project:client_secret.json of every channel'
+    )
+    run_parser.add_argument(
+        '--max-wait', type=float, default=float('inf'),
+        help='seconds to wait for quota before stopping'
+    )
+    args = parser.parse_args()
+    if args.command == 'add':
+        scheduler = UploadScheduler(
+            [], args.state, validator=VideoValidator()
+        )
+        try:
+            scheduler.add(
+                YoutubeVideo(file=args.file, title=args.title),
+                args.priority,
+                args.channel
+            )
+        except InvalidVideo as e:
+            exit('Not queued: %s' % e)
+    else:
+        channels = []
+        for spec in args.channels:
+            name, project, secrets = spec.split(':', 2)
+            channels.append(Channel(
+                name, project,
+                lambda secrets=secrets: get_authenticated_service(secrets)
+            ))
+        scheduler = UploadScheduler(
+            channels, args.state, validator=VideoValidator()
+        )
+        scheduler.run(args.max_wait)
+    print(scheduler.counts())
+    scheduler.close()
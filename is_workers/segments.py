@@ -0,0 +1,178 @@
+import argparse
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+from audio import AudioAnalyst
+from audiofile import audio_cache
+
+
+@dataclass
+class Clip:
+    """
+    Part of a recording, offsets in samples
+    """
+    start: int
+    end: int
+    samplerate: int
+
+    @property
+    def start_time(self):
+        return self.start / self.samplerate
+
+    @property
+    def duration(self):
+        return (self.end - self.start) / self.samplerate
+
+    def cut(self, signal, samplerate=None):
+        """
+        The clip within a signal, possibly at another samplerate
+        """
+        scale = (samplerate or self.samplerate) / self.samplerate
+        return signal[round(self.start * scale):round(self.end * scale)]
+
+
+class Segmenter:
+    """
+    Split a long recording, e.g. a word list read by a native speaker,
+    into clips at the silences.
+    Energy and zero crossing rate are computed on non overlapping
+    frames of the whole signal at once. A clip opens on a voiced frame
+    louder than HYSTERESIS dB above the AudioAnalyst silence and closes
+    when the level falls back below the silence.
+    """
+    SILENCE = AudioAnalyst.silence
+    HYSTERESIS = 10
+    # noise and breath cross zero more often than voice
+    MAX_ZCR = 0.25
+    FRAME = 0.01
+    MIN_GAP = 0.25
+    MIN_DURATION = 0.15
+    PADDING = 0.05
+
+    def __init__(
+        self,
+        samplerate=12800,
+        silence=SILENCE,
+        hysteresis=HYSTERESIS,
+        min_gap=MIN_GAP,
+        min_duration=MIN_DURATION,
+        padding=PADDING
+    ):
+        self.samplerate = samplerate
+        self.silence = silence
+        self.hysteresis = hysteresis
+        self.frame = max(1, int(self.FRAME * samplerate))
+        self.min_gap = int(min_gap / self.FRAME)
+        self.min_duration = int(min_duration / self.FRAME)
+        self.padding = int(padding * samplerate)
+
+    def read(self, filepath):
+        """
+        Whole signal at the segmenter samplerate
+        """
+        return audio_cache.open(filepath).signal(self.samplerate)
+
+    def features(self, signal):
+        """
+        Level in dB and zero crossing rate of every frame
+        """
+        count = signal.size // self.frame
+        frames = signal[:count * self.frame].reshape(count, self.frame)
+        power = np.einsum('ij,ij->i', frames, frames) / self.frame
+        level = 10 * np.log10(np.maximum(power, 1e-12))
+        signs = np.signbit(frames)
+        zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) \
+            / self.frame
+        return level, zcr
+
+    def regions(self, level, zcr):
+        """
+        First and last + 1 frame of every clip
+        """
+        above = level > self.silence
+        trigger = above & (level > self.silence + self.hysteresis) & \
+            (zcr < self.MAX_ZCR)
+        # runs above the silence, kept when one of their frames triggers
+        edges = np.diff(above.astype(np.int8), prepend=0, append=0)
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1)
+        if not starts.size:
+            return starts, ends
+        triggered = np.add.reduceat(trigger, starts) > 0
+        starts, ends = starts[triggered], ends[triggered]
+        # pauses inside a word, e.g. before a plosive, are not words
+        if starts.size:
+            keep = np.concatenate(
+                ([True], starts[1:] - ends[:-1] >= self.min_gap)
+            )
+            starts = starts[keep]
+            ends = ends[np.concatenate((keep[1:], [True]))]
+        long_enough = ends - starts >= self.min_duration
+        return starts[long_enough], ends[long_enough]
+
+    def clips(self, signal):
+        level, zcr = self.features(signal)
+        starts, ends = self.regions(level, zcr)
+        starts = np.maximum(starts * self.frame - self.padding, 0)
+        ends = np.minimum(ends * self.frame + self.padding, signal.size)
+        return [
+            Clip(int(start), int(end), self.samplerate)
+            for start, end in zip(starts, ends)
+        ]
+
+    def segment(self, filepath):
+        """
+        Return the signal and its clips
+        """
+        signal = self.read(filepath)
+        return signal, self.clips(signal)
+
+    def analyses(self, filepath, titles=None):
+        """
+        Yield every clip with its analysis, no clip is written to disk
+        """
+        signal, clips = self.segment(filepath)
+        if titles is not None and len(titles) != len(clips):
+            raise ValueError(
+                f'{len(clips)} clips found in {filepath}, '
+                f'{len(titles)} titles given'
+            )
+        for index, clip in enumerate(clips):
+            title = titles[index] if titles else f'{index + 1}'
+            analyst = AudioAnalyst(
+                filepath,
+                title,
+                samplerate=self.samplerate,
+                signal=clip.cut(signal)
+            )
+            yield clip, analyst.analyse()
+
+
+def benchmark(minutes, samplerate):
+    """
+    Segment a synthetic recording of one word per second
+    """
+    random = np.random.default_rng(0)
+    seconds = minutes * 60
+    times = np.arange(seconds * samplerate) / samplerate
+    signal = 0.001 * random.standard_normal(times.size)
+    voiced = (times % 1) < 0.5
+    signal[voiced] += 0.3 * np.sin(2 * np.pi * 220 * times[voiced])
+    signal = signal.astype(np.float32)
+    segmenter = Segmenter(samplerate)
+    started = time.perf_counter()
+    clips = segmenter.clips(signal)
+    print(
+        f'{len(clips)} clips in {minutes} minutes of audio: '
+        f'{time.perf_counter() - started:.2f}s'
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--minutes', type=int, default=60)
+    parser.add_argument('--samplerate', type=int, default=12800)
+    args = parser.parse_args()
+    benchmark(args.minutes, args.samplerate)
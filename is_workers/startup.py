@@ -0,0 +1,68 @@
+"""
+Startup time of the worker entry points, measured with -X importtime.
+Exits with an error when an entry point is over its budget.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+WORKERS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# entry point: (imports done before any work, budget in seconds)
+ENTRY_POINTS = {
+    'analyse': ('import workers, audio', 0.3),
+    'render': ('import workers, image', 0.3),
+}
+
+
+def import_times(statement):
+    """
+    (cumulative us, self us, depth, module) of every import
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        cwd=WORKERS_DIR,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        times.append((int(cumulative_us), int(self_us), depth, name.strip()))
+    return times
+
+
+def measure(entry_point, top=5):
+    """
+    Print the slowest imports of an entry point, return the total time
+    """
+    statement, budget = ENTRY_POINTS[entry_point]
+    times = import_times(statement)
+    top_level = sorted(
+        (cumulative, name) for cumulative, x, depth, name in times
+        if depth == 0
+    )
+    total = sum(cumulative for cumulative, name in top_level) / 1e6
+    status = 'ok' if total <= budget else 'OVER BUDGET'
+    print(f'{entry_point}: {total:.3f}s / {budget:.3f}s {status}')
+    for cumulative, name in top_level[::-1][:top]:
+        print(f'    {cumulative / 1e6:.3f}s {name}')
+    return total
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'entry_points', nargs='*', default=list(ENTRY_POINTS)
+    )
+    args = parser.parse_args()
+    over_budget = [
+        entry_point for entry_point in args.entry_points
+        if measure(entry_point) > ENTRY_POINTS[entry_point][1]
+    ]
+    sys.exit(1 if over_budget else 0)
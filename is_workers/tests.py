@@ -1,15 +1,52 @@
+import asyncio
+import datetime
+import io
+import json
+import multiprocessing
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import types
 import unittest
+import unittest.mock
+import warnings
+import wave
 import os.path
 
+import ffmpeg
+import httplib2
 import matplotlib.pyplot as plt
+import numpy as np
+from cryptography.fernet import Fernet
+from google.oauth2.credentials import Credentials
+from googleapiclient.errors import HttpError
 from scipy.cluster.hierarchy import dendrogram
 
-from models import YoutubeVideo
+from models import YoutubeVideo, PitchAnalysis
 from image import ImageMaker
-from utils import path_in_medialib
-from audio import GoogleSpeaker, AudioAnalyst
-from video import VideoMaker
-from upload import upload_file
+from utils import path_in_medialib, NoteTools
+from audio import (
+    GoogleSpeaker, BatchSpeaker, AudioAnalyst, TextToSpeechClients
+)
+from video import VideoMaker, CompilationMaker
+from upload import (
+    AuthorizationRequired, TokenCache, resumable_upload, upload_file
+)
+from framebuffer import FrameRing, check_renderers
+from contours import ContourIndex
+from medialib import MediaLibrary, library
+from collector import MediaCollector
+from segments import Segmenter
+from audiofile import WavFile, Audio, AudioCache
+from postprocess import PitchPostProcessor
+from live import LivePitchTracker, LiveSocket
+from wordindex import WordIndex
+from scheduler import Channel, UploadScheduler
+from validate import InvalidVideo, ProbeCache, VideoValidator
+from audiofile import audio_cache
+import startup
 
 TEST_SENTENCE = 'Intonation Studio'
 JSON_FILE = 'test1.json'
@@ -17,6 +54,294 @@ VIDEO_FILE = 'test1.mp4'
 WAV_FILE = 'test1'
 
 
+class TestMediaLibrary(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.library = MediaLibrary(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_atomic(self):
+        with self.library.atomic('word.wav') as partial_path:
+            with open(partial_path, 'wb') as out:
+                out.write(b'data')
+            self.assertFalse(self.library.exists('word.wav'))
+        self.assertTrue(self.library.exists('word.wav'))
+        self.assertEqual(
+            os.path.relpath(self.library.path('word.wav'), self.root).count(
+                os.sep
+            ),
+            2
+        )
+        with self.assertRaises(RuntimeError):
+            with self.library.atomic('broken.wav') as partial_path:
+                open(partial_path, 'wb').close()
+                raise RuntimeError()
+        names = [entry.name for entry in self.library.scan()]
+        self.assertEqual(names, ['word.wav'])
+
+    def test_workdir(self):
+        workdirs = {self.library.workdir('maker') for x in range(100)}
+        self.assertEqual(len(workdirs), 100)
+        self.assertEqual(len(list(self.library.scan(workdirs=True))), 100)
+
+
+class TestMediaCollector(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.library = MediaLibrary(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def put(self, name, size, age):
+        with self.library.atomic(name) as partial_path:
+            with open(partial_path, 'wb') as out:
+                out.write(b'x' * size)
+        mtime = time.time() - age
+        os.utime(self.library.path(name), (mtime, mtime))
+
+    def test_retention(self):
+        old = 30 * MediaCollector.DAY
+        self.put('unused.wav', 200, old)
+        self.put('analysed.wav', 300, old)
+        self.put('analysed.json', 10, old)
+        self.put('pending.mp4', 1000, old)
+        self.put('uploaded.mp4', 500, old)
+        self.put('preview_pending.mp4', 50, old)
+        self.library.mark_uploaded('uploaded.mp4', 'video_id')
+        collector = MediaCollector(
+            self.library, shards_per_pass=MediaCollector.SHARDS
+        )
+        report = collector.collect()
+        self.assertEqual(report.removed, 3)
+        self.assertEqual(report.reclaimed, 750)
+        names = sorted(entry.name for entry in self.library.scan())
+        self.assertEqual(names, [
+            'analysed.json', 'analysed.wav', 'pending.mp4',
+            'uploaded.mp4.uploaded'
+        ])
+
+    def test_analysed_elsewhere(self):
+        """
+        A wav is kept while the analysis recorded for it exists
+        """
+        old = 30 * MediaCollector.DAY
+        self.put('word.wav', 300, old)
+        json_path = os.path.join(self.root, 'word_analysis.json')
+        open(json_path, 'w').close()
+        self.library.mark_analysed(self.library.path('word.wav'), json_path)
+        collector = MediaCollector(
+            self.library, shards_per_pass=MediaCollector.SHARDS
+        )
+        self.assertEqual(collector.collect().removed, 0)
+        os.remove(json_path)
+        self.assertEqual(collector.collect().removed, 2)
+        self.assertEqual(list(self.library.scan()), [])
+
+    def test_quota(self):
+        self.put('first.mp4', 500, 60)
+        self.put('second.mp4', 500, 30)
+        self.library.mark_uploaded('first.mp4', 'first_id')
+        self.library.mark_uploaded('second.mp4', 'second_id')
+        collector = MediaCollector(
+            self.library, quota=600, shards_per_pass=MediaCollector.SHARDS
+        )
+        report = collector.collect()
+        self.assertEqual(report.reclaimed, 500)
+        self.assertFalse(self.library.exists('first.mp4'))
+        self.assertTrue(self.library.exists('second.mp4'))
+        self.assertLessEqual(report.total, 600)
+
+
+class TestStartup(unittest.TestCase):
+
+    HEAVY_MODULES = (
+        'aubio', 'cairo', 'django', 'ffmpeg', 'ffprobe',
+        'google.cloud.texttospeech', 'scipy'
+    )
+
+    def test_lazy_imports(self):
+        """
+        Entry points do not load the heavy dependencies at startup
+        """
+        for entry_point, (statement, budget) in \
+                startup.ENTRY_POINTS.items():
+            modules = {
+                name for cumulative, x, depth, name in
+                startup.import_times(statement)
+            }
+            for heavy_module in self.HEAVY_MODULES:
+                self.assertNotIn(heavy_module, modules, entry_point)
+
+
+class TestNoteTools(unittest.TestCase):
+
+    def test_scalar(self):
+        self.assertEqual(NoteTools.note_to_midi('A4'), 69)
+        self.assertEqual(NoteTools.midi_to_note(60.7), 'C4')
+        self.assertAlmostEqual(NoteTools.note_to_freq('A4'), 440.0)
+        self.assertEqual(NoteTools.freq_to_note(261.0), 'C4')
+        self.assertEqual(
+            NoteTools.note_range('A3', 'C#4'),
+            ['A3', 'A#3', 'B3', 'C4', 'C#4']
+        )
+
+    def test_arrays(self):
+        midi = np.array([60, 61.5, 69, 81])
+        names = NoteTools.midi_to_notes(midi)
+        self.assertEqual(names.tolist(), ['C4', 'C#4', 'A4', 'A5'])
+        self.assertEqual(
+            NoteTools.notes_to_midi(names).tolist(), [60, 61, 69, 81]
+        )
+        freqs = NoteTools.midi_to_freqs(midi)
+        np.testing.assert_allclose(NoteTools.freqs_to_midi(freqs), midi)
+        self.assertEqual(NoteTools.freqs_to_notes(freqs)[2], 'A4')
+        with self.assertRaises(ValueError):
+            NoteTools.notes_to_midi(['H4'])
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            self.assertEqual(
+                NoteTools.freqs_to_notes([0.0, 440.0]).tolist(),
+                [NoteTools.midi_to_note(0), 'A4']
+            )
+
+
+class FakeCredentials:
+
+    def __init__(self, credential_filepath):
+        self.credential_filepath = credential_filepath
+        self.refreshed = 0
+
+    def refresh(self, request):
+        self.refreshed += 1
+
+
+class FakeTextToSpeechClient:
+    created = 0
+
+    def __init__(self, credentials, beta=False):
+        FakeTextToSpeechClient.created += 1
+        self.credentials = credentials
+        self.calls = 0
+
+    def list_voices(self, language_code):
+        self.calls += 1
+
+
+class FakeSynthesisClient(FakeTextToSpeechClient):
+    """
+    MP3 of a tone, a tenth of a second per character
+    """
+
+    def synthesize_speech(self, input, voice, audio_config):
+        duration = 0.1 * len(input.text)
+        content, _ = ffmpeg.input(
+            f'sine=frequency=220:duration={duration}', f='lavfi'
+        ).output('pipe:', format='mp3').run(
+            capture_stdout=True, capture_stderr=True
+        )
+        return types.SimpleNamespace(audio_content=content)
+
+
+class TestTextToSpeechClients(unittest.TestCase):
+
+    def setUp(self):
+        FakeTextToSpeechClient.created = 0
+        self.registry = TextToSpeechClients(
+            make_client=FakeTextToSpeechClient,
+            load_credentials=FakeCredentials,
+            pool_size=2
+        )
+
+    def test_pool_reused(self):
+        speakers = [GoogleSpeaker(self.registry) for x in range(10)]
+        self.assertEqual(FakeTextToSpeechClient.created, 2)
+        self.assertEqual(len({id(speaker.client) for speaker in speakers}), 2)
+        other = self.registry.get('other_credentials.json')
+        self.assertEqual(FakeTextToSpeechClient.created, 4)
+        self.assertEqual(
+            other.credentials.credential_filepath, 'other_credentials.json'
+        )
+
+    def test_concurrent_get(self):
+        threads = [
+            threading.Thread(target=self.registry.get) for x in range(20)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(FakeTextToSpeechClient.created, 2)
+
+    def test_warm_up_refresh(self):
+        self.registry.warm_up()
+        clients = self.registry.pool()['clients']
+        self.assertEqual([client.calls for client in clients], [1, 1])
+        credentials = self.registry.refresh()
+        self.assertEqual(credentials.refreshed, 2)
+        self.assertEqual(FakeTextToSpeechClient.created, 2)
+        self.assertIs(clients[0].credentials, credentials)
+
+
+class TestBatchSpeaker(unittest.TestCase):
+
+    SAMPLERATE = 24000
+
+    def fixture_response(self, durations):
+        """
+        LINEAR16 response: the word i is a constant signal of value i
+        """
+        frames = b''.join(
+            struct.pack('<h', i) * int(duration * self.SAMPLERATE)
+            for i, duration in enumerate(durations)
+        )
+        content = io.BytesIO()
+        with wave.open(content, 'wb') as audio:
+            audio.setnchannels(1)
+            audio.setsampwidth(2)
+            audio.setframerate(self.SAMPLERATE)
+            audio.writeframes(frames)
+        times = np.cumsum([0] + durations)
+        timepoints = [
+            types.SimpleNamespace(mark_name=str(i), time_seconds=time)
+            for i, time in enumerate(times)
+        ]
+        return content.getvalue(), timepoints
+
+    def test_split_timepoints(self):
+        durations = [0.5, 0.25, 1.0]
+        content, timepoints = self.fixture_response(durations)
+        params, clips = BatchSpeaker.split_timepoints(
+            content, timepoints, len(durations)
+        )
+        self.assertEqual(params.framerate, self.SAMPLERATE)
+        for i, (clip, duration) in enumerate(zip(clips, durations)):
+            samples = np.frombuffer(clip, dtype='<i2')
+            self.assertEqual(len(samples), int(duration * self.SAMPLERATE))
+            self.assertTrue((samples == i).all())
+
+    def test_missing_timepoint(self):
+        content, timepoints = self.fixture_response([0.5, 0.5])
+        with self.assertRaises(ValueError):
+            BatchSpeaker.split_timepoints(content, timepoints[:-1], 2)
+
+    def test_batches(self):
+        words = [f'word{i}' for i in range(1000)]
+        batches = list(BatchSpeaker.batches(words))
+        self.assertGreater(len(batches), 1)
+        self.assertEqual(sum(batches, []), words)
+        for batch in batches:
+            self.assertLessEqual(
+                len(BatchSpeaker.ssml_for(batch).encode('utf8')),
+                BatchSpeaker.MAX_SSML_BYTES
+            )
+        self.assertIn('&lt;b&gt;', BatchSpeaker.ssml_for(['<b>']))
+
+
 class TestGoogleSpeaker(unittest.TestCase):
 
     def test_speak_correct(self):
@@ -80,6 +405,363 @@ class TestAudioAnalyst(unittest.TestCase):
         plt.savefig(path_in_medialib('test_analyst.svg'), format='svg')
 
 
+class TestSegmenter(unittest.TestCase):
+
+    SAMPLERATE = 12800
+
+    def recording(self, parts):
+        """
+        (seconds, amplitude) parts of a 220 Hz tone over faint noise
+        """
+        random = np.random.default_rng(0)
+        signal = []
+        for seconds, amplitude in parts:
+            times = np.arange(int(seconds * self.SAMPLERATE)) \
+                / self.SAMPLERATE
+            signal.append(
+                amplitude * np.sin(2 * np.pi * 220 * times)
+                + 0.0005 * random.standard_normal(times.size)
+            )
+        return np.concatenate(signal).astype(np.float32)
+
+    def test_clips(self):
+        segmenter = Segmenter(self.SAMPLERATE, padding=0)
+        signal = self.recording([
+            (0.5, 0), (0.4, 0.3), (0.5, 0),
+            # a pause inside a word
+            (0.3, 0.3), (0.1, 0), (0.3, 0.3), (0.5, 0),
+            # between the two thresholds: never opens a clip
+            (0.4, 0.02), (0.5, 0),
+        ])
+        clips = segmenter.clips(signal)
+        self.assertEqual(len(clips), 2)
+        self.assertAlmostEqual(clips[0].start_time, 0.5, places=1)
+        self.assertAlmostEqual(clips[0].duration, 0.4, places=1)
+        self.assertAlmostEqual(clips[1].start_time, 1.4, places=1)
+        self.assertAlmostEqual(clips[1].duration, 0.7, places=1)
+
+    def test_signal_analysis(self):
+        """
+        A clip is analysed like the file it comes from
+        """
+        filepath = path_in_medialib(f'{WAV_FILE}.wav')
+        signal = Segmenter(self.SAMPLERATE).read(filepath)
+        from_file = AudioAnalyst(filepath, TEST_SENTENCE).analyse()
+        from_signal = AudioAnalyst(
+            filepath, TEST_SENTENCE, signal=signal
+        ).analyse()
+        np.testing.assert_allclose(
+            from_signal.samples,
+            from_file.samples[:from_signal.samples.size]
+        )
+
+
+class TestAudioFile(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write_wav(self, frames, samplerate=16000):
+        """
+        16 bit stereo file
+        """
+        filepath = os.path.join(self.tempdir, 'stereo.wav')
+        with wave.open(filepath, 'wb') as wav:
+            wav.setnchannels(2)
+            wav.setsampwidth(2)
+            wav.setframerate(samplerate)
+            wav.writeframes(frames.astype('<i2').tobytes())
+        return filepath
+
+    def test_memory_map(self):
+        frames = np.stack([
+            np.arange(-1000, 1000), np.arange(1000, -1000, -1)
+        ], axis=1)
+        wav = WavFile(self.write_wav(frames))
+        self.assertIsInstance(wav.data, np.memmap)
+        self.assertEqual((wav.samplerate, wav.channels), (16000, 2))
+        np.testing.assert_array_equal(wav.data, frames)
+        # the channels cancel out
+        np.testing.assert_array_equal(wav.to_float(), 0)
+
+    def test_mp3_to_wav(self):
+        """
+        Converted mp3 files are float WAVs, mapped without a copy
+        """
+        filepath = os.path.join(self.tempdir, 'converted.wav')
+        GoogleSpeaker.mp3_to_wav(
+            path_in_medialib(f'{WAV_FILE}.mp3'), filepath
+        )
+        wav = WavFile(filepath)
+        self.assertEqual(wav.data.dtype, np.float32)
+        self.assertTrue(np.shares_memory(wav.to_float(), wav.data))
+
+    def test_not_wav(self):
+        with self.assertRaises(ValueError):
+            WavFile(path_in_medialib(f'{WAV_FILE}.mp3'))
+
+    def test_cache(self):
+        times = np.arange(16000) / 16000
+        tone = 8000 * np.sin(2 * np.pi * 440 * times)
+        filepath = self.write_wav(np.stack([tone, tone], axis=1))
+        cache = AudioCache()
+        audio = cache.open(filepath)
+        self.assertIs(cache.open(filepath), audio)
+        resampled = audio.signal(8000)
+        self.assertEqual(resampled.size, 8000)
+        self.assertEqual(resampled.dtype, np.float32)
+        self.assertIs(audio.signal(8000), resampled)
+        pipe = Audio.pipe(resampled)
+        self.assertEqual(pipe.nbytes, resampled.nbytes)
+        self.assertEqual(pipe.format, 'B')
+
+
+class TestPitchAnalysis(unittest.TestCase):
+
+    def setUp(self):
+        filepath = path_in_medialib(f'{WAV_FILE}.wav')
+        self.analysis = AudioAnalyst(filepath, TEST_SENTENCE).analyse()
+
+    def test_dict_round_trip(self):
+        data = json.loads(json.dumps(self.analysis.to_dict()))
+        analysis = PitchAnalysis.from_dict(data)
+        self.assertTrue((analysis.samples == self.analysis.samples).all())
+        np.testing.assert_array_equal(
+            analysis.confidences, self.analysis.confidences
+        )
+        self.assertEqual(analysis.max_note, self.analysis.max_note)
+        self.assertTrue(analysis.is_midi)
+
+    def test_missing_field(self):
+        data = self.analysis.to_dict()
+        del data['max_y']
+        with self.assertRaises(KeyError):
+            PitchAnalysis.from_dict(data)
+
+    def test_stats(self):
+        stats = PitchAnalysis.stats(np.array([0.0, 60.5, 61.0, 72.0]))
+        counts, edges = stats['histogram']
+        # one bin per semitone, the highest pitch in a bin of its own
+        np.testing.assert_array_equal(edges, np.arange(74))
+        self.assertEqual(counts[[60, 61, 71, 72]].tolist(), [1, 1, 0, 1])
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            stats = PitchAnalysis.stats(np.zeros(4), is_midi=False)
+        self.assertEqual(stats['histogram'][0].tolist(), [0])
+
+
+class TestPitchPostProcessor(unittest.TestCase):
+
+    def setUp(self):
+        self.post_processor = PitchPostProcessor()
+        self.track = np.array([
+            60, 60.5, 72.5, 61, 0, 0, 61.5, 62, 50, 62, 62.5, 62, 0, 0,
+            0, 0, 0, 63, 63
+        ])
+
+    def test_track(self):
+        confidences = np.ones(self.track.size)
+        confidences[3] = 0.1
+        cleaned = self.post_processor.process_tracks(
+            [self.track], [confidences]
+        )[0]
+        # octave errors are moved back
+        self.assertAlmostEqual(cleaned[2], 60.5)
+        self.assertTrue((np.abs(np.diff(cleaned[:12])) < 1).all())
+        # the gap includes the unconfident frame
+        np.testing.assert_allclose(
+            cleaned[3:6], np.linspace(cleaned[2], cleaned[6], 5)[1:4]
+        )
+        # long gaps stay unvoiced
+        self.assertTrue((cleaned[12:17] == 0).all())
+
+    def test_batch(self):
+        """
+        Tracks of a batch are cleaned independently
+        """
+        tracks = [self.track, self.track[:5] + 3, self.track[::-1]]
+        confidences = [np.ones(track.size) for track in tracks]
+        batch = self.post_processor.process_tracks(tracks, confidences)
+        for track, track_confidences, cleaned in zip(
+            tracks, confidences, batch
+        ):
+            alone = self.post_processor.process_tracks(
+                [track], [track_confidences]
+            )[0]
+            np.testing.assert_array_equal(cleaned, alone)
+
+    def test_analysis(self):
+        filepath = path_in_medialib(f'{WAV_FILE}.wav')
+        analysis = AudioAnalyst(filepath, TEST_SENTENCE).analyse()
+        cleaned = AudioAnalyst(
+            filepath, TEST_SENTENCE, post_processor=self.post_processor
+        ).analyse()
+        self.assertEqual(cleaned.samples.size, analysis.samples.size)
+        self.assertEqual(cleaned.max_y, cleaned.samples.max())
+
+
+class TestLivePitchTracker(unittest.TestCase):
+
+    def test_pcm_stream(self):
+        """
+        Points of a PCM stream cut anywhere are the analysis samples
+        """
+        filepath = path_in_medialib(f'{WAV_FILE}.wav')
+        signal = audio_cache.open(filepath).signal(12800)
+        pcm = np.round(signal * 32767).astype('<i2')
+        analysis = AudioAnalyst(
+            filepath, TEST_SENTENCE,
+            signal=(pcm / 32768).astype(np.float32)
+        ).analyse()
+        tracker = LivePitchTracker()
+        data = pcm.tobytes()
+        points = []
+        for start in range(0, len(data), 1000):
+            points += tracker.feed_pcm(data[start:start + 1000])
+        self.assertEqual(len(points), pcm.size // tracker.hop)
+        np.testing.assert_allclose(
+            [point['pitch'] for point in points],
+            analysis.samples[:len(points)],
+            rtol=1e-5
+        )
+
+    def test_replay(self):
+        """
+        A WAV file replayed at real-time pace through the WebSocket
+        """
+        sent = []
+        connected = [{'type': 'websocket.connect'}]
+
+        async def receive():
+            return connected.pop()
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(LiveSocket()(
+            {
+                'type': 'websocket',
+                'path': LiveSocket.PATH,
+                'query_string': f'replay={WAV_FILE}.wav'.encode(),
+            },
+            receive,
+            send
+        ))
+        self.assertEqual(sent[0]['type'], 'websocket.accept')
+        self.assertEqual(sent[-1]['type'], 'websocket.close')
+        points = [json.loads(message['text']) for message in sent[1:-1]]
+        self.assertTrue(points)
+        for point in points:
+            self.assertLess(point['latency'], LivePitchTracker.LATENCY_BUDGET)
+
+    def test_bad_samplerate(self):
+        """
+        A samplerate that is not a supported integer closes the socket
+        """
+        for samplerate in ('fast', '0', '10000000'):
+            sent = []
+
+            async def receive():
+                return {'type': 'websocket.connect'}
+
+            async def send(message):
+                sent.append(message)
+
+            asyncio.run(LiveSocket()(
+                {
+                    'type': 'websocket',
+                    'path': LiveSocket.PATH,
+                    'query_string': f'samplerate={samplerate}'.encode(),
+                },
+                receive,
+                send
+            ))
+            self.assertEqual(sent[-1]['type'], 'websocket.close')
+            self.assertEqual(sent[-1]['code'], LiveSocket.POLICY_VIOLATION)
+
+
+class TestWordIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.words_path = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.words_path, 'it'))
+        lists = {
+            'it_50k.txt': 'non 2000\nperché 1000\nè 500\ncasa 10\n',
+            'it_ignored.txt': '. 9000\n42 3\n',
+        }
+        for filename, content in lists.items():
+            with open(os.path.join(self.words_path, 'it', filename), 'w',
+                      encoding='utf8') as fp:
+                fp.write(content)
+        WordIndex.build('it', self.words_path)
+        self.index = WordIndex.open('it', self.words_path)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.words_path)
+
+    def test_lookup(self):
+        self.assertEqual(len(self.index), 6)
+        self.assertEqual(self.index.rank('perché'), 2)
+        self.assertEqual(self.index.relevance('è'), 500)
+        entry = self.index.lookup('.')
+        self.assertEqual((entry.rank, entry.ignored), (1, True))
+        self.assertIsNone(self.index.lookup('cas'))
+        self.assertNotIn('zzz', self.index)
+        self.assertIn('casa', self.index)
+
+    def test_ranked(self):
+        self.assertEqual(
+            [entry.word for entry in self.index.ranked()],
+            ['non', 'perché', 'è', 'casa']
+        )
+        self.assertEqual(
+            [entry.rank for entry in self.index.ranked(2, 4)], [2, 3]
+        )
+        self.assertEqual(self.index.ranked(10), [])
+
+    def test_not_an_index(self):
+        path = os.path.join(self.words_path, 'it', 'it_50k.txt')
+        with self.assertRaises(ValueError):
+            WordIndex(path)
+
+
+class TestContourIndex(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.default_rng(0)
+        steps = random.normal(0, 0.5, (500, ContourIndex.LENGTH))
+        self.contours = np.cumsum(steps, axis=1)
+        self.index = ContourIndex()
+        self.index.add_many(
+            [str(key) for key in range(len(self.contours))],
+            self.contours
+        )
+
+    def test_query_exact(self):
+        """
+        Pruned results are the brute force DTW neighbours
+        """
+        query = self.contours[42].astype(ContourIndex.DTYPE)
+        distances = self.index.dtw(query, self.index.contours[:500])
+        expected = [str(key) for key in np.argsort(distances)[:5]]
+        found = [key for key, distance in self.index.query(query, 5)]
+        self.assertEqual(found, expected)
+        self.assertEqual(found[0], '42')
+
+    def test_save_load(self):
+        filepath = path_in_medialib('test_contours.npz')
+        self.index.save(filepath)
+        index = ContourIndex.load(filepath)
+        os.remove(filepath)
+        self.assertEqual(len(index), len(self.index))
+        query = self.contours[7]
+        self.assertEqual(index.query(query, 3), self.index.query(query, 3))
+
+
 class TestImageMaker(unittest.TestCase):
 
     def setUp(self):
@@ -92,6 +774,44 @@ class TestImageMaker(unittest.TestCase):
         images[0].write_to_png(path_in_medialib('test_cairo_frame_0.jpg'))
         images[4].write_to_png(path_in_medialib('test_cairo_frame_4.jpg'))
 
+    def test_preview(self):
+        generator = ImageMaker.preview(self.analysis)
+        self.assertEqual((generator.width, generator.height), (320, 180))
+        self.assertEqual(generator.rects()['path'], (15, 40, 290, 120))
+        images = generator.make_images()
+        self.assertEqual(
+            len(images), -(-len(self.analysis.samples) // 2)
+        )
+        self.assertEqual(images[0].get_width(), 320)
+        self.assertEqual(
+            generator.framerate,
+            self.analysis.samplerate / self.analysis.hop / 2
+        )
+        with tempfile.TemporaryDirectory() as tempdir:
+            sheet_path = os.path.join(tempdir, 'sheet.png')
+            generator.save_contact_sheet(sheet_path)
+            self.assertTrue(os.path.getsize(sheet_path))
+
+    def test_background_drawn_once(self):
+        generator = ImageMaker(self.analysis)
+        with unittest.mock.patch.object(
+            generator, 'cairo_draw_background',
+            wraps=generator.cairo_draw_background
+        ) as draw_background:
+            generator.make_images()
+        self.assertEqual(draw_background.call_count, 1)
+
+    def test_preview_faster(self):
+        """
+        The preview renders faster than the full resolution frames
+        """
+        started = time.perf_counter()
+        ImageMaker(self.analysis).make_images()
+        full = time.perf_counter() - started
+        started = time.perf_counter()
+        ImageMaker.preview(self.analysis).make_images()
+        self.assertLess(time.perf_counter() - started, full / 2)
+
     @unittest.SkipTest
     def test_cairo_save_images(self):
         """
@@ -101,6 +821,67 @@ class TestImageMaker(unittest.TestCase):
         generator.cairo_save_images()
 
 
+class TestFrameRing(unittest.TestCase):
+
+    @staticmethod
+    def write_frames(ring, renderer, renderers, frames):
+        for index in range(renderer, frames, renderers):
+            slot = ring.acquire(index)
+            slot[:8] = index.to_bytes(8, 'little')
+            slot.release()
+            ring.release(index)
+        ring.close()
+
+    def test_stream_in_order(self):
+        """
+        Frames drawn by concurrent renderers are streamed in order
+        """
+        frames, renderers = 40, 3
+        ring = FrameRing(slots=2)
+        processes = [
+            multiprocessing.Process(
+                target=self.write_frames,
+                args=(ring, renderer, renderers, frames)
+            )
+            for renderer in range(renderers)
+        ]
+        for process in processes:
+            process.start()
+        out = io.BytesIO()
+        ring.stream(frames, out, timeout=ring.TIMEOUT)
+        for process in processes:
+            process.join()
+        ring.close()
+        ring.unlink()
+        data = out.getvalue()
+        self.assertEqual(len(data), frames * ring.slot_size)
+        for index in range(frames):
+            offset = index * ring.slot_size
+            self.assertEqual(
+                int.from_bytes(data[offset:offset + 8], 'little'),
+                index
+            )
+
+    def test_renderer_crash(self):
+        """
+        A dead renderer fails the stream before the timeout
+        """
+        ring = FrameRing(slots=2)
+        ring.POLL = 0.05
+        process = multiprocessing.Process(target=os._exit, args=(3,))
+        process.start()
+        started = time.perf_counter()
+        with self.assertRaises(RuntimeError):
+            ring.stream(
+                4, io.BytesIO(), ring.TIMEOUT,
+                lambda: check_renderers([process])
+            )
+        self.assertLess(time.perf_counter() - started, ring.TIMEOUT / 10)
+        process.join()
+        ring.close()
+        ring.unlink()
+
+
 class TestVideoMaker(unittest.TestCase):
 
     @unittest.SkipTest
@@ -116,6 +897,42 @@ class TestVideoMaker(unittest.TestCase):
         self.assertTrue(os.path.exists(videopath))
 
 
+class TestCompilationMaker(unittest.TestCase):
+
+    def test_segments_cached(self):
+        """
+        Only missing segments are encoded
+        """
+        encoded = []
+
+        class CountingMaker(CompilationMaker):
+            def encode_segment(self, text, segment_path):
+                encoded.append(text)
+                name = os.path.basename(segment_path)
+                with library.atomic(name) as partial_path:
+                    open(partial_path, 'wb').close()
+                return segment_path
+
+        maker = CountingMaker()
+        paths = maker.segments(['first', 'second'])
+        maker.segments(['first', 'second', 'third'])
+        self.assertEqual(encoded, ['first', 'second', 'third'])
+        self.assertEqual(len(set(paths)), 2)
+        for text in encoded:
+            os.remove(maker.segment_path(text))
+
+    def test_make(self):
+        """
+        Create a compilation
+        """
+        registry = TextToSpeechClients(
+            make_client=FakeSynthesisClient, load_credentials=FakeCredentials
+        )
+        maker = CompilationMaker(registry=registry)
+        videopath = maker.make(['Compilation', 'Offline'])
+        self.assertTrue(os.path.exists(videopath))
+
+
 class TestVideoUploader(unittest.TestCase):
 
     def test_upload_success(self):
@@ -135,6 +952,484 @@ class TestVideoUploader(unittest.TestCase):
         upload_file(video1)
         upload_file(video2)
 
+    def test_chunks_without_backoff(self):
+        """
+        Only errors make the upload sleep
+        """
+        chunks = [(None, None), (None, None), (None, {'id': 'video'})]
+        request = types.SimpleNamespace(next_chunk=lambda: chunks.pop(0))
+        with unittest.mock.patch('upload.time.sleep') as sleep:
+            self.assertEqual(resumable_upload(request), {'id': 'video'})
+        sleep.assert_not_called()
+
+
+class FakeYoutube:
+    """
+    videos.insert of the YouTube Data API, enforcing a daily quota
+    """
+    def __init__(
+        self, quota, cost=UploadScheduler.INSERT_COST, reason='quotaExceeded',
+        before=None
+    ):
+        """
+        before is called at the start of every upload
+        """
+        self.quota = quota
+        self.cost = cost
+        self.reason = reason
+        self.before = before or (lambda: None)
+        self.used = 0
+        self.titles = []
+        self.lock = threading.Lock()
+
+    def videos(self):
+        return self
+
+    def insert(self, part, body, media_body):
+        return FakeInsertRequest(self, body['snippet']['title'])
+
+
+class FakeInsertRequest:
+    def __init__(self, api, title):
+        self.api = api
+        self.title = title
+
+    def next_chunk(self):
+        self.api.before()
+        with self.api.lock:
+            if self.api.used + self.api.cost > self.api.quota:
+                raise HttpError(
+                    httplib2.Response({'status': 403}),
+                    json.dumps(
+                        {'error': {'errors': [{'reason': self.api.reason}]}}
+                    ).encode('utf8')
+                )
+            self.api.used += self.api.cost
+            self.api.titles.append(self.title)
+            return None, {'id': f'video{len(self.api.titles)}'}
+
+
+class TestUploadScheduler(unittest.TestCase):
+    COST = UploadScheduler.INSERT_COST
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.state_path = os.path.join(self.tmpdir, 'uploads.sqlite3')
+        self.now = 1600000000.0
+
+    def tearDown(self):
+        for name in os.listdir(self.tmpdir):
+            uploaded = f'{name}{MediaLibrary.UPLOADED_SUFFIX}'
+            if library.exists(uploaded):
+                library.remove(library.path(uploaded))
+        shutil.rmtree(self.tmpdir)
+
+    def scheduler(self, apis, projects=None, **kwargs):
+        projects = projects or [f'project{x}' for x in range(len(apis))]
+        channels = [
+            Channel(f'channel{index}', project, lambda api=api: api)
+            for index, (api, project) in enumerate(zip(apis, projects))
+        ]
+        return UploadScheduler(
+            channels, self.state_path, clock=lambda: self.now, **kwargs
+        )
+
+    def add(self, scheduler, title, priority=0):
+        path = os.path.join(self.tmpdir, f'{title}.mp4')
+        with open(path, 'wb') as video:
+            video.write(b'video')
+        return scheduler.add(YoutubeVideo(file=path, title=title), priority)
+
+    def test_priority_and_quota(self):
+        api = FakeYoutube(10 * self.COST)
+        scheduler = self.scheduler(
+            [api], quotas={'project0': 2 * self.COST}, spread=False
+        )
+        for title, priority in (('low', 0), ('high', 5), ('middle', 1)):
+            self.add(scheduler, title, priority)
+        scheduler.run(max_wait=60)
+        self.assertEqual(api.titles, ['high', 'middle'])
+        self.assertEqual(scheduler.counts(), {'done': 2, 'pending': 1})
+        scheduler.close()
+
+    def test_quota_enforced_by_api(self):
+        api = FakeYoutube(self.COST)
+        scheduler = self.scheduler([api], spread=False)
+        self.add(scheduler, 'first')
+        self.add(scheduler, 'second')
+        scheduler.run(max_wait=60)
+        self.assertEqual(api.titles, ['first'])
+        self.assertEqual(scheduler.counts(), {'done': 1, 'pending': 1})
+        # the refused upload was not an attempt
+        job, wait = scheduler.claim(scheduler.channels['channel0'])
+        self.assertIsNone(job)
+        self.assertGreater(wait, 60)
+        scheduler.close()
+
+    def test_restart(self):
+        api = FakeYoutube(10 * self.COST)
+        quotas = {'project0': 2 * self.COST}
+        scheduler = self.scheduler([api], quotas=quotas, spread=False)
+        for title in ('a', 'b', 'c'):
+            self.add(scheduler, title)
+        channel = scheduler.channels['channel0']
+        scheduler.upload_next(channel, api)
+        # a crash in the middle of an upload
+        scheduler.claim(channel)
+        scheduler.close()
+        scheduler = self.scheduler([api], quotas=quotas, spread=False)
+        self.assertEqual(scheduler.counts(), {'done': 1, 'pending': 2})
+        scheduler.run(max_wait=60)
+        # the quota day is over
+        self.assertEqual(api.titles, ['a'])
+        self.now += 24 * 3600
+        scheduler.run(max_wait=60)
+        self.assertEqual(api.titles, ['a', 'b', 'c'])
+        scheduler.close()
+
+    def test_spread(self):
+        api = FakeYoutube(10 * self.COST)
+        scheduler = self.scheduler([api], quotas={'project0': 4 * self.COST})
+        self.add(scheduler, 'a')
+        self.add(scheduler, 'b')
+        channel = scheduler.channels['channel0']
+        self.assertIsNotNone(scheduler.upload_next(channel, api)[0])
+        job, wait = scheduler.upload_next(channel, api)
+        self.assertIsNone(job)
+        # three uploads left for the rest of the day
+        seconds_left = scheduler.quota_day(self.now)[1]
+        self.assertAlmostEqual(wait, seconds_left / 3, places=3)
+        self.now += wait
+        self.assertIsNotNone(scheduler.upload_next(channel, api)[0])
+        scheduler.close()
+
+    def test_channel_upload_limit(self):
+        """
+        A channel over its upload limit does not stop its project.
+        The limit is hit once the other channel found nothing left to
+        claim: the refused job goes to it.
+        """
+        started, idle = threading.Event(), threading.Event()
+
+        def refuse():
+            started.set()
+            idle.wait(5)
+
+        apis = [
+            FakeYoutube(0, reason='uploadLimitExceeded', before=refuse),
+            FakeYoutube(10 * self.COST, before=lambda: started.wait(5)),
+        ]
+        scheduler = self.scheduler(
+            apis, projects=['shared', 'shared'], spread=False
+        )
+        scheduler.POLL_DELAY = 0.01
+        claim = scheduler.claim
+
+        def claim_and_signal(channel):
+            job, wait = claim(channel)
+            if job is None and channel.name == 'channel1':
+                idle.set()
+            return job, wait
+
+        scheduler.claim = claim_and_signal
+        for index in range(3):
+            self.add(scheduler, f'video{index}')
+        scheduler.run(max_wait=60)
+        self.assertTrue(idle.is_set())
+        self.assertEqual(len(apis[1].titles), 3)
+        channel = scheduler.channels['channel0']
+        self.assertGreater(scheduler.hold_wait(channel, self.now), 60)
+        self.assertEqual(scheduler.quota_wait('shared', self.now), 0)
+        scheduler.close()
+
+    def test_channels_in_parallel(self):
+        apis = [FakeYoutube(2 * self.COST), FakeYoutube(2 * self.COST)]
+        scheduler = self.scheduler(apis, spread=False)
+        for index in range(5):
+            self.add(scheduler, f'video{index}')
+        scheduler.run(max_wait=60)
+        self.assertEqual([len(api.titles) for api in apis], [2, 2])
+        self.assertEqual(scheduler.counts(), {'done': 4, 'pending': 1})
+        scheduler.close()
+
+
+class FakeTokenEndpoint:
+    """
+    OAuth token endpoint answering the refreshes of the credentials
+    """
+    def __init__(self):
+        self.refreshes = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, url, method='GET', body=None, headers=None, **kwargs):
+        with self.lock:
+            self.refreshes += 1
+            token = f'token{self.refreshes}'
+        return types.SimpleNamespace(
+            status=200, headers={}, data=json.dumps({
+                'access_token': token, 'expires_in': 3600
+            }).encode('utf8')
+        )
+
+
+class TestTokenCache(unittest.TestCase):
+    SECRETS = 'client_secret.json'
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.endpoint = FakeTokenEndpoint()
+        self.authorized = []
+        self.now = time.time()
+        self.key = Fernet.generate_key()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def authorize(self, client_secrets_file):
+        self.authorized.append(client_secrets_file)
+        return self.credentials('authorized', 3600)
+
+    def credentials(self, token, expires_in):
+        return Credentials(
+            token, refresh_token='refresh', client_id='id',
+            client_secret='secret',
+            token_uri='https://oauth2.googleapis.com/token',
+            expiry=datetime.datetime.fromtimestamp(
+                self.now + expires_in, datetime.timezone.utc
+            ).replace(tzinfo=None)
+        )
+
+    def cache(self, key=None):
+        return TokenCache(
+            self.tmpdir, key=key or self.key, authorize=self.authorize,
+            request=self.endpoint, clock=lambda: self.now
+        )
+
+    def test_encrypted_at_rest(self):
+        self.cache().save(self.SECRETS, self.credentials('secret', 3600))
+        path = self.cache().path(self.SECRETS)
+        with open(path, 'rb') as fp:
+            self.assertNotIn(b'secret', fp.read())
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+        self.assertEqual(self.cache().load(self.SECRETS).token, 'secret')
+        self.assertIsNone(self.cache(Fernet.generate_key()).load(self.SECRETS))
+
+    def test_key_file(self):
+        """
+        Without a key, one is kept outside the token directory
+        """
+        tokens = os.path.join(self.tmpdir, 'tokens')
+        key_path = os.path.join(self.tmpdir, 'config', 'token.key')
+        # key of an older version, kept with the tokens
+        os.makedirs(tokens)
+        with open(os.path.join(tokens, 'token.key'), 'wb') as fp:
+            fp.write(self.key)
+        cache = TokenCache(tokens, key_path=key_path)
+        cache.save(self.SECRETS, self.credentials('stored', 3600))
+        self.assertEqual(
+            os.listdir(tokens), [os.path.basename(cache.path(self.SECRETS))]
+        )
+        self.assertEqual(os.stat(key_path).st_mode & 0o777, 0o600)
+        # still readable with the key of the older version
+        self.assertEqual(
+            TokenCache(tokens, key=self.key).load(self.SECRETS).token,
+            'stored'
+        )
+        os.chmod(key_path, 0o644)
+        with self.assertRaises(PermissionError):
+            TokenCache(tokens, key_path=key_path).cipher()
+        with self.assertRaises(ValueError):
+            TokenCache(tokens, key_path=os.path.join(tokens, 'k')).cipher()
+
+    def test_cold_start(self):
+        """
+        A valid stored token needs no authorization nor refresh
+        """
+        self.cache().save(self.SECRETS, self.credentials('stored', 3600))
+        cache = self.cache()
+        service = cache.service(self.SECRETS)
+        self.assertIs(cache.service(self.SECRETS), service)
+        self.assertEqual(cache.credentials(self.SECRETS).token, 'stored')
+        self.assertEqual((self.authorized, self.endpoint.refreshes), ([], 0))
+
+    def test_refresh_ahead_of_expiry(self):
+        self.cache().save(self.SECRETS, self.credentials('stored', 3600))
+        cache = self.cache()
+        cache.credentials(self.SECRETS)
+        self.now += 3600 - TokenCache.REFRESH_MARGIN + 1
+        self.assertEqual(cache.credentials(self.SECRETS).token, 'token1')
+        # written back for the next worker
+        self.assertEqual(self.cache().load(self.SECRETS).token, 'token1')
+        self.assertEqual(self.authorized, [])
+
+    def test_shared_by_threads(self):
+        self.cache().save(self.SECRETS, self.credentials('stored', 60))
+        cache = self.cache()
+        results = []
+
+        def connect():
+            results.append(
+                (cache.credentials(self.SECRETS), cache.service(self.SECRETS))
+            )
+
+        threads = [threading.Thread(target=connect) for x in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len({id(result[0]) for result in results}), 1)
+        self.assertEqual(len({id(result[1]) for result in results}), 4)
+        self.assertEqual(self.endpoint.refreshes, 1)
+
+    def test_headless_without_token(self):
+        cache = TokenCache(self.tmpdir, key=self.key)
+        with unittest.mock.patch('sys.stdin', io.StringIO()):
+            with self.assertRaises(AuthorizationRequired):
+                cache.service(self.SECRETS)
+        # authorized once from a terminal
+        self.cache().credentials(self.SECRETS)
+        self.assertEqual(cache.credentials(self.SECRETS).token, 'authorized')
+
+
+def probe_result(
+    duration=2.0, frames=50, packets=None, vcodec='h264', acodec='aac',
+    size=(1280, 720)
+):
+    """
+    ffprobe output of a video made at 25 fps
+    """
+    return {
+        'format': {'duration': str(duration)},
+        'streams': [
+            {
+                'codec_type': 'video', 'codec_name': vcodec,
+                'width': size[0], 'height': size[1],
+                'avg_frame_rate': '25/1', 'duration': str(duration),
+                'nb_frames': str(frames),
+                'nb_read_packets': str(frames if packets is None else packets),
+            },
+            {
+                'codec_type': 'audio', 'codec_name': acodec,
+                'nb_frames': '94', 'nb_read_packets': '94',
+            },
+        ],
+    }
+
+
+class TestVideoValidator(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.results = {}
+        self.probed = []
+        self.delay = 0
+        self.cache = ProbeCache(
+            os.path.join(self.tmpdir, 'probes.sqlite3'), self.probe
+        )
+        self.validator = VideoValidator(self.cache, workers=8)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.tmpdir)
+
+    def probe(self, path):
+        self.probed.append(os.path.basename(path))
+        time.sleep(self.delay)
+        return self.results[os.path.basename(path)]
+
+    def video(self, name, **result):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'wb') as video:
+            video.write(b'video')
+        self.results[name] = probe_result(**result)
+        return path
+
+    def test_cached_until_changed(self):
+        path = self.video('word.mp4')
+        self.assertTrue(self.validator.check(path).ok)
+        self.assertTrue(self.validator.check(path).ok)
+        self.assertEqual(self.probed, ['word.mp4'])
+        # a new cache reads the same file
+        cache = ProbeCache(self.cache.state_path, self.probe)
+        self.assertEqual(cache.get(path), self.results['word.mp4'])
+        self.assertEqual(self.probed, ['word.mp4'])
+        with open(path, 'ab') as video:
+            video.write(b'more')
+        self.validator.check(path)
+        self.assertEqual(self.probed, ['word.mp4', 'word.mp4'])
+        os.remove(path)
+        self.assertEqual(cache.prune(), 1)
+        cache.close()
+
+    def test_rejected(self):
+        audio = os.path.join(self.tmpdir, 'audio.wav')
+        with open(audio, 'wb') as wav:
+            wav.write(b'wav')
+        self.results['audio.wav'] = {'format': {'duration': '2.0'}}
+        videos = {
+            'truncated': self.video('truncated.mp4', packets=31),
+            'codec': self.video('codec.mp4', vcodec='mpeg4'),
+            'size': self.video('size.mp4', size=(640, 360)),
+            'frames': self.video('frames.mp4', frames=20),
+            'audio': self.video('audio.mp4', duration=1.5, frames=38),
+        }
+        for reason, path in videos.items():
+            with self.assertRaises(InvalidVideo, msg=reason):
+                self.validator.validate(path, audio)
+        self.assertTrue(
+            self.validator.check(self.video('good.mp4'), audio).ok
+        )
+
+    def test_probe_error(self):
+        path = self.video('broken.mp4')
+
+        def probe(path):
+            self.probed.append(path)
+            raise ffmpeg.Error('ffprobe', b'', b'moov atom not found')
+
+        self.cache.probe = probe
+        for x in range(2):
+            validation = self.validator.check(path)
+            self.assertEqual(
+                validation.errors, ['ffprobe: moov atom not found']
+            )
+        self.assertEqual(len(self.probed), 1)
+
+    def test_check_many(self):
+        """
+        Probes run in parallel, results come in order
+        """
+        paths = [self.video(f'video{index}.mp4') for index in range(8)]
+        paths.insert(4, self.video('truncated.mp4', packets=10))
+        self.delay = 0.1
+        started = time.perf_counter()
+        validations = self.validator.check_many(paths)
+        self.assertLess(time.perf_counter() - started, 0.5)
+        self.assertEqual([v.path for v in validations], paths)
+        self.assertEqual(
+            [v.ok for v in validations], [True] * 4 + [False] + [True] * 4
+        )
+
+    def test_upload_queue(self):
+        scheduler = UploadScheduler(
+            [], os.path.join(self.tmpdir, 'uploads.sqlite3'),
+            validator=self.validator, upload=lambda service, video: {}
+        )
+        with self.assertRaises(InvalidVideo):
+            scheduler.add(YoutubeVideo(
+                file=self.video('bad.mp4', acodec='opus'), title='bad'
+            ))
+        path = self.video('good.mp4')
+        scheduler.add(YoutubeVideo(file=path, title='good'))
+        # truncated after being queued
+        self.results['good.mp4'] = probe_result(packets=12)
+        with open(path, 'ab') as video:
+            video.write(b'more')
+        channel = Channel('channel', 'project', lambda: None)
+        scheduler.upload_next(channel, None)
+        self.assertEqual(scheduler.counts(), {'failed': 1})
+        scheduler.close()
+
 
 class TestWordImporter(unittest.TestCase):
     def test_import_language(self):
@@ -2,12 +2,18 @@
 Example file from youtube sample code.
 Port to Python3
 Add a singleton connection: YoutubeService
+OAuth tokens are kept encrypted on disk by the TokenCache
 """
 import argparse
+import datetime
+import hashlib
 import http.client
 import httplib2
+import json
 import os
 import random
+import sys
+import threading
 import time
 
 import google.oauth2.credentials
@@ -16,6 +22,14 @@ from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaFileUpload
 from google_auth_oauthlib.flow import InstalledAppFlow
+from google.oauth2.credentials import Credentials
+
+from medialib import library
+from utils import lazy_import
+
+fernet = lazy_import('cryptography.fernet')
+google_auth_exceptions = lazy_import('google.auth.exceptions')
+google_auth_requests = lazy_import('google.auth.transport.requests')
 
 
 # Explicitly tell the underlying HTTP transport library not to retry, since
@@ -59,29 +73,257 @@ API_VERSION = 'v3'
 
 VALID_PRIVACY_STATUSES = ('public', 'private', 'unlisted')
 
+# Encrypted tokens of the client secrets files. The key comes from the
+# TOKEN_KEY_ENV variable or, without it, from a key file made on first use
+# in the home of the user, away from the tokens.
+TOKEN_DIR = os.path.join(BASEDIR, 'tokens')
+TOKEN_KEY_ENV = 'IS_TOKEN_KEY'
+TOKEN_KEY_FILE = os.path.join(
+    os.path.expanduser('~'), '.config', 'intonation_studio', 'token.key'
+)
+
+
+# Reasons of the 403 errors of an exhausted quota: the upload limit is
+# the one of the channel, the others are the ones of the project
+PROJECT_QUOTA_REASONS = ('quotaExceeded', 'dailyLimitExceeded')
+CHANNEL_QUOTA_REASONS = ('uploadLimitExceeded',)
+
+
+class UploadError(Exception):
+    pass
+
+
+class QuotaExceeded(UploadError):
+    """
+    The project or, if channel is true, only the channel cannot upload
+    before the quota resets
+    """
+    def __init__(self, message, channel=False):
+        super().__init__(message)
+        self.channel = channel
+
+
+def quota_reason(error):
+    """
+    Reason of a quota 403 error, None for other errors
+    """
+    if error.resp.status != 403:
+        return None
+    content = error.content.decode('utf8', 'replace') \
+        if isinstance(error.content, bytes) else str(error.content)
+    for reason in PROJECT_QUOTA_REASONS + CHANNEL_QUOTA_REASONS:
+        if reason in content:
+            return reason
+    return None
+
+
+class AuthorizationRequired(UploadError):
+    """
+    No usable token and no terminal to authorize a new one
+    """
 
-# Authorize the request and store authorization credentials.
-def get_authenticated_service():
-    flow = InstalledAppFlow.from_client_secrets_file(
-        CLIENT_SECRETS_FILE, SCOPES
-    )
-    credentials = flow.run_console()
-    return build(API_SERVICE_NAME, API_VERSION, credentials=credentials)
+
+class TokenCache:
+    """
+    OAuth credentials of the client secrets files, encrypted on disk so
+    that workers start without any authorization step while the token
+    is valid. The credentials of a file are loaded once per process and
+    shared by every thread: they are refreshed REFRESH_MARGIN seconds
+    before they expire and written back whenever their token changes.
+    Services wrap an httplib2 connection, which is not thread safe, so
+    every thread builds its own around the shared credentials.
+
+    The encryption protects the tokens when the token directory leaves
+    the machine: a backup, a copied volume, a directory committed by
+    mistake. It does not protect them from anyone running as the user
+    of the workers, who can read the key as well. That only holds while
+    the key is not stored with the tokens: it comes from TOKEN_KEY_ENV,
+    a secret of the deployment, or from a key file outside the token
+    directory, only readable by its owner.
+    """
+    REFRESH_MARGIN = 600
+
+    def __init__(
+        self,
+        directory=TOKEN_DIR,
+        key=None,
+        authorize=None,
+        request=None,
+        clock=time.time,
+        key_path=TOKEN_KEY_FILE
+    ):
+        """
+        authorize returns new credentials for a client secrets file,
+        request is the transport of the token refreshes
+        """
+        self.directory = directory
+        self.key = key
+        self.key_path = key_path
+        self.authorize = authorize or self.default_authorize
+        self.request = request
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.local = threading.local()
+
+    @staticmethod
+    def default_authorize(client_secrets_file):
+        if not sys.stdin.isatty():
+            raise AuthorizationRequired(
+                'No valid token for %s, authorize it once with: '
+                'python upload.py --authorize --client-secrets %s' %
+                (client_secrets_file, client_secrets_file)
+            )
+        flow = InstalledAppFlow.from_client_secrets_file(
+            client_secrets_file, SCOPES
+        )
+        return flow.run_local_server(port=0, open_browser=False)
+
+    def cipher(self):
+        if self.key is None:
+            self.key = os.environ.get(TOKEN_KEY_ENV) or self.key_file()
+        return fernet.Fernet(self.key)
+
+    def key_file(self):
+        """
+        Key of the key file, made on first use. A key file readable by
+        others is refused, a key left in the token directory by older
+        versions is moved out of it.
+        """
+        path = self.key_path
+        if os.path.dirname(os.path.abspath(path)) == \
+                os.path.abspath(self.directory):
+            raise ValueError(f'{path}: the key cannot live with the tokens')
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        legacy = os.path.join(self.directory, 'token.key')
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            if os.stat(path).st_mode & 0o077:
+                raise PermissionError(
+                    f'{path} is readable by others, chmod 600 it'
+                )
+            with open(path, 'rb') as fp:
+                return fp.read()
+        if os.path.exists(legacy):
+            with open(legacy, 'rb') as fp:
+                key = fp.read()
+        else:
+            key = fernet.Fernet.generate_key()
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(key)
+        if os.path.exists(legacy):
+            os.remove(legacy)
+        return key
+
+    def path(self, client_secrets_file):
+        name = hashlib.sha256(
+            os.path.abspath(client_secrets_file).encode('utf8')
+        ).hexdigest()[:16]
+        return os.path.join(self.directory, name + '.token')
+
+    def load(self, client_secrets_file):
+        """
+        Stored credentials, None if missing or not readable with the key
+        """
+        try:
+            with open(self.path(client_secrets_file), 'rb') as fp:
+                info = json.loads(self.cipher().decrypt(fp.read()))
+        except (OSError, ValueError, fernet.InvalidToken):
+            return None
+        return Credentials.from_authorized_user_info(info, SCOPES)
+
+    def save(self, client_secrets_file, credentials):
+        path = self.path(client_secrets_file)
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        data = self.cipher().encrypt(credentials.to_json().encode('utf8'))
+        temp = '%s.%d.tmp' % (path, os.getpid())
+        fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(data)
+        os.replace(temp, path)
+
+    def expires_in(self, credentials):
+        if credentials.expiry is None:
+            return float('inf') if credentials.token else 0.0
+        # google-auth expiries are naive UTC
+        expiry = credentials.expiry.replace(tzinfo=datetime.timezone.utc)
+        return expiry.timestamp() - self.clock()
+
+    def entry(self, client_secrets_file):
+        with self.lock:
+            return self.entries.setdefault(
+                client_secrets_file,
+                {'lock': threading.Lock(), 'credentials': None, 'token': None}
+            )
+
+    def credentials(self, client_secrets_file=CLIENT_SECRETS_FILE):
+        """
+        Valid credentials of a client secrets file, refreshed if they
+        expire within REFRESH_MARGIN seconds
+        """
+        entry = self.entry(client_secrets_file)
+        with entry['lock']:
+            credentials = entry['credentials']
+            if credentials is None:
+                credentials = self.load(client_secrets_file)
+                if credentials is not None:
+                    entry['token'] = credentials.token
+            if credentials is None or not credentials.refresh_token and \
+                    self.expires_in(credentials) <= 0:
+                credentials = self.authorize(client_secrets_file)
+            elif self.expires_in(credentials) < self.REFRESH_MARGIN:
+                try:
+                    credentials.refresh(
+                        self.request or google_auth_requests.Request()
+                    )
+                except google_auth_exceptions.RefreshError:
+                    # revoked or expired refresh token
+                    credentials = self.authorize(client_secrets_file)
+            entry['credentials'] = credentials
+            if credentials.token != entry['token']:
+                self.save(client_secrets_file, credentials)
+                entry['token'] = credentials.token
+            return credentials
+
+    def service(self, client_secrets_file=CLIENT_SECRETS_FILE):
+        """
+        YouTube service of the current thread
+        """
+        credentials = self.credentials(client_secrets_file)
+        services = self.local.__dict__.setdefault('services', {})
+        built_with, service = services.get(client_secrets_file, (None, None))
+        if built_with is not credentials:
+            # the discovery document ships with the client library
+            service = build(
+                API_SERVICE_NAME, API_VERSION, credentials=credentials,
+                static_discovery=True
+            )
+            services[client_secrets_file] = credentials, service
+        return service
+
+    def clear(self):
+        with self.lock:
+            self.entries = {}
+        self.local = threading.local()
+
+
+token_cache = TokenCache()
+
+
+def get_authenticated_service(client_secrets_file=CLIENT_SECRETS_FILE):
+    return token_cache.service(client_secrets_file)
 
 
 class YoutubeService:
     """
     Singleton implementation
-    Reuse the same connection for multiple requests
+    Reuse the same connection for multiple requests of a thread,
+    the credentials are shared by the process
     """
-    instance = None
-
-    def __init__(self):
-        if not YoutubeService.instance:
-            YoutubeService.instance = get_authenticated_service()
 
     def __getattr__(self, name):
-        return getattr(self.instance, name)
+        return getattr(get_authenticated_service(), name)
 
 
 def initialize_upload(youtube, options):
@@ -121,7 +363,9 @@ def initialize_upload(youtube, options):
         media_body=MediaFileUpload(options.file, chunksize=-1, resumable=True)
     )
 
-    resumable_upload(insert_request)
+    response = resumable_upload(insert_request)
+    library.mark_uploaded(options.file, response['id'])
+    return response
 
 
 # This method implements an exponential backoff strategy to resume a
@@ -140,12 +384,18 @@ def resumable_upload(request):
                         'Video id "%s" was successfully uploaded.' %
                         response['id']
                     )
+                    return response
                 else:
-                    exit(
+                    raise UploadError(
                         'The upload failed with an unexpected response: %s' %
                         response
                     )
         except HttpError as e:
+            reason = quota_reason(e)
+            if reason:
+                raise QuotaExceeded(
+                    e.content, channel=reason in CHANNEL_QUOTA_REASONS
+                ) from e
             if e.resp.status in RETRIABLE_STATUS_CODES:
                 error = 'A retriable HTTP error %d occurred:\n%s' % (
                     e.resp.status,
@@ -156,11 +406,12 @@ def resumable_upload(request):
         except RETRIABLE_EXCEPTIONS as e:
             error = 'A retriable error occurred: %s' % e
 
-            if error is not None:
-                print(error)
-                retry += 1
+        if error is not None:
+            print(error)
+            retry += 1
+            error = None
             if retry > MAX_RETRIES:
-                exit('No longer attempting to retry.')
+                raise UploadError('No longer attempting to retry.')
 
             max_sleep = 2 ** retry
             sleep_seconds = random.random() * max_sleep
@@ -174,11 +425,13 @@ def upload_file(options):
         initialize_upload(youtube, options)
     except HttpError as e:
         print('An HTTP error %d occurred:\n%s' % (e.resp.status, e.content))
+    except UploadError as e:
+        print('The upload failed: %s' % e)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument('--file', required=True, help='Video file to upload')
+    parser.add_argument('--file', help='Video file to upload')
     parser.add_argument('--title', help='Video title', default='Test Title')
     parser.add_argument(
         '--description',
@@ -201,11 +454,26 @@ if __name__ == '__main__':
         default='public',
         help='Video privacy status.'
     )
+    parser.add_argument(
+        '--client-secrets', default=CLIENT_SECRETS_FILE,
+        help='OAuth client secrets file of the channel'
+    )
+    parser.add_argument(
+        '--authorize', action='store_true',
+        help='Authorize the client and store its token for the workers'
+    )
     args = parser.parse_args()
-
-    youtube = get_authenticated_service()
+    if args.authorize:
+        token_cache.credentials(args.client_secrets)
+        print('Token stored in %s' % token_cache.path(args.client_secrets))
+        exit()
+    if not args.file:
+        parser.error('--file is required')
 
     try:
+        youtube = get_authenticated_service(args.client_secrets)
         initialize_upload(youtube, args)
     except HttpError as e:
         print('An HTTP error %d occurred:\n%s' % (e.resp.status, e.content))
+    except UploadError as e:
+        exit('The upload failed: %s' % e)
@@ -1,23 +1,40 @@
+import importlib.util
 import os
-import math
+import sys
 
+import numpy as np
 
-def path_in_medialib(filename,  medialib='samples', overwrite=False):
+
+def lazy_import(name):
+    """
+    Import a module on the first access to one of its attributes.
+    Heavy dependencies are only paid for by the workers using them.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f'No module named {name!r}', name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    # bind the submodule on its package like a regular import does
+    parent, _, child = name.rpartition('.')
+    if parent:
+        setattr(importlib.import_module(parent), child, module)
+    loader.exec_module(module)
+    return module
+
+
+def path_in_medialib(filename,  medialib='samples'):
     """
-    Returns a path within the media folder.
+    Returns a path within the samples folder.
+    Generated artifacts belong to the MediaLibrary.
     """
     filedir = os.path.dirname(os.path.abspath(__file__))
     basedir = os.path.join(filedir, f'{medialib}/')
-    filepath = os.path.join(basedir, filename)
-    if not overwrite and os.path.exists(filepath):
-        counter = 1
-        while not os.path.exists(filepath):
-            filename, extension = os.path.splitext(filepath)[0]
-            filepath = os.path.join(
-                os.path.dirname(filepath),
-                f'{filename}_{counter}{extension}'
-            )
-    return filepath
+    return os.path.join(basedir, filename)
 
 
 class ColorTools:
@@ -55,54 +72,98 @@ class ColorTools:
 
 
 class NoteTools:
+    """
+    Conversions between MIDI numbers, frequencies and note names.
+    The plural methods work on whole arrays through lookup tables.
+    """
     A4 = 440
     C0 = A4*pow(2, -4.75)
     notes = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
+    # Lookup tables indexed by MIDI number, C-1 to G9
+    MIDI_RANGE = np.arange(128)
+    NOTE_NAMES = np.char.add(
+        np.array(notes)[MIDI_RANGE % 12],
+        (MIDI_RANGE // 12 - 1).astype(str)
+    )
+    NOTE_FREQS = A4 * np.power(2.0, (MIDI_RANGE - 69) / 12)
+    # Note names sorted for the reverse lookup
+    NAME_ORDER = np.argsort(NOTE_NAMES)
+    SORTED_NAMES = NOTE_NAMES[NAME_ORDER]
+
+    @classmethod
+    def midi_to_notes(cls, midi):
+        """
+        Note names of MIDI numbers, fractions are truncated
+        """
+        index = np.clip(np.asarray(midi).astype(int), 0, 127)
+        return cls.NOTE_NAMES[index]
+
+    @classmethod
+    def notes_to_midi(cls, notes):
+        """
+        MIDI numbers of note names
+        """
+        notes = np.char.upper(np.asarray(notes, dtype=str))
+        position = np.searchsorted(cls.SORTED_NAMES, notes)
+        position = np.minimum(position, cls.SORTED_NAMES.size - 1)
+        unknown = cls.SORTED_NAMES[position] != notes
+        if np.any(unknown):
+            raise ValueError(f'Unknown notes: {notes[unknown]}')
+        return cls.NAME_ORDER[position]
+
+    @classmethod
+    def midi_to_freqs(cls, midi):
+        midi = np.asarray(midi, dtype=float)
+        return cls.A4 * np.power(2.0, (midi - 69) / 12)
+
+    @classmethod
+    def freqs_to_midi(cls, freqs):
+        return 69 + 12 * np.log2(np.asarray(freqs, dtype=float) / cls.A4)
+
+    @classmethod
+    def notes_to_freqs(cls, notes):
+        return cls.NOTE_FREQS[cls.notes_to_midi(notes)]
+
+    @classmethod
+    def freqs_to_notes(cls, freqs):
+        """
+        Note names of frequencies, rounded to the closest note.
+        Unvoiced frequencies, 0 or below, get the lowest note.
+        """
+        freqs = np.asarray(freqs, dtype=float)
+        voiced = freqs > 0
+        midi = cls.freqs_to_midi(np.where(voiced, freqs, cls.A4))
+        return cls.midi_to_notes(np.where(voiced, np.rint(midi), 0))
 
     @classmethod
     def note_to_midi(cls, note):
         # Accepted notation is Note-Octave
-        note, octave = note[:-1].upper(), int(note[-1])
-        st = cls.notes.index(note)
-        return 12 + octave * 12 + st
+        return int(cls.notes_to_midi(note))
 
     @classmethod
     def midi_to_note(cls, midi):
         # Accepted notation is Note-Octave
-        midi_rounded = int(midi)
-        octave = midi_rounded // 12 - 1
-        st_index = midi_rounded % 12
-        return cls.notes[st_index] + str(octave)
+        return str(cls.midi_to_notes(midi))
 
     @classmethod
     def note_to_freq(cls, note):
         # Accepted notation is Note-Octave
-        note, octave = note[:-1].upper(), int(note[-1])
-        dn = cls.notes.index(note)
-        return cls.C0 * pow(2, (octave*12 + dn) / 12)
+        return float(cls.notes_to_freqs(note))
 
     @classmethod
     def freq_to_note(cls, freq):
-        h = round(12 * math.log2(freq/cls.C0))
-        octave = h // 12
-        n = h % 12
-        return cls.notes[n] + str(octave)
+        return str(cls.freqs_to_notes(freq))
+
+    @classmethod
+    def midi_range(cls, note_min, note_max):
+        """
+        MIDI numbers from note_min to note_max included
+        """
+        return np.arange(
+            cls.note_to_midi(note_min),
+            cls.note_to_midi(note_max) + 1
+        )
 
     @classmethod
     def note_range(cls, note_min, note_max):
-        note_min, oct_min = note_min[:-1].upper(), int(note_min[-1])
-        note_max, oct_max = note_max[:-1].upper(), int(note_max[-1])
-        index_min, index_max = \
-            cls.notes.index(note_min), cls.notes.index(note_max)
-        index, octave = index_min, oct_min
-        note_range = []
-        while True:
-            note_range.append(f"{cls.notes[index]}{octave}")
-            if index == index_max and octave == oct_max:
-                break
-            else:
-                if index == len(cls.notes) - 1:
-                    index, octave = 0, octave + 1
-                else:
-                    index = index + 1
-        return note_range
+        return cls.NOTE_NAMES[cls.midi_range(note_min, note_max)].tolist()
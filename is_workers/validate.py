@@ -0,0 +1,299 @@
+"""
+Validation of the finished videos before they reach the upload queue.
+ffprobe reads the container and counts the packets of every stream,
+which finds truncated files without decoding them. The probes run in a
+bounded pool, every worker waits on its own ffprobe process, and their
+results are kept in a SQLite file of the media library keyed by the
+size and modification time of the files: a video is only probed again
+once it changed.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import List
+
+from medialib import library
+from utils import lazy_import
+
+ffmpeg = lazy_import('ffmpeg')
+
+
+def probe(path):
+    """
+    ffprobe output of a file, with the packets of the streams counted
+    """
+    return ffmpeg.probe(path, count_packets=None)
+
+
+class ProbeCache:
+    """
+    ffprobe results of the files, valid while their size and
+    modification time do not change. Failed probes are kept too:
+    a broken file stays broken until it is written again.
+    """
+    STATE_FILE = '.probes.sqlite3'
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS probes (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            result TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, state_path=None, probe=probe):
+        self.state_path = state_path or os.path.join(
+            library.root, self.STATE_FILE
+        )
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        self.probe = probe
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(
+            self.state_path, isolation_level=None, check_same_thread=False,
+            timeout=30
+        )
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.db.executescript(self.SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def get(self, path):
+        """
+        Probe result of a file, {'error': message} if ffprobe failed
+        """
+        key = os.path.realpath(path)
+        stat = os.stat(key)
+        with self.lock:
+            row = self.db.execute(
+                'SELECT result FROM probes '
+                'WHERE path = ? AND size = ? AND mtime_ns = ?',
+                (key, stat.st_size, stat.st_mtime_ns)
+            ).fetchone()
+        if row is not None:
+            return json.loads(row[0])
+        try:
+            result = self.probe(key)
+        except ffmpeg.Error as e:
+            message = e.stderr.decode('utf8', 'replace').strip()
+            result = {'error': message or 'ffprobe failed'}
+        after = os.stat(key)
+        # a file written during the probe is probed again next time
+        if (after.st_size, after.st_mtime_ns) == \
+                (stat.st_size, stat.st_mtime_ns):
+            with self.lock:
+                self.db.execute(
+                    'INSERT OR REPLACE INTO probes '
+                    '(path, size, mtime_ns, result) VALUES (?, ?, ?, ?)',
+                    (key, stat.st_size, stat.st_mtime_ns, json.dumps(result))
+                )
+        return result
+
+    def prune(self):
+        """
+        Forget the files removed since their probe, return how many
+        """
+        with self.lock:
+            paths = [
+                row[0] for row in self.db.execute('SELECT path FROM probes')
+            ]
+            missing = [(path,) for path in paths if not os.path.exists(path)]
+            self.db.executemany('DELETE FROM probes WHERE path = ?', missing)
+        return len(missing)
+
+
+@dataclass
+class Validation:
+    path: str
+    errors: List[str] = field(default_factory=list)
+    duration: float = 0.0
+
+    @property
+    def ok(self):
+        return not self.errors
+
+
+class InvalidVideo(ValueError):
+    def __init__(self, validation):
+        super().__init__(
+            '%s: %s' % (validation.path, '; '.join(validation.errors))
+        )
+        self.validation = validation
+
+
+def frame_rate(stream):
+    numerator, _, denominator = stream.get('avg_frame_rate', '0/0') \
+        .partition('/')
+    if not float(denominator or 0):
+        return 0.0
+    return float(numerator) / float(denominator)
+
+
+class VideoValidator:
+    """
+    Checks of the finished videos against what the makers encode:
+    codecs, resolution, complete streams, frames matching the duration
+    and a duration matching the audio the video was made from
+    """
+    VIDEO_CODECS = ('h264',)
+    AUDIO_CODECS = ('aac',)
+    # frames of the ImageMaker
+    RESOLUTION = (1280, 720)
+    # seconds of difference allowed with the audio, on top of one frame
+    DURATION_TOLERANCE = 0.1
+    AUDIO_EXTENSIONS = ('.wav', '.mp3')
+    WORKERS = os.cpu_count() or 1
+
+    def __init__(self, cache=None, resolution=RESOLUTION, workers=WORKERS):
+        """
+        resolution None accepts any size
+        """
+        self.cache = cache or ProbeCache()
+        self.resolution = resolution
+        self.workers = workers
+
+    @classmethod
+    def audio_of(cls, video_path):
+        """
+        Audio of the library a video was made from, None if removed:
+        <name>.mp4 is made from <name>.wav or <name>.mp3,
+        <name>.wav.mp4 from <name>.wav
+        """
+        stem = os.path.splitext(os.path.basename(video_path))[0]
+        names = [stem] if os.path.splitext(stem)[1] in cls.AUDIO_EXTENSIONS \
+            else [f'{stem}{extension}' for extension in cls.AUDIO_EXTENSIONS]
+        for name in names:
+            if library.exists(name):
+                return library.path(name)
+        return None
+
+    @staticmethod
+    def streams(result, codec_type):
+        return [
+            stream for stream in result.get('streams', [])
+            if stream.get('codec_type') == codec_type
+        ]
+
+    @staticmethod
+    def check_packets(stream, name, errors):
+        """
+        Frames announced by the container against the packets read
+        """
+        frames = int(stream.get('nb_frames', 0))
+        packets = int(stream.get('nb_read_packets', frames))
+        if not frames and not packets:
+            errors.append(f'no {name} frames')
+        elif packets < frames:
+            errors.append(f'truncated {name}: {packets} of {frames} frames')
+        return packets
+
+    def check(self, path, audio_path=None):
+        """
+        Validation of a video, audio_path defaults to audio_of
+        """
+        validation = Validation(path)
+        errors = validation.errors
+        if not os.path.exists(path):
+            errors.append('missing file')
+            return validation
+        result = self.cache.get(path)
+        if 'error' in result:
+            errors.append(f'ffprobe: {result["error"]}')
+            return validation
+        validation.duration = float(
+            result.get('format', {}).get('duration', 0)
+        )
+        videos = self.streams(result, 'video')
+        audios = self.streams(result, 'audio')
+        rate = 0.0
+        if not videos:
+            errors.append('no video stream')
+        else:
+            video = videos[0]
+            if video.get('codec_name') not in self.VIDEO_CODECS:
+                errors.append(f'video codec {video.get("codec_name")}')
+            size = (video.get('width'), video.get('height'))
+            if self.resolution and size != tuple(self.resolution):
+                errors.append('resolution %sx%s' % size)
+            frames = self.check_packets(video, 'video', errors)
+            rate = frame_rate(video)
+            duration = float(video.get('duration', validation.duration))
+            if rate and frames and abs(frames - duration * rate) > 1:
+                errors.append(
+                    f'{frames} frames for {duration:.2f}s at {rate:g} fps'
+                )
+        if not audios:
+            errors.append('no audio stream')
+        else:
+            audio = audios[0]
+            if audio.get('codec_name') not in self.AUDIO_CODECS:
+                errors.append(f'audio codec {audio.get("codec_name")}')
+            self.check_packets(audio, 'audio', errors)
+        audio_path = audio_path or self.audio_of(path)
+        if audio_path and os.path.exists(audio_path):
+            source = self.cache.get(audio_path)
+            expected = float(source.get('format', {}).get('duration', 0))
+            tolerance = self.DURATION_TOLERANCE + (1 / rate if rate else 0)
+            if 'error' in source:
+                errors.append(f'audio ffprobe: {source["error"]}')
+            elif abs(validation.duration - expected) > tolerance:
+                errors.append(
+                    f'duration {validation.duration:.2f}s, '
+                    f'audio {expected:.2f}s'
+                )
+        return validation
+
+    def check_many(self, paths, audio_paths=None):
+        """
+        Validations of many videos, in order, workers probes at a time
+        """
+        audio_paths = audio_paths or [None] * len(paths)
+        with ThreadPoolExecutor(self.workers) as pool:
+            return list(pool.map(self.check, paths, audio_paths))
+
+    def validate(self, path, audio_path=None):
+        """
+        Raise InvalidVideo unless the video can be uploaded
+        """
+        validation = self.check(path, audio_path)
+        if not validation.ok:
+            raise InvalidVideo(validation)
+        return validation
+
+
+def library_videos():
+    """
+    Finished videos of the media library
+    """
+    return sorted(
+        entry.path for entry in library.scan()
+        if entry.name.endswith('.mp4') and not entry.name.startswith(
+            (library.PARTIAL_PREFIX, 'preview_', 'segment_')
+        )
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'videos', nargs='*', help='every video of the library if none'
+    )
+    parser.add_argument('--workers', type=int, default=VideoValidator.WORKERS)
+    parser.add_argument(
+        '--prune', action='store_true',
+        help='forget the probes of removed files'
+    )
+    args = parser.parse_args()
+    validator = VideoValidator(workers=args.workers)
+    if args.prune:
+        print('%d probes pruned' % validator.cache.prune())
+    validations = validator.check_many(args.videos or library_videos())
+    invalid = [validation for validation in validations if not validation.ok]
+    for validation in invalid:
+        print('%s: %s' % (validation.path, '; '.join(validation.errors)))
+    print('%d videos, %d invalid' % (len(validations), len(invalid)))
+    exit(1 if invalid else 0)
@@ -1,9 +1,14 @@
 import os
-from ffprobe import FFProbe
 from audio import GoogleSpeaker, AudioAnalyst
+from audiofile import Audio, audio_cache
+from framebuffer import encode_parallel
 from image import ImageMaker
-from utils import path_in_medialib
-import ffmpeg
+from medialib import library
+from segments import Segmenter
+from utils import path_in_medialib, lazy_import
+
+ffmpeg = lazy_import('ffmpeg')
+ffprobe = lazy_import('ffprobe')
 
 
 class VideoMaker:
@@ -12,12 +17,43 @@ class VideoMaker:
     and image makers
     """
     TARGET_EXTENSION = '.mp4'
+    PREVIEW_PREFIX = 'preview'
+    PREVIEW_OUTDICT = {
+        'vcodec': 'libx264',
+        'preset': 'ultrafast',
+        'pix_fmt': 'yuv420p',
+        'shortest': None,
+    }
 
     @staticmethod
     def get_meta(video_path):
-        metadata = FFProbe(video_path)
+        metadata = ffprobe.FFProbe(video_path)
         return metadata
 
+    @staticmethod
+    def run(stream, signal=None):
+        """
+        Run an ffmpeg stream and print its output on failure.
+        The signal is written to the audio pipe.
+        """
+        try:
+            return stream.run(
+                input=None if signal is None else Audio.pipe(signal),
+                capture_stdout=True,
+                capture_stderr=True
+            )
+        except ffmpeg.Error as e:
+            print('stdout:', e.stdout.decode('utf8'))
+            print('stderr:', e.stderr.decode('utf8'))
+            raise e
+
+    @staticmethod
+    def audio_pipe(samplerate):
+        """
+        ffmpeg input reading a mono float signal from the pipe
+        """
+        return ffmpeg.input('pipe:', format='f32le', ar=samplerate, ac=1)
+
     @classmethod
     def from_text(
         cls,
@@ -35,55 +71,245 @@ class VideoMaker:
             language=language,
             rate=rate
             )
-        if not videopath:
-            basename = os.path.splitext(os.path.basename(audio_filepath))[0]
-            filename = f'{basename}{cls.TARGET_EXTENSION}'
-            video_path = path_in_medialib(filename)
         analyst = AudioAnalyst(audio_filepath, text)
         analysis = analyst.analyse()
-        image_maker = ImageMaker(analysis)
-        pattern = image_maker.save_images()
-        outdict = {
-            'vcodec': 'h264',
-            'shortest': None
-        }
-        image = ffmpeg.input(pattern)
-        audio = ffmpeg.input(audio_filepath)
-        try:
-            ffmpeg.output(image, audio, video_path, **outdict).run(
-                capture_stdout=True,
-                capture_stderr=True
-            )
-            return videopath
-        except ffmpeg.Error as e:
-            print('stdout:', e.stdout.decode('utf8'))
-            print('stderr:', e.stderr.decode('utf8'))
-            raise e
-        return None
+        if videopath:
+            return encode_parallel(analysis, audio_filepath, videopath)
+        basename = os.path.splitext(os.path.basename(audio_filepath))[0]
+        filename = f'{basename}{cls.TARGET_EXTENSION}'
+        with library.atomic(filename) as partial_path:
+            encode_parallel(analysis, audio_filepath, partial_path)
+        return library.path(filename)
 
     @staticmethod
     def from_audio(filename, text=None):
-        wav_file = path_in_medialib(filename)
+        wav_file = library.path(filename) if library.exists(filename) \
+            else path_in_medialib(filename)
         analyst = AudioAnalyst(wav_file, text)
         analysis = analyst.analyse()
-        image_maker = ImageMaker(analysis)
+        video_name = f"{filename}.mp4"
+        with library.atomic(video_name) as partial_path:
+            encode_parallel(analysis, wav_file, partial_path)
+        return library.path(video_name)
+
+    @classmethod
+    def preview(cls, analysis, videopath=None, contact_sheet=True):
+        """
+        Create a small preview of an analysis for reviews,
+        with a contact sheet of the whole path next to it.
+        The audio is the file the analysis was made from.
+        """
+        image_maker = ImageMaker.preview(analysis)
         pattern = image_maker.save_images()
+        image = ffmpeg.input(pattern, framerate=image_maker.framerate)
+        audio = audio_cache.open(image_maker.analysis.filename)
+        audio_pipe = cls.audio_pipe(audio.samplerate)
+        basename = os.path.splitext(
+            os.path.basename(image_maker.analysis.filename)
+        )[0]
+        name = f'{cls.PREVIEW_PREFIX}_{basename}'
+        filename = f'{name}{cls.TARGET_EXTENSION}'
+        if videopath:
+            cls.run(
+                ffmpeg.output(
+                    image, audio_pipe, videopath, **cls.PREVIEW_OUTDICT
+                ),
+                audio.signal()
+            )
+        else:
+            with library.atomic(filename) as partial_path:
+                cls.run(
+                    ffmpeg.output(
+                        image, audio_pipe, partial_path,
+                        **cls.PREVIEW_OUTDICT
+                    ),
+                    audio.signal()
+                )
+            videopath = library.path(filename)
+        image_maker.remove_targetdir()
+        if contact_sheet and videopath == library.path(filename):
+            with library.atomic(f'{name}.png') as partial_path:
+                image_maker.save_contact_sheet(partial_path)
+        elif contact_sheet:
+            image_maker.save_contact_sheet(
+                f'{os.path.splitext(videopath)[0]}.png'
+            )
+        return videopath
+
+    @staticmethod
+    def from_recording(filename, words=None, samplerate=12800):
+        """
+        Create a video for every word of a long recording.
+        The clips are analysed and piped to ffmpeg from memory.
+        """
+        wav_file = library.path(filename) if library.exists(filename) \
+            else path_in_medialib(filename)
         outdict = {
             'vcodec': 'h264',
             'shortest': None
         }
-        image = ffmpeg.input(pattern)
-        audio = ffmpeg.input(wav_file)
-        video_path = f"{wav_file}.mp4"
+        segmenter = Segmenter(samplerate)
+        audio = audio_cache.open(wav_file)
+        audio_pipe = VideoMaker.audio_pipe(audio.samplerate)
+        video_paths = []
+        for index, (clip, analysis) in enumerate(
+            segmenter.analyses(wav_file, words)
+        ):
+            image_maker = ImageMaker(analysis)
+            pattern = image_maker.save_images()
+            framerate = analysis.samplerate / analysis.hop
+            image = ffmpeg.input(pattern, framerate=framerate)
+            video_name = f'{filename}_{index + 1:04d}.mp4'
+            with library.atomic(video_name) as partial_path:
+                VideoMaker.run(
+                    ffmpeg.output(
+                        image, audio_pipe, partial_path, **outdict
+                    ),
+                    clip.cut(audio.signal(), audio.samplerate)
+                )
+            image_maker.remove_targetdir()
+            video_paths.append(library.path(video_name))
+        return video_paths
+
+
+class CompilationMaker:
+    """
+    Assemble a single video out of many words or phrases.
+    Every entry is encoded once as a segment and cached in the media
+    library, the compilation stream-copies the segments with the
+    concat demuxer.
+    """
+    SEGMENT_PREFIX = 'segment'
+    CONCAT_PREFIX = 'compilation'
+    FRAMERATE = 25
+    # Segments are concatenated without re-encoding:
+    # all of them must share the same codec parameters
+    SEGMENT_OUTDICT = {
+        'vcodec': 'libx264',
+        'pix_fmt': 'yuv420p',
+        'r': FRAMERATE,
+        'acodec': 'aac',
+        'ar': 44100,
+        'ac': 1,
+        'shortest': None,
+    }
+
+    def __init__(
+        self,
+        language='en-US',
+        rate=0.4,
+        voice_name='en-US-Wavenet-D',
+        registry=None
+    ):
+        """
+        registry is the TextToSpeechClients of the speaker
+        """
+        self.language = language
+        self.rate = rate
+        self.voice_name = voice_name
+        self.registry = registry
+        self.speaker = None
+
+    def segment_key(self, text):
+        """
+        Identify a segment by its text, voice and codec parameters
+        """
+        return library.key(
+            text,
+            self.language,
+            self.rate,
+            self.voice_name,
+            self.SEGMENT_OUTDICT
+        )
+
+    def segment_path(self, text):
+        key = self.segment_key(text)
+        return library.path(
+            f'{self.SEGMENT_PREFIX}_{key}{VideoMaker.TARGET_EXTENSION}'
+        )
+
+    def encode_segment(self, text, segment_path):
+        """
+        Create the segment of a single entry
+        """
+        if not self.speaker:
+            self.speaker = GoogleSpeaker(self.registry)
+        audio_filepath = self.speaker.speak(
+            text,
+            rate=self.rate,
+            language=self.language,
+            voice_name=self.voice_name
+        )
+        analysis = AudioAnalyst(audio_filepath, text).analyse()
+        image_maker = ImageMaker(analysis)
+        pattern = image_maker.save_images()
+        framerate = analysis.samplerate / analysis.hop
+        image = ffmpeg.input(pattern, framerate=framerate)
+        audio = audio_cache.open(audio_filepath)
+        audio_pipe = VideoMaker.audio_pipe(audio.samplerate)
+        # Encoded aside and renamed: a broken encode is never reused
+        with library.atomic(os.path.basename(segment_path)) as partial_path:
+            VideoMaker.run(
+                ffmpeg.output(
+                    image, audio_pipe, partial_path, **self.SEGMENT_OUTDICT
+                ),
+                audio.signal()
+            )
+        image_maker.remove_targetdir()
+        return segment_path
+
+    def segments(self, texts):
+        """
+        Return the segment paths, encoding only the missing ones
+        """
+        paths = []
+        for text in texts:
+            segment_path = self.segment_path(text)
+            if not os.path.exists(segment_path):
+                self.encode_segment(text, segment_path)
+            paths.append(segment_path)
+        return paths
+
+    @staticmethod
+    def write_concat_list(paths, list_path):
+        """
+        Write the list file read by the concat demuxer
+        """
+        with open(list_path, 'w') as list_file:
+            list_file.write('ffconcat version 1.0\n')
+            for path in paths:
+                escaped = os.path.abspath(path).replace("'", "'\\''")
+                list_file.write(f"file '{escaped}'\n")
+        return list_path
+
+    def make(self, texts, videopath=None):
+        """
+        Create the compilation of the texts in the given order
+        """
+        paths = self.segments(texts)
+        if videopath:
+            return self.concat(paths, videopath)
+        key = library.key(*paths)
+        filename = f'{self.CONCAT_PREFIX}_{key}{VideoMaker.TARGET_EXTENSION}'
+        with library.atomic(filename) as partial_path:
+            self.concat(paths, partial_path)
+        return library.path(filename)
+
+    def concat(self, paths, videopath):
+        """
+        Stream-copy the segments into a single video
+        """
+        list_path = self.write_concat_list(paths, f'{videopath}.ffconcat')
+        concat = ffmpeg.input(list_path, format='concat', safe=0)
         try:
-            ffmpeg.output(image, audio, video_path, **outdict).run(
-                capture_stdout=True,
-                capture_stderr=True
+            VideoMaker.run(
+                ffmpeg.output(
+                    concat, videopath, c='copy', movflags='+faststart'
+                ).overwrite_output()
             )
-        except ffmpeg.Error as e:
-            print('stdout:', e.stdout.decode('utf8'))
-            print('stderr:', e.stderr.decode('utf8'))
-            raise e
+        finally:
+            os.remove(list_path)
+        return videopath
 
 
 
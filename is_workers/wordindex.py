@@ -0,0 +1,259 @@
+"""
+Binary word frequency index of a language, built from the OpenSubtitles
+lists words/<lang>/<lang>_50k.txt and <lang>_ignored.txt.
+The file is memory-mapped: opening it reads only the header, lookups
+are binary searches over the sorted string table and processes on the
+same host share the pages through the page cache.
+
+Layout, little endian, arrays in this order after the header:
+    header      magic, version, words, ranked words, string table size
+    relevance   uint64[words]   word count in the corpus
+    offsets     uint32[words+1] string table offsets, sorted by bytes
+    ranks       uint32[words]   position in its list, 1 is most frequent
+    ignored     uint8[words]    1 for the words of the ignored list
+    by_rank     uint32[ranked]  sorted position of every rank, from 1
+    strings     utf8 words, sorted by bytes
+"""
+import bisect
+import mmap
+import os
+import struct
+from dataclasses import dataclass
+
+import numpy as np
+
+WORDS_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'words'
+)
+
+
+@dataclass(frozen=True)
+class WordEntry:
+    word: str
+    rank: int
+    relevance: int
+    ignored: bool
+
+
+class _Strings:
+    """
+    Sorted string table as a sequence of bytes, for bisect
+    """
+    def __init__(self, data, start, offsets):
+        self.data = data
+        self.start = start
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return self.data[
+            self.start + self.offsets[index]:
+            self.start + self.offsets[index + 1]
+        ]
+
+
+class WordIndex:
+    MAGIC = b'ISWI'
+    VERSION = 1
+    HEADER = struct.Struct('<4sIIII')
+    SUFFIX = '.wordindex'
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as fp:
+            self.mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.mmap) < self.HEADER.size:
+            raise ValueError(f'Not a word index: {path}')
+        magic, version, words, ranked, size = \
+            self.HEADER.unpack_from(self.mmap)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ValueError(f'Not a word index or old version: {path}')
+        offset = self.HEADER.size
+        arrays = {}
+        for name, dtype, count in self.arrays(words, ranked):
+            arrays[name] = np.frombuffer(
+                self.mmap, dtype=dtype, count=count, offset=offset
+            )
+            offset += arrays[name].nbytes
+        self.relevances = arrays['relevance']
+        self.ranks = arrays['ranks']
+        self.ignored = arrays['ignored']
+        self.by_rank = arrays['by_rank']
+        if offset + size > len(self.mmap):
+            raise ValueError(f'Truncated word index: {path}')
+        # a memoryview indexes faster than numpy in the binary search
+        offsets = arrays['offsets']
+        self.offsets = memoryview(offsets).cast('B').cast('I') \
+            if offsets.dtype.isnative else offsets
+        self.strings = _Strings(self.mmap, offset, self.offsets)
+
+    @staticmethod
+    def arrays(words, ranked):
+        return (
+            ('relevance', '<u8', words),
+            ('offsets', '<u4', words + 1),
+            ('ranks', '<u4', words),
+            ('ignored', 'u1', words),
+            ('by_rank', '<u4', ranked),
+        )
+
+    @staticmethod
+    def read_words(path):
+        """
+        Yield (word, relevance) of a list, "word count" per line
+        """
+        with open(path, encoding='utf8') as fp:
+            for line in fp:
+                word, _, relevance = line.strip().rpartition(' ')
+                if word:
+                    yield word, int(relevance)
+
+    @classmethod
+    def corpus_paths(cls, lang, words_path=WORDS_PATH):
+        folder = os.path.join(words_path, lang)
+        return (
+            os.path.join(folder, f'{lang}_50k.txt'),
+            os.path.join(folder, f'{lang}_ignored.txt'),
+            os.path.join(folder, f'{lang}{cls.SUFFIX}'),
+        )
+
+    @classmethod
+    def write(cls, path, words, ignored=()):
+        """
+        Write the index of word lists in rank order,
+        both lists yield (word, relevance)
+        """
+        entries = {}
+        for is_ignored, items in ((0, ignored), (1, words)):
+            for rank, (word, relevance) in enumerate(items, 1):
+                # a word of both lists is a ranked word
+                entries[word.encode('utf8')] = (relevance, rank, is_ignored)
+        keys = sorted(entries)
+        values = np.array(
+            [entries[key] for key in keys], dtype=np.uint64
+        ).reshape(-1, 3)
+        is_word = values[:, 2] == 1
+        lengths = np.fromiter((len(key) for key in keys), np.uint32, len(keys))
+        offsets = np.zeros(len(keys) + 1, dtype='<u4')
+        np.cumsum(lengths, out=offsets[1:])
+        by_rank = np.empty(np.count_nonzero(is_word), dtype='<u4')
+        by_rank[values[is_word, 1].astype(np.int64) - 1] = \
+            np.flatnonzero(is_word)
+        strings = b''.join(keys)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as fp:
+            fp.write(cls.HEADER.pack(
+                cls.MAGIC, cls.VERSION, len(keys), by_rank.size, len(strings)
+            ))
+            fp.write(values[:, 0].astype('<u8').tobytes())
+            fp.write(offsets.tobytes())
+            fp.write(values[:, 1].astype('<u4').tobytes())
+            fp.write((1 - values[:, 2]).astype('u1').tobytes())
+            fp.write(by_rank.tobytes())
+            fp.write(strings)
+        # readers keep the pages of the file they mapped
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def build(cls, lang, words_path=WORDS_PATH):
+        """
+        Compile the word lists of a language next to them
+        """
+        words_file, ignored_file, index_file = \
+            cls.corpus_paths(lang, words_path)
+        ignored = cls.read_words(ignored_file) \
+            if os.path.exists(ignored_file) else ()
+        return cls.write(index_file, cls.read_words(words_file), ignored)
+
+    @classmethod
+    def open(cls, lang, words_path=WORDS_PATH):
+        return cls(cls.corpus_paths(lang, words_path)[2])
+
+    def close(self):
+        if isinstance(self.offsets, memoryview):
+            self.offsets.release()
+        self.strings = self.offsets = None
+        self.relevances = self.ranks = self.ignored = self.by_rank = None
+        self.mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self.strings)
+
+    def __contains__(self, word):
+        return self.find(word) is not None
+
+    def entry(self, position):
+        return WordEntry(
+            self.strings[position].decode('utf8'),
+            int(self.ranks[position]),
+            int(self.relevances[position]),
+            bool(self.ignored[position]),
+        )
+
+    def find(self, word):
+        """
+        Sorted position of a word, None if it is not indexed
+        """
+        key = word.encode('utf8')
+        position = bisect.bisect_left(self.strings, key)
+        if position < len(self.strings) and self.strings[position] == key:
+            return position
+        return None
+
+    def lookup(self, word):
+        position = self.find(word)
+        return None if position is None else self.entry(position)
+
+    def rank(self, word):
+        position = self.find(word)
+        return None if position is None else int(self.ranks[position])
+
+    def relevance(self, word):
+        position = self.find(word)
+        return None if position is None else int(self.relevances[position])
+
+    def ranked(self, start=1, stop=None):
+        """
+        Words of the ranks start to stop excluded, most frequent first
+        """
+        stop = len(self.by_rank) + 1 if stop is None else stop
+        positions = self.by_rank[max(start, 1) - 1:max(stop, 1) - 1]
+        return [self.entry(position) for position in positions]
+
+
+class WordIndexes:
+    """
+    Open indexes by language, shared by the objects of a process
+    """
+    def __init__(self, words_path=WORDS_PATH):
+        self.words_path = words_path
+        self.indexes = {}
+
+    def __getitem__(self, lang):
+        if lang not in self.indexes:
+            self.indexes[lang] = WordIndex.open(lang, self.words_path)
+        return self.indexes[lang]
+
+    def clear(self):
+        for index in self.indexes.values():
+            index.close()
+        self.indexes = {}
+
+
+word_indexes = WordIndexes()
+
+
+def available_languages(words_path=WORDS_PATH):
+    return sorted(
+        lang for lang in os.listdir(words_path)
+        if os.path.exists(WordIndex.corpus_paths(lang, words_path)[0])
+    )
@@ -1,17 +1,153 @@
+"""
+Worker entry points.
+Every command imports only what it needs:
+analysing does not load cairo, rendering does not load aubio,
+Django is only set up by the commands using the database.
+"""
+import argparse
 import os
-import django
-from is_app.models import Language, Word
+import sys
 
-os.environ.setdefault("DJANGO_SETTINGS_MODULE", "is_project.settings")
-django.setup()
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_django():
+    if BASE_DIR not in sys.path:
+        sys.path.append(BASE_DIR)
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "is_project.settings")
+    import django
+    django.setup()
 
 
 class WordImporter:
+    @staticmethod
     def run(lang):
         """
         lang is a tuple (language code, language name)
         """
+        setup_django()
+        from is_app.models import Language
         language = Language.objects.get_or_create(
             code=lang[0],
             name=lang[1]
-        )
\ No newline at end of file
+        )
+        return language
+
+
+def analyse(wav_path, title, json_path=None):
+    """
+    Analyse an audio file and save the analysis,
+    by default next to the audio in the library as <name>.json
+    """
+    from audio import AudioAnalyst
+    from medialib import library
+    if json_path is None:
+        stem = os.path.splitext(os.path.basename(wav_path))[0]
+        json_path = library.path(f'{stem}.json')
+        os.makedirs(os.path.dirname(json_path), exist_ok=True)
+    analysis = AudioAnalyst(wav_path, title).analyse()
+    analysis.save(json_path)
+    library.mark_analysed(wav_path, json_path)
+    return analysis
+
+
+def clean(json_paths, min_confidence=None):
+    """
+    Post-process saved analyses in one batch, in place
+    """
+    from medialib import library
+    from models import PitchAnalysis
+    from postprocess import PitchPostProcessor
+    post_processor = PitchPostProcessor() if min_confidence is None \
+        else PitchPostProcessor(min_confidence)
+    analyses = post_processor.process_many(
+        [PitchAnalysis.load(json_path) for json_path in json_paths]
+    )
+    for analysis, json_path in zip(analyses, json_paths):
+        analysis.save(json_path)
+        library.mark_analysed(analysis.filename, json_path)
+    return analyses
+
+
+def render(json_path, targetdir=None):
+    """
+    Render the frames of a saved analysis
+    """
+    from image import ImageMaker
+    return ImageMaker.from_filepath(json_path).save_images(targetdir)
+
+
+def preview(json_paths):
+    """
+    Preview videos and contact sheets of saved analyses
+    """
+    from models import PitchAnalysis
+    from video import VideoMaker
+    return [
+        VideoMaker.preview(PitchAnalysis.load(json_path))
+        for json_path in json_paths
+    ]
+
+
+def catalogue(json_paths, lang, voice=''):
+    """
+    Add saved analyses to the catalogue of the database
+    """
+    setup_django()
+    from is_app.catalogue import record
+    from is_app.models import Language
+    from models import PitchAnalysis
+    language = Language.objects.get_or_create(code=lang)[0]
+    return [
+        record(PitchAnalysis.load(json_path), language, voice)
+        for json_path in json_paths
+    ]
+
+
+def index_words(langs=None, words_path=None):
+    """
+    Compile the word lists into the memory-mapped word indexes
+    """
+    from wordindex import WORDS_PATH, WordIndex, available_languages
+    words_path = words_path or WORDS_PATH
+    return [
+        WordIndex.build(lang, words_path)
+        for lang in langs or available_languages(words_path)
+    ]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command', required=True)
+    analyse_parser = commands.add_parser('analyse')
+    analyse_parser.add_argument('wav_path')
+    analyse_parser.add_argument('title')
+    analyse_parser.add_argument('json_path', nargs='?')
+    clean_parser = commands.add_parser('clean')
+    clean_parser.add_argument('json_paths', nargs='+')
+    clean_parser.add_argument('--min-confidence', type=float)
+    preview_parser = commands.add_parser('preview')
+    preview_parser.add_argument('json_paths', nargs='+')
+    render_parser = commands.add_parser('render')
+    render_parser.add_argument('json_path')
+    render_parser.add_argument('--targetdir')
+    catalogue_parser = commands.add_parser('catalogue')
+    catalogue_parser.add_argument('lang')
+    catalogue_parser.add_argument('json_paths', nargs='+')
+    catalogue_parser.add_argument('--voice', default='')
+    index_parser = commands.add_parser('index_words')
+    index_parser.add_argument('langs', nargs='*', help='all if none')
+    index_parser.add_argument('--words-path')
+    args = parser.parse_args()
+    if args.command == 'analyse':
+        analyse(args.wav_path, args.title, args.json_path)
+    elif args.command == 'clean':
+        clean(args.json_paths, args.min_confidence)
+    elif args.command == 'preview':
+        print('\n'.join(preview(args.json_paths)))
+    elif args.command == 'catalogue':
+        catalogue(args.json_paths, args.lang, args.voice)
+    elif args.command == 'index_words':
+        print('\n'.join(index_words(args.langs, args.words_path)))
+    else:
+        print(render(args.json_path, args.targetdir))